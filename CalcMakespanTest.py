@@ -1,4 +1,26 @@
-from calc_makespan import calc_makespan, PipelineTask
+from concurrent.futures import ProcessPoolExecutor
+from random import sample
+
+import numpy as np
+
+from branch_and_bound import branch_and_bound_order
+from calc_makespan import calc_makespan, calc_makespan_batch, calc_schedule, CheckpointedSchedule, CompiledPipeline, \
+    PipelineTask, SimulationStats
+from calibration import AmdahlModel, calibrate, calibrated_tasks, RunRecord
+from cluster import calc_cluster_makespan, Node
+from dispatch import DispatchPolicy
+from GA_optimize_both import GA_both
+from GA_optimize_cluster import GA_cluster
+from GA_optimize_file_order_only import crossover_batch, GA_file_order, mutate_batch, order_positions
+from GA_optimize_islands import GA_islands, migrate
+from GA_optimize_task_cpus_only import GA_cpus
+from heuristics import best_heuristic, heuristic_orders
+from lower_bounds import lower_bound
+from makespan_cache import MakespanCache
+from online import OnlineScheduler
+from run_control import BackgroundRun, RunControl
+from simulated_annealing import joint_annealing
+from time_brute import brute_force, brute_force_order, distinct_permutations
 
 
 def main():
@@ -77,8 +99,8 @@ def main():
 
     Stuck in loop, program does not finish
 
-    - Fixed. Returns -1 when step order is missing a step or step value 
-    repeats.
+    - Fixed. Returns -1 when step order is missing a step. Tasks repeating a
+    step run side by side, see DAG pipelines.
     """
     task_a = PipelineTask(name="Task A", step=0, time_factor=2,
                           space_factor=1, cpus=2)
@@ -124,5 +146,429 @@ def main():
                                tasks=[task_a])
 
 
+    """
+    Jobs that take no time (e.g. a small file split over many CPUs)
+    Finished jobs were counted again when another job ended at the same time
+    point, giving back their resources twice.
+
+    -   Fixed by keeping running jobs in a heap and finishing each job once.
+    """
+    task_a = PipelineTask(name="Task A", step=0, time_factor=1,
+                          space_factor=1, cpus=4)
+    task_b = PipelineTask(name="Task B", step=1, time_factor=2,
+                          space_factor=1, cpus=2)
+    assert 3 == calc_makespan([1, 1, 3],
+                              max_memory=32,
+                              max_cpus=8,
+                              tasks=[task_a, task_b])
+
+    """
+    Batch evaluation
+    Every candidate gets the makespan calc_makespan gives it, and -1 where
+    calc_makespan returns -1.
+    """
+    task_a = PipelineTask(name="A", step=0, time_factor=6,
+                          space_factor=1,
+                          cpus=4)
+    task_b = PipelineTask(name="B", step=1, time_factor=4,
+                          space_factor=2,
+                          cpus=6)
+    task_c = PipelineTask(name="C", step=2, time_factor=8,
+                          space_factor=1,
+                          cpus=8)
+    makespans = calc_makespan_batch(file_orders=[[2, 4, 6, 8],
+                                                 [8, 6, 4, 2],
+                                                 [2, 4, 6, 8]],
+                                    cpu_assignments=[[4, 6, 8],
+                                                     [4, 6, 8],
+                                                     [4, 6, 17]],
+                                    max_memory=32,
+                                    max_cpus=16,
+                                    tasks=[task_a, task_b, task_c])
+    assert [27, calc_makespan([8, 6, 4, 2], max_memory=32, max_cpus=16,
+                              tasks=[task_a, task_b, task_c]), -1] == \
+        makespans.tolist()
+
+    """
+    Compiled pipeline
+    Reordering files and reassigning CPUs reuses the precomputed tables and
+    gives the same makespans as calc_makespan.
+    """
+    pipeline = CompiledPipeline(file_sizes=[2, 4, 6, 8],
+                                tasks=[task_a, task_b, task_c],
+                                max_cpus=16,
+                                max_memory=32)
+    assert 27 == pipeline.makespan([2, 4, 6, 8])
+    assert makespans.tolist() == [pipeline.makespan([2, 4, 6, 8], [4, 6, 8]),
+                                  pipeline.makespan([8, 6, 4, 2]),
+                                  pipeline.makespan([2, 4, 6, 8], [4, 6, 17])]
+    assert makespans.tolist() == pipeline.makespan_batch(
+        [[2, 4, 6, 8], [8, 6, 4, 2], [2, 4, 6, 8]],
+        [[4, 6, 8], [4, 6, 8], [4, 6, 17]]).tolist()
+
+    task_a = PipelineTask(name="Task A", step=0, time_factor=2,
+                          space_factor=1, cpus=2)
+    task_c = PipelineTask(name="Task C", step=2, time_factor=2,
+                          space_factor=1, cpus=2)
+    assert -1 == CompiledPipeline([10, 10, 20], [task_a, task_c],
+                                  max_cpus=32, max_memory=32).makespan(
+        [10, 20, 10])
+
+    """
+    Checkpointed schedule
+    Swaps restarted from a checkpoint give the same makespans as simulating
+    the swapped order from the start.
+    """
+    file_sizes = [5, 12, 3, 9, 7, 12, 2, 8]
+    pipeline = CompiledPipeline(file_sizes, [task_a, task_b, task_c],
+                                max_cpus=16, max_memory=32)
+    schedule = CheckpointedSchedule(pipeline, file_sizes, spacing=1)
+    assert schedule.makespan == pipeline.makespan(file_sizes)
+    for i, j in [(6, 7), (2, 5), (0, 7), (4, 4)]:
+        swapped = file_sizes.copy()
+        swapped[i], swapped[j] = swapped[j], swapped[i]
+        assert schedule.swap_makespan(i, j) == pipeline.makespan(swapped)
+        assert schedule.swap(i, j) == pipeline.makespan(swapped)
+        file_sizes = swapped
+
+    """
+    Makespan cache
+    A schedule is looked up by a digest of its order whether it comes as a
+    list or an array, the least recently used schedule is evicted once the
+    cache is full, and batches give the same makespans as simulating.
+    """
+    orders = [file_sizes, file_sizes[::-1], sorted(file_sizes)]
+    cache = MakespanCache(pipeline, maxsize=2)
+    assert cache.makespan(orders[0]) == cache.makespan(np.array(orders[0])) == pipeline.makespan(orders[0])
+    cache.makespan(orders[1])
+    cache.makespan(orders[0])
+    cache.makespan(orders[2])  # evicts orders[1], used less recently than orders[0]
+    cache.makespan(orders[0])
+    assert cache.cache_info() == (3, 3, 2, 2)
+    cache.makespan(orders[1])
+    assert cache.cache_info() == (3, 4, 2, 2)
+    cache = MakespanCache(pipeline)
+    cpus = [[4, 6, 8], [2, 2, 2], [16, 1, 4], [4, 6, 17]]
+    expected = [pipeline.makespan(order, order_cpus) for order, order_cpus in zip(orders + orders[:1], cpus)]
+    assert cache.makespan_batch(orders + orders[:1], cpus) == expected
+    assert cache.makespan_batch(np.array(orders + orders[:1]), np.array(cpus)) == expected
+    assert cache.cache_info() == (4, 4, 100000, 4)
+
+    """
+    CPU assignment passed as an argument
+    The tasks list keeps its order and the tasks keep their CPUs, so the
+    same tasks can be evaluated concurrently.
+    """
+    task_a = PipelineTask(name="A", step=0, time_factor=4,
+                          space_factor=1,
+                          cpus=1)
+    task_b = PipelineTask(name="B", step=1, time_factor=6,
+                          space_factor=1,
+                          cpus=1)
+    tasks = [task_b, task_a]
+    assert 30 == calc_makespan(file_sizes=[20, 10, 10],
+                               max_memory=32,
+                               max_cpus=20,
+                               tasks=tasks,
+                               cpu_assignment=(12, 8))
+    assert tasks == [task_b, task_a]
+    assert task_a.cpus == 1 and task_b.cpus == 1
+
+    """
+    Branch and bound
+    Finds the same optimal makespan as brute force.
+    """
+    task_c = PipelineTask(name="C", step=2, time_factor=2,
+                          space_factor=2,
+                          cpus=4)
+    for file_sizes in ([7, 3, 12, 5, 9], [14, 2, 2, 11, 6, 8]):
+        assert brute_force_order(file_sizes, 32, 16, [task_a, task_b, task_c])[0] == \
+            branch_and_bound_order(file_sizes, 32, 16, [task_a, task_b, task_c])[0]
+
+    """
+    Distinct permutations
+    Orders that only swap files of the same size are generated once.
+    """
+    assert [(2, 2, 5), (2, 5, 2), (5, 2, 2)] == \
+        list(distinct_permutations([5, 2, 2]))
+
+    """
+    Joint annealing
+    Finds the optimal order and CPUs of a small pipeline, and reports the
+    makespan of the schedule it returns.
+    """
+    file_sizes = [7, 3, 12, 5, 9]
+    makespan, (order, cpus) = joint_annealing(file_sizes, 32, 8, [task_a, task_b], max_evaluations=2000,
+                                              restarts=4, seed=0)
+    assert brute_force(file_sizes, 32, 8, [task_a, task_b])[0] == makespan
+    assert makespan == calc_makespan(order, 32, 8, [task_a, task_b], cpus)
+
+    """
+    Joint annealing budget
+    The moves that set the starting temperature count against the evaluation
+    budget, so a budget smaller than an epoch isn't overrun.
+    """
+    control = RunControl()
+    joint_annealing(file_sizes, 32, 8, [task_a, task_b], max_evaluations=3, epoch=10, seed=0, control=control)
+    assert control.evaluations == 3
+
+    """
+    Run control
+    A search stops once its evaluation budget is used and returns the best
+    schedule it found, which is also streamed while it runs.
+    """
+    control = RunControl(max_evaluations=10)
+    makespan, params = brute_force(file_sizes, 32, 8, [task_a, task_b], control=control)
+    assert control.stop_reason == "evaluations" and control.evaluations == 10
+    assert (makespan, params) == control.best()
+
+    run = BackgroundRun(brute_force, file_sizes, 32, 8, [task_a, task_b], control=RunControl(patience=20))
+    improvements = list(run.improvements())
+    assert run.result() == improvements[-1] == run.best()
+    assert [makespan for makespan, params in improvements] == \
+        sorted({makespan for makespan, params in improvements}, reverse=True)
+    assert run.control.stop_reason == "stalled"
+
+    """
+    Lower bound
+    No schedule beats the bound, and a search stops as soon as it reaches
+    it since the schedule it found is then optimal.
+    """
+    assert lower_bound(file_sizes, 32, 8, [task_a, task_b], any_cpus=True) <= \
+        brute_force(file_sizes, 32, 8, [task_a, task_b])[0]
+    control = RunControl()
+    makespan, order = brute_force_order(file_sizes, 32, 8, [task_a, task_b], control=control)
+    assert makespan == lower_bound(file_sizes, 32, 8, [task_a, task_b]) == control.lower_bound
+    assert control.stop_reason == "optimal" and control.gap() == 0
+
+    """
+    Heuristics
+    Each heuristic orders every file once, and the best of them is kept.
+    """
+    file_sizes = [14, 2, 2, 11, 6, 8, 30, 5]
+    orders = heuristic_orders(file_sizes, 32, 16, [task_a, task_b, task_c])
+    for order in orders.values():
+        assert sorted(order) == sorted(file_sizes)
+    makespan, order = best_heuristic(file_sizes, 32, 16, [task_a, task_b, task_c])
+    assert makespan == calc_makespan(order, 32, 16, [task_a, task_b, task_c]) == \
+        min(calc_makespan(order, 32, 16, [task_a, task_b, task_c]) for order in orders.values())
+    cpus = [task.cpus for task in [task_a, task_b, task_c]]
+    assert best_heuristic(file_sizes, 32, 16, [task_a, task_b, task_c], np.array(cpus)) == \
+        best_heuristic(file_sizes, 32, 16, [task_a, task_b, task_c], cpus) == (makespan, order)
+
+    """
+    Heuristic selection
+    NEH, which simulates every insertion, is only used by default for small
+    instances, and any heuristics can be picked by name.
+    """
+    assert list(orders) == ["Johnson", "LPT", "SPT", "NEH"]
+    assert list(heuristic_orders(file_sizes * 10, 32, 16, [task_a, task_b, task_c])) == ["Johnson", "LPT", "SPT"]
+    orders = heuristic_orders(file_sizes, 32, 16, [task_a, task_b, task_c], heuristics=["NEH"])
+    assert list(orders) == ["NEH"]
+    assert best_heuristic(file_sizes, 32, 16, [task_a, task_b, task_c], heuristics=["NEH"])[1] == orders["NEH"]
+    try:
+        heuristic_orders(file_sizes, 32, 16, [task_a, task_b, task_c], heuristics=["Random"])
+        assert False
+    except Exception as e:
+        assert str(e).startswith("Unknown heuristic Random")
+
+    """
+    Island migration
+    The best individuals of each island replace the worst of the next
+    island on the ring, impossible schedules counting as the worst.
+    """
+    populations = [[[[island, i], [1]] for i in range(3)] for island in range(3)]
+    scores = [[5, 3, -1], [7, 9, 8], [4, 6, 2]]
+    migrate(populations, scores, 1, "ring", None)
+    assert [[individual[0] for individual in pop] for pop in populations] == \
+        [[[0, 0], [0, 1], [2, 2]], [[1, 0], [0, 1], [1, 2]], [[2, 0], [1, 0], [2, 2]]]
+    assert scores == [[5, 3, 2], [7, 3, 8], [4, 7, 2]]
+
+    """
+    Vectorized GA operators
+    Orders are kept as positions of the files, so crossing over and
+    mutating a whole population keeps every order a rearrangement of the
+    files even when some have the same size.
+    """
+    file_sizes = [14, 2, 2, 11, 6, 2]
+    assert order_positions(file_sizes, [2, 6, 2, 14, 2, 11]) == [1, 4, 2, 0, 5, 3]
+    pop = np.array([order_positions(file_sizes, sample(file_sizes, 6)) for x in range(20)])
+    children1, children2 = crossover_batch(pop[0::2], pop[1::2], 1)
+    mutate_batch(children1, 0.5)
+    for child in np.concatenate([children1, children2]):
+        assert sorted(np.array(file_sizes)[child]) == sorted(file_sizes)
+    assert (children2[:, 0] == pop[1::2, 0]).all()
+
+    """
+    Parallel evaluation
+    Workers only score individuals, so a seeded GA finds the same schedule
+    in this process, with its own pool of workers and with a pool it is
+    given, which it leaves running.
+    """
+    tasks = [task_a, task_b, task_c]
+    with ProcessPoolExecutor(2) as executor:
+        for GA, args in ((GA_both, (0.9, 0.2)), (GA_file_order, ()), (GA_cpus, ())):
+            results = [GA(file_sizes, 32, 16, tasks, 5, 10, *args, seed=3, **parallel)
+                       for parallel in ({}, {"workers": 2}, {"executor": executor})]
+            assert results[0] == results[1] == results[2]
+        assert executor.submit(abs, -1).result() == 1
+
+    """
+    Island model
+    A seeded run finds the same schedule again and with workers, keeps
+    every file though some have the same size, and is never worse than the
+    heuristic orders it starts from, also with two tasks to a schedule and
+    an odd number of individuals on each island.
+    """
+    for island_tasks, pop_size in ((tasks, 6), ([task_a, task_b], 6), (tasks, 5)):
+        results = [GA_islands(file_sizes, 32, 16, island_tasks, 6, pop_size, 0.9, 0.2, islands=3,
+                              migration_interval=2, seed=4, heuristic_seeds=True, **parallel)
+                   for parallel in ({}, {}, {"workers": 2})]
+        assert results[0] == results[1] == results[2]
+        makespan, (order, cpus) = results[0]
+        assert sorted(order) == sorted(file_sizes) and makespan == calc_makespan(order, 32, 16, island_tasks, cpus)
+        cpus = [min(task.cpus, 16) for task in island_tasks]
+        assert makespan <= min(calc_makespan(order, 32, 16, island_tasks, cpus)
+                               for order in heuristic_orders(file_sizes, 32, 16, island_tasks, cpus).values())
+
+    """
+    Simulation stats
+    Every job is admitted and finishes once, whether the schedule is
+    simulated on its own or in a batch, and stats add up over evaluations.
+    """
+    file_sizes = [14, 2, 2, 11, 6, 8, 30, 5]
+    stats = SimulationStats()
+    makespan = calc_makespan(file_sizes, 64, 16, [task_a, task_b, task_c], stats=stats)
+    assert makespan > 0 and stats.evaluations == 1 and stats.admitted == stats.finished == 3 * len(file_sizes)
+    assert 0 < stats.events <= stats.finished
+    pipeline = CompiledPipeline(file_sizes, [task_a, task_b, task_c], 16, 64)
+    pipeline.stats = SimulationStats()
+    assert pipeline.makespan_batch([file_sizes, file_sizes])[0] == pipeline.makespan(file_sizes) == makespan
+    assert pipeline.stats.evaluations == 3 and pipeline.stats.finished == 3 * stats.finished
+    assert stats.merge(pipeline.stats).evaluations == 4
+
+    # Two jobs of 8 CPUs start at once, each found by reading the root and one
+    # leaf of a tree of two files, and each step checks once more than it
+    # starts jobs, reading the root unless the CPUs are used up
+    stats = SimulationStats()
+    calc_makespan([5, 6], 64, 16, [PipelineTask(name="A", step=0, time_factor=4, space_factor=1, cpus=8)],
+                  stats=stats)
+    assert (stats.admission_checks, stats.scanned) == (5, 6)
+
+    """
+    Schedule trace
+    Every job runs for its duration after the previous step of its file,
+    the last one ends at the makespan and the machine is never overused.
+    """
+    trace = calc_schedule(file_sizes, 64, 16, [task_a, task_b, task_c])
+    assert trace.makespan == makespan == trace.end.max() and len(trace) == 3 * len(file_sizes)
+    for position, step, start in zip(trace.sample, trace.step, trace.start):
+        assert step == 0 or start >= trace.end[(trace.sample == position) & (trace.step == step - 1)][0]
+    times, cpus_used, memory_used = trace.utilization()
+    assert cpus_used.max() <= 16 and memory_used.max() <= 64 and cpus_used[-1] == memory_used[-1] == 0
+
+    """
+    Cluster
+    One node runs the pipeline as calc_makespan does, two nodes split the
+    files between them, and a file moving to another node between steps
+    waits for the transfer.
+    """
+    tasks = [task_a, task_b, task_c]
+    assert calc_cluster_makespan(file_sizes, [Node("a", 16, 64)], tasks) == makespan
+    nodes = [Node("a", 16, 64), Node("b", 16, 64)]
+    assert calc_cluster_makespan(file_sizes + file_sizes, nodes, tasks,
+                                 placement=[[0] * 3] * len(file_sizes) + [[1] * 3] * len(file_sizes)) == makespan
+    assert calc_cluster_makespan([10], nodes, tasks, placement=[[0, 0, 0]]) == \
+        calc_cluster_makespan([10], nodes, tasks, placement=[[0, 1, 1]]) == \
+        calc_cluster_makespan([10], nodes, tasks, placement=[[0, 1, 1]], transfer_factor=2) - 20
+    assert calc_cluster_makespan([30], [Node("a", 16, 64), Node("b", 16, 32)], tasks, placement=[[0, 0, 1]]) == -1
+    best_makespan, best_params = GA_cluster(file_sizes, nodes, tasks, rounds=5, pop_size=10, crossover_rate=0.9,
+                                            mutation_rate=0.1, transfer_factor=1, seed=1)
+    assert best_makespan == calc_cluster_makespan(*best_params[:1], nodes, tasks, *best_params[1:],
+                                                  transfer_factor=1) > 0
+
+    """
+    Online scheduling
+    Files arriving together start as calc_makespan would start them, and
+    files arriving over time never start before they arrive or before the
+    previous step of their file ends.
+    """
+    scheduler = OnlineScheduler(64, 16, tasks, horizon=0)
+    for file_size in file_sizes:
+        scheduler.submit(file_size, 0)
+    scheduler.finish()
+    assert scheduler.makespan == makespan
+    scheduler = OnlineScheduler(64, 16, tasks, horizon=4, time_budget=None, max_evaluations=20, seed=1)
+    dispatches = []
+    for release_time, file_size in zip(range(0, 80, 10), file_sizes):
+        dispatches += scheduler.submit(file_size, release_time)
+    dispatches += scheduler.finish()
+    assert len(dispatches) == 3 * len(file_sizes) and scheduler.makespan == max(job.end for job in dispatches)
+    ends = {}
+    for job in sorted(dispatches, key=lambda job: job.start):
+        assert job.start >= scheduler.release_times[job.sample] and job.start >= ends.get((job.sample, job.step - 1), 0)
+        ends[(job.sample, job.step)] = job.end
+
+    """
+    DAG pipelines
+    Naming the previous step as a predecessor is the same chain, tasks in the
+    same step run side by side for a file and join before the next step, and
+    a predecessor that doesn't exist or isn't earlier is invalid.
+    """
+    chain = [PipelineTask(name=task.name, step=task.step, time_factor=task.time_factor,
+                          space_factor=task.space_factor, cpus=task.cpus,
+                          predecessors=[tasks[task.step - 1].name] if task.step else None) for task in tasks]
+    assert calc_makespan(file_sizes, 64, 16, chain) == makespan
+    trim = PipelineTask(name="trim", step=0, time_factor=4, space_factor=1, cpus=8)
+    qc = PipelineTask(name="qc", step=1, time_factor=6, space_factor=1, cpus=8)
+    align = PipelineTask(name="align", step=1, time_factor=8, space_factor=2, cpus=8)
+    report = PipelineTask(name="report", step=2, time_factor=2, space_factor=1, cpus=4)
+    dag = [report, align, trim, qc]
+    assert calc_makespan([16], 64, 32, dag) == 8 + max(12, 16) + 8
+    assert calc_makespan([16], 64, 32, dag, cpu_assignment=[4, 8, 8, 16]) == 8 + max(12, 16) + 8
+    late = PipelineTask(name="late", step=1, time_factor=1, space_factor=1, cpus=1, predecessors=["align"])
+    missing = PipelineTask(name="late", step=2, time_factor=1, space_factor=1, cpus=1, predecessors=["none"])
+    assert calc_makespan([16], 64, 32, dag + [late]) == calc_makespan([16], 64, 32, dag + [missing]) == -1
+    pipeline = CompiledPipeline(file_sizes, dag, 32, 128)
+    orders = [sample(file_sizes, len(file_sizes)) for x in range(3)]
+    assert pipeline.makespan_batch(orders).tolist() == [calc_makespan(order, 128, 32, dag) for order in orders]
+    assert 0 < lower_bound(file_sizes, 128, 32, dag) <= pipeline.makespan(file_sizes)
+
+    """
+    Dispatch policies
+    Step order starting every job that fits is what calc_makespan does, and
+    every order and backfilling keeps within the machine and starts no job
+    before the jobs it waits for end.
+    """
+    assert calc_makespan(file_sizes, 64, 16, tasks, policy=DispatchPolicy()) == makespan
+    assert calc_makespan(file_sizes, 128, 32, dag, policy=DispatchPolicy()) == pipeline.makespan(file_sizes)
+    for policy in [DispatchPolicy(order, backfill) for order in DispatchPolicy.ORDERS
+                   for backfill in DispatchPolicy.BACKFILLS]:
+        trace = calc_schedule(file_sizes, 128, 32, dag, policy=policy)
+        assert trace.makespan == calc_makespan(file_sizes, 128, 32, dag, policy=policy) >= \
+            lower_bound(file_sizes, 128, 32, dag)
+        for t in trace.start:
+            running = (trace.start <= t) & (trace.end > t)
+            assert trace.cpus[running].sum() <= 32 and trace.memory[running].sum() <= 128
+        ends = {(file, step): end for file, step, end in zip(trace.sample, trace.step, trace.end)}
+        for file, step, start in zip(trace.sample, trace.step, trace.start):
+            assert all(ends[(file, before)] <= start for before in pipeline.predecessors[step])
+
+    """
+    Calibration
+    Runs that follow Amdahl's law are fitted by an Amdahl model, which plans
+    durations within a time unit of what the runs took and enough memory for
+    every file.
+    """
+    amdahl = AmdahlModel(serial_fraction=0.25)
+    records = [RunRecord("A", size, cpus, amdahl(size, 4, cpus), 2 * size) for size in (5, 10, 20, 40)
+               for cpus in (1, 2, 4, 8, 16)]
+    calibration = calibrate(records)["A"]
+    assert isinstance(calibration.time_model, AmdahlModel) and abs(calibration.time_model.serial_fraction - 0.25) < 0.01
+    task = calibrated_tasks(tasks, {"A": calibration}, file_sizes)[0]
+    assert all(abs(task.parallel_func(record.file_size, task.time_factor, record.cpus) - record.wall_time) <= 1
+               for record in records)
+    assert task.space_factor == 2 and task.step == tasks[0].step and calibrated_tasks(tasks, {}, file_sizes) == tasks
+
 if __name__ == '__main__':
     main()
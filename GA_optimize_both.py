@@ -1,9 +1,21 @@
 from numpy.random import randint
 from numpy.random import rand
+from numpy.random import seed as numpy_seed
 from random import sample
+from random import seed as random_seed
 from math import inf
-
-from calc_makespan import calc_makespan, PipelineTask
+from contextlib import nullcontext
+from itertools import count
+
+import numpy as np
+
+from calc_makespan import calc_makespan, CompiledPipeline, PipelineTask
+from heuristics import heuristic_orders
+from lower_bounds import pipeline_lower_bound
+from makespan_cache import MakespanCache
+from parallel_evaluation import PoolEvaluator
+from progress import diversity, round_stats, ProgressLog
+from run_control import RunControl
 import GA_optimize_task_cpus_only as GA_cpus
 import GA_optimize_file_order_only as GA_order
 from time_brute import brute_force
@@ -25,7 +37,8 @@ def main():
                                          rounds=1000,
                                          pop_size=100,
                                          crossover_rate=0.9,
-                                         mutation_rate=0.2)
+                                         mutation_rate=0.2,
+                                         verbose=True)
 
     opt_makespan, opt_params = brute_force(file_sizes=[22, 52, 45, 30],
                                            max_memory=200,
@@ -81,30 +94,66 @@ def mutate(individual, max_cpus, mutation_rate):
     GA_cpus.mutate(individual[1], max_cpus, mutation_rate)
 
 
+def crossover_batch(orders1, cpus1, orders2, cpus2, crossover_rate):
+    """
+    Perform a crossover event between each pair of parents at once, with frequency proportional to the given
+    crossover rate, the same as calling crossover on each pair. Parents are split into their file orders, as
+    permutations of the positions of the files (see GA_optimize_file_order_only.order_positions), and their CPUs.
+
+    :param orders1: the file order of the first parent of each pair, one per row; numpy array of int
+    :param cpus1: the CPU assignment of the first parent of each pair; numpy array of int
+    :param orders2: the file order of the second parent of each pair; numpy array of int
+    :param cpus2: the CPU assignment of the second parent of each pair; numpy array of int
+    :param crossover_rate: the rate at which crossover events should occur; float
+    :return: the file orders and CPU assignments of the first and second child of each pair; tuple of 4 numpy
+    arrays of int
+    """
+    crossing = (rand(len(orders1)) < crossover_rate)[:, None]
+
+    # rate here is 1 to ensure a crossover in the children, the pairs not crossing just copy their parents
+    order_children = GA_order.crossover_batch(orders1, orders2, 1)
+    cpu_children = GA_cpus.crossover_batch(cpus1, cpus2, 1)
+
+    return (np.where(crossing, order_children[0], orders1), np.where(crossing, cpu_children[0], cpus1),
+            np.where(crossing, order_children[1], orders2), np.where(crossing, cpu_children[1], cpus2))
+
+
+def mutate_batch(pop_order, pop_cpu, max_cpus, mutation_rate):
+    """
+    Mutate every individual at once, the same as calling mutate on each. Mutates the population in place.
+
+    :param pop_order: the file order of each individual, see crossover_batch; numpy array of int
+    :param pop_cpu: the CPU assignment of each individual; numpy array of int
+    :param max_cpus: max cpus, see mutate; int
+    :param mutation_rate: the rate at which mutation events should occur; float
+    """
+    GA_order.mutate_batch(pop_order, mutation_rate)
+    GA_cpus.mutate_batch(pop_cpu, max_cpus, mutation_rate)
+
+
 def objective(individual, max_memory, max_cpus, tasks):
     """
-    Objective function for optimizing file order and task CPU assignment i.e. run calc_makespan after setting
-    cpus for each task according to the individual. File orders are already reordered and are used as file
-    sizes.
+    Objective function for optimizing file order and task CPU assignment i.e. run calc_makespan with the cpus
+    for each task given by the individual. File orders are already reordered and are used as file sizes. The
+    tasks are not modified, so the same tasks can be scored concurrently.
 
     :param individual: a particular assignment of file ordering and CPUs to tasks; list of lists
     :return: the makespan for these parameters; int
     """
-    # Set cpus per task according to
-    for i in range(len(tasks)):
-        task_cpus = individual[1][i]
-
+    for task_cpus in individual[1]:
         if task_cpus > max_cpus:
             raise Exception(f"Can't assign {task_cpus} to a task when the max is {max_cpus}")
-        tasks[i].cpus = task_cpus
 
     return calc_makespan(file_sizes=individual[0],
                          max_memory=max_memory,
                          max_cpus=max_cpus,
-                         tasks=tasks)
+                         tasks=tasks,
+                         cpu_assignment=tuple(individual[1]))
 
 
-def GA_both(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover_rate, mutation_rate):
+def GA_both(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover_rate, mutation_rate, cache=None,
+            workers=None, executor=None, seed=None, control=None, heuristic_seeds=False, progress=None,
+            verbose=False):
     """
     A simple genetic algorithm to find an approximately optimal file ordering and Task CPU assignment for
     minimizing makespan of a pipeline.
@@ -113,64 +162,117 @@ def GA_both(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover
     :param max_memory: the memory limits of the machine; int
     :param max_cpus: the number of cores in the machine; int
     :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
-    :param rounds: number of rounds to run the genetic algorithm; int
+    :param rounds: number of rounds to run the genetic algorithm, or None to run until the control stops it; int
     :param pop_size: population size; int
     :param crossover_rate: proportion of the time a crossover event occurs; float
     :param mutation_rate: proportion of the time a mutation event occurs; float
+    :param cache: makespans of schedules already scored on this pipeline, e.g. shared with other optimizer runs,
+    or None to use a new cache; MakespanCache
+    :param workers: number of processes to score each generation with, or None to score in this process unless
+    an executor is given; int
+    :param executor: a process pool to score each generation with; concurrent.futures.Executor
+    :param seed: seed for the random number generators, a run with the same seed gives the same result whatever
+    the number of workers; int
+    :param control: budget and stall rule to stop early by, checked after every round, and where the best
+    schedule so far is reported, or None to run every round; RunControl
+    :param heuristic_seeds: start the population with the order from each heuristic heuristics.heuristic_orders
+    uses by default, or from each heuristic named in heuristics.HEURISTICS, and the CPUs set on the tasks, the rest
+    of the population is random; bool or list of str
+    :param progress: called with the statistics of every round, e.g. a ProgressLog, or None; callable taking a
+    RoundStats
+    :param verbose: print the progress at most once a second, unless a progress callback is given, and the results;
+    bool
     :return: the lowest makespan and the file ordering / assignment of cpus to tasks that achieved it; list of
     lists
     """
+    control = control if control is not None else RunControl()
+    if rounds is None and not control.limited:
+        raise Exception("GA_both needs a number of rounds or a control with a budget or patience to stop it")
+    control.start()
+    if verbose and progress is None:
+        progress = ProgressLog()
+
     num_tasks = len(tasks)
     num_files = len(file_sizes)
+    parallel = workers is not None or executor is not None
 
-    # Create an initial population: an individual is a list of 2 lists where
-    # first represents a list of file orderings for the given number of files, length num_files
-    pop_order = [sample(file_sizes, num_files) for x in range(pop_size)]
-
-    # second represents a CPU assignment of from 1 to max_cpus to each task, length num_tasks
-    pop_cpu = [randint(1, max_cpus + 1, num_tasks).tolist() for x in range(pop_size)]
+    # Only this process draws random numbers, workers just score individuals
+    if seed is not None:
+        numpy_seed(seed)
+        random_seed(seed)
 
-    # create a 1 to 1 matching of both lists to create all individuals in the population
-    pop = []
-    for i in range(pop_size):
-        individual = [pop_order[i], pop_cpu[i]]
+    # Create an initial population: an individual is a row of each of 2 arrays where
+    # first represents an ordering of the given number of files as the positions of the files in file_sizes,
+    # length num_files
+    sizes = np.array(file_sizes)
+    pop_order = np.array([sample(range(num_files), num_files) for x in range(pop_size)]).reshape(pop_size, num_files)
 
-        pop.append(individual)
+    # second represents a CPU assignment of from 1 to max_cpus to each task, length num_tasks
+    pop_cpu = randint(1, max_cpus + 1, (pop_size, num_tasks))
+
+    # Durations and memory of every task for every file and CPU count are calculated once for all rounds, and
+    # individuals scored before are looked up instead of simulated again
+    if cache is None:
+        cache = MakespanCache(CompiledPipeline(file_sizes, tasks, max_cpus, max_memory))
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(cache.pipeline, any_cpus=True)
+
+    # Replace the first individuals with good schedules to converge from, after drawing the random ones so a seed
+    # gives the same random individuals either way
+    if heuristic_seeds:
+        cpu_assn = [min(task.cpus, max_cpus) for task in tasks]
+        orders = heuristic_orders(file_sizes, max_memory, max_cpus, tasks, cpu_assn, cache.pipeline,
+                                  None if heuristic_seeds is True else heuristic_seeds).values()
+        pop_order[:len(orders)] = [GA_order.order_positions(file_sizes, order) for order in orders][:pop_size]
+        pop_cpu[:len(orders)] = cpu_assn
 
     # Store best (and worst) makespans found so far and CPU assignments that achieved them
     best_params, best_makespan = None, inf
     worst_params, worst_makespan = None, 0
 
-    # Run the genetic algorithm for the specified number of rounds
-    for round in range(rounds):
-        # Score all the individuals in the population
-        makespans = [objective(individual, max_memory, max_cpus, tasks) for individual in pop]
-
-        # Update best (and worst) solution found so far
-        for i in range(pop_size):
-            if makespans[i] <= best_makespan:
-                best_params, best_makespan = pop[i], makespans[i]
-
-            if makespans[i] >= worst_makespan:
-                worst_params, worst_makespan = pop[i], makespans[i]
-
-        print(f"Round {round}: best makespan {best_makespan} achieved with params {best_params}")
-
-        # Create the next generation
-        parents = [GA_cpus.tournament(pop, pop_size, makespans) for x in range(pop_size)]
-
-        next_gen = list()
-        for i in range(0, pop_size, 2):
-            parent1, parent2 = parents[i], parents[i + 1]
-            children = crossover(parent1, parent2, crossover_rate)
-            for child in children:
-                mutate(child, max_cpus, mutation_rate)
-                next_gen.append(child)
-
-        pop = next_gen
-
-    print(f"Final best makespan {best_makespan}, achieved using parameters {best_params}")
-    print(f"Final worst makespan {worst_makespan}, achieved using parameters {worst_params}")
+    with PoolEvaluator(cache.pipeline, workers, executor) if parallel else nullcontext() as evaluator:
+        # Run the genetic algorithm for the specified number of rounds
+        for round in range(rounds) if rounds is not None else count():
+            # Score all the individuals in the population at once
+            makespans = cache.makespan_batch(file_orders=sizes[pop_order], cpu_assignments=pop_cpu,
+                                             evaluator=evaluator)
+
+            # Update best (and worst) solution found so far, the last individual of equal makespans wins
+            scores = np.asarray(makespans)
+            if scores.min() <= best_makespan:
+                i = pop_size - 1 - scores[::-1].argmin()
+                best_params, best_makespan = [sizes[pop_order[i]].tolist(), pop_cpu[i].tolist()], makespans[i]
+
+            if scores.max() >= worst_makespan:
+                i = pop_size - 1 - scores[::-1].argmax()
+                worst_params, worst_makespan = [sizes[pop_order[i]].tolist(), pop_cpu[i].tolist()], makespans[i]
+
+            control.record(best_makespan, best_params)
+            control.iteration(pop_size)
+
+            if progress is not None:
+                progress(round_stats(round, makespans, best_makespan, best_params, diversity(pop_order, pop_cpu),
+                                     control))
+            if control.should_stop():
+                if verbose:
+                    print(f"Stopping early: {control.stop_reason}")
+                break
+
+            # Create the next generation, mating pairs of parents who each won a tournament to create two children
+            parents = GA_cpus.tournament_batch(makespans, pop_size + pop_size % 2)
+            orders1, cpus1, orders2, cpus2 = crossover_batch(pop_order[parents[0::2]], pop_cpu[parents[0::2]],
+                                                             pop_order[parents[1::2]], pop_cpu[parents[1::2]],
+                                                             crossover_rate)
+            pop_order = np.stack((orders1, orders2), axis=1).reshape(-1, num_files)[:pop_size]
+            pop_cpu = np.stack((cpus1, cpus2), axis=1).reshape(-1, num_tasks)[:pop_size]
+            mutate_batch(pop_order, pop_cpu, max_cpus, mutation_rate)
+
+    if verbose:
+        print(f"Final best makespan {best_makespan}, achieved using parameters {best_params}")
+        print(f"Final worst makespan {worst_makespan}, achieved using parameters {worst_params}")
+        print(f"Makespan cache: {cache.cache_info()}")
+        if control.gap() is not None:
+            print(f"Gap to the lower bound of {control.lower_bound}: {control.gap():.1%}")
 
     return best_makespan, best_params
 
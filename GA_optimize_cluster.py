@@ -0,0 +1,166 @@
+from itertools import count
+from math import inf
+from random import sample
+from random import seed as random_seed
+
+import numpy as np
+from numpy.random import rand, randint
+from numpy.random import seed as numpy_seed
+
+from calc_makespan import PipelineTask
+from cluster import ClusterPipeline, Node
+from lower_bounds import cluster_lower_bound
+from progress import diversity, round_stats, ProgressLog
+from run_control import RunControl
+import GA_optimize_both as GA_both
+import GA_optimize_task_cpus_only as GA_cpus
+
+
+def main():
+    """ Plan a pipeline across a cluster of two big nodes and a small one """
+    task_a = PipelineTask(name="A", step=0, time_factor=7, space_factor=3, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=10, space_factor=1, cpus=12)
+    task_c = PipelineTask(name="C", step=2, time_factor=3, space_factor=2, cpus=4)
+    tasks = [task_a, task_b, task_c]
+    nodes = [Node(name="big1", max_cpus=32, max_memory=400), Node(name="big2", max_cpus=32, max_memory=400),
+             Node(name="small", max_cpus=8, max_memory=150)]
+    file_sizes = sample(range(1, 100), 40)
+
+    GA_cluster(file_sizes, nodes, tasks, rounds=100, pop_size=100, crossover_rate=0.9, mutation_rate=0.02,
+               transfer_factor=1, verbose=True)
+
+
+def mutate_placement_batch(pop_place, num_nodes, mutation_rate):
+    """
+    Move random jobs of every individual to a random node at once. Mutates the population in place.
+
+    :param pop_place: the node of each job of each individual, one individual per row; numpy array of int
+    :param num_nodes: number of nodes in the cluster; int
+    :param mutation_rate: the rate at which mutation events should occur; float
+    """
+    mutating = rand(*pop_place.shape) < mutation_rate
+    pop_place[mutating] = randint(0, num_nodes, np.count_nonzero(mutating))
+
+
+def repair_placement_batch(pop_place, fits):
+    """
+    Move every job placed on a node without the memory for it to a random node with enough. Mutates the population
+    in place.
+
+    :param pop_place: the node of each job of each individual, one individual per row; numpy array of int
+    :param fits: whether each job fits on each node, one row per job; numpy array of bool
+    """
+    p, job = np.nonzero(~fits[np.arange(fits.shape[0])[None, :], pop_place])
+    if p.size:
+        # The node with the highest random key among the ones it fits on
+        pop_place[p, job] = (rand(p.size, fits.shape[1]) * fits[job]).argmax(axis=1)
+
+
+def GA_cluster(file_sizes, nodes, tasks, rounds, pop_size, crossover_rate, mutation_rate, transfer_factor=0,
+               seed=None, control=None, progress=None, verbose=False):
+    """
+    The genetic algorithm of GA_both for a cluster of nodes (see cluster.calc_cluster_makespan), finding a file
+    ordering, Task CPU assignment and placement of every job on a node together. An individual's placement is kept
+    per file rather than per position in the order, so a file takes its nodes along when crossover or mutation
+    reorders it.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param nodes: the machines of the cluster; list of Node
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param rounds: number of rounds to run the genetic algorithm, or None to run until the control stops it; int
+    :param pop_size: population size; int
+    :param crossover_rate: proportion of the time a crossover event occurs; float
+    :param mutation_rate: proportion of the time a mutation event occurs; float
+    :param transfer_factor: time units to move a file size of 1 unit from one node to another; int
+    :param seed: seed for the random number generators; int
+    :param control: budget and stall rule to stop early by, checked after every round, and where the best
+    schedule so far is reported, or None to run every round; RunControl
+    :param progress: called with the statistics of every round, e.g. a ProgressLog, or None; callable taking a
+    RoundStats
+    :param verbose: print the progress at most once a second, unless a progress callback is given, and the results;
+    bool
+    :return: the lowest makespan and the file ordering / assignment of cpus to tasks / placement of the tasks of
+    each file that achieved it, in the form calc_cluster_makespan takes them; list of lists
+    """
+    control = control if control is not None else RunControl()
+    if rounds is None and not control.limited:
+        raise Exception("GA_cluster needs a number of rounds or a control with a budget or patience to stop it")
+    control.start()
+    if verbose and progress is None:
+        progress = ProgressLog()
+
+    cluster = ClusterPipeline(file_sizes, tasks, nodes, transfer_factor)
+    if control.lower_bound is None:
+        control.lower_bound = cluster_lower_bound(cluster)
+
+    num_tasks = len(tasks)
+    num_files = len(file_sizes)
+    if seed is not None:
+        numpy_seed(seed)
+        random_seed(seed)
+
+    # An individual is a row of each of 3 arrays: an ordering of the files as their positions in file_sizes, a CPU
+    # assignment of from 1 to the cores of the biggest node to each task, and the node of each task of each file
+    # in file_sizes, flattened to num_files * num_tasks so job g is task g % num_tasks of file g // num_tasks
+    sizes = np.array(file_sizes)
+    pop_order = np.array([sample(range(num_files), num_files) for x in range(pop_size)]).reshape(pop_size, num_files)
+    pop_cpu = randint(1, cluster.max_cpus + 1, (pop_size, num_tasks))
+    pop_place = randint(0, len(nodes), (pop_size, num_files, 1)).repeat(num_tasks, axis=2).reshape(pop_size, -1)
+
+    # Start every file on one node, and keep every job on a node it fits on, so only the CPUs can make a schedule
+    # impossible
+    fits = cluster.fits(file_sizes).reshape(num_files * num_tasks, len(nodes))
+    if not fits.any(axis=1).all():
+        raise Exception("A job doesn't fit on any node of the cluster")
+    repair_placement_batch(pop_place, fits)
+
+    best_params, best_makespan = None, inf
+    for round in range(rounds) if rounds is not None else count():
+        makespans = [cluster.makespan(sizes[order].tolist(), cpus.tolist(),
+                                      place.reshape(num_files, num_tasks)[order].tolist())
+                     for order, cpus, place in zip(pop_order, pop_cpu, pop_place)]
+
+        # Placements are repaired to fit, so a schedule is only impossible if the pipeline is invalid, and then
+        # every one is. Its makespan of -1 still mustn't win the tournaments, which pick the lowest score
+        scores = np.where(np.asarray(makespans) < 0, inf, makespans)
+        i = scores.argmin()
+        if scores[i] < best_makespan:
+            best_makespan = makespans[i]
+            best_params = [sizes[pop_order[i]].tolist(), pop_cpu[i].tolist(),
+                           pop_place[i].reshape(num_files, num_tasks)[pop_order[i]].tolist()]
+
+        control.record(best_makespan, best_params)
+        control.iteration(pop_size)
+        if progress is not None:
+            progress(round_stats(round, makespans, best_makespan, best_params,
+                                 diversity(pop_order, pop_cpu, pop_place), control))
+        if control.should_stop():
+            if verbose:
+                print(f"Stopping early: {control.stop_reason}")
+            break
+
+        # Create the next generation as GA_both does, crossing the placements of the same pairs of parents
+        parents = GA_cpus.tournament_batch(scores, pop_size + pop_size % 2)
+        first, second = parents[0::2], parents[1::2]
+        orders1, cpus1, orders2, cpus2 = GA_both.crossover_batch(pop_order[first], pop_cpu[first],
+                                                                 pop_order[second], pop_cpu[second], crossover_rate)
+        place1, place2 = GA_cpus.crossover_batch(pop_place[first], pop_place[second], crossover_rate)
+        pop_order = np.stack((orders1, orders2), axis=1).reshape(-1, num_files)[:pop_size]
+        pop_cpu = np.stack((cpus1, cpus2), axis=1).reshape(-1, num_tasks)[:pop_size]
+        pop_place = np.stack((place1, place2), axis=1).reshape(-1, num_files * num_tasks)[:pop_size]
+        GA_both.mutate_batch(pop_order, pop_cpu, cluster.max_cpus, mutation_rate)
+        mutate_placement_batch(pop_place, len(nodes), mutation_rate)
+        repair_placement_batch(pop_place, fits)
+
+    if best_params is None:
+        best_makespan = -1
+    if verbose:
+        print(f"Final best makespan {best_makespan}, achieved using parameters {best_params}")
+        if control.gap() is not None:
+            print(f"Gap to the lower bound of {control.lower_bound}: {control.gap():.1%}")
+
+    return best_makespan, best_params
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
 from numpy.random import randint
 from numpy.random import rand
+from numpy.random import seed as numpy_seed
 from random import sample
+from random import seed as random_seed
 from math import inf
-
-from calc_makespan import calc_makespan, PipelineTask
-from GA_optimize_task_cpus_only import tournament
+from contextlib import nullcontext
+from itertools import count
+
+import numpy as np
+
+from calc_makespan import calc_makespan, CompiledPipeline, PipelineTask
+from heuristics import heuristic_orders
+from lower_bounds import pipeline_lower_bound
+from makespan_cache import MakespanCache
+from parallel_evaluation import PoolEvaluator
+from progress import diversity, round_stats, ProgressLog
+from run_control import RunControl
+from GA_optimize_task_cpus_only import tournament_batch
 from time_brute import brute_force_order
 
 
@@ -22,7 +34,8 @@ def main():
                                                    rounds=1000,
                                                    pop_size=100,
                                                    crossover_rate=0.9,
-                                                   mutation_rate=0.2)
+                                                   mutation_rate=0.2,
+                                                   verbose=True)
 
     # 7 files (7! possible orderings) doable in reasonable time by brute force
     opt_makespan, opt_file_order = brute_force_order(file_sizes=[26, 42, 31, 19, 55, 11, 61],
@@ -85,6 +98,89 @@ def mutate(individual, mutation_rate):
             individual[i], individual[swapIndex] = individual[swapIndex], individual[i]
 
 
+def order_positions(file_sizes, file_order):
+    """
+    Find where each file of an order is in the given file sizes, so an order can be kept as a permutation of
+    positions, which stays a valid order through crossover_batch even if some files have the same size.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param file_order: the same file sizes in processing order; list of int
+    :return: the position in file_sizes of each file in the order; list of int
+    """
+    unused = dict()  # positions not used yet of each size, last first
+    for k in reversed(range(len(file_sizes))):
+        unused.setdefault(file_sizes[k], []).append(k)
+    return [unused[size].pop() for size in file_order]
+
+
+def crossover_batch(parents1, parents2, crossover_rate):
+    """
+    Perform a crossover event between each pair of parents at once, with frequency proportional to the given
+    crossover rate, the same as calling crossover on each pair. Parents are permutations of the positions of the
+    files, see order_positions.
+
+    :param parents1: the first parent of each pair, one permutation per row; numpy array of int
+    :param parents2: the second parent of each pair; numpy array of int
+    :param crossover_rate: the rate at which crossover events should occur; float
+    :return: the first and second child of each pair; (numpy array of int, numpy array of int)
+    """
+    num_pairs, num_files = parents1.shape
+    crossing = rand(num_pairs) < crossover_rate
+    x = randint(1, max(num_files - 1, 2), num_pairs)  # crossover index, as in crossover
+    x[~crossing] = num_files  # just copy parents
+
+    return _order_crossover(parents1, parents2, x), _order_crossover(parents2, parents1, x)
+
+
+def _order_crossover(parents1, parents2, x):
+    """
+    The first part of each first parent up to its crossover index, then the files it is missing in the order that
+    they are present in the second parent.
+
+    :param parents1: the parent of each child the first part comes from; numpy array of int
+    :param parents2: the parent of each child the rest comes from; numpy array of int
+    :param x: the crossover index of each child; numpy array of int
+    :return: the children, one per row; numpy array of int
+    """
+    num_files = parents1.shape[1]
+    columns = np.arange(num_files)
+    rows = np.arange(parents1.shape[0])[:, None]
+
+    # Where each file is in the first parent, to tell which files of the second parent are in the first part
+    where1 = np.empty_like(parents1)
+    where1[rows, parents1] = columns
+    missing = where1[rows, parents2] >= x[:, None]
+
+    # Put both parents side by side and sort the files to keep by where they go: the first part in place, then the
+    # missing files after it in the order of the second parent
+    rank = np.concatenate([np.where(columns < x[:, None], columns, 2 * num_files),
+                           np.where(missing, num_files + columns, 2 * num_files)], axis=1)
+    keep = np.argsort(rank, axis=1, kind="stable")[:, :num_files]
+    return np.take_along_axis(np.concatenate([parents1, parents2], axis=1), keep, axis=1)
+
+
+def mutate_batch(pop, mutation_rate):
+    """
+    Mutate every individual at once, the same as calling mutate on each: all the random numbers are drawn
+    together, then swaps are made one position at a time across the whole population. Mutates the population in
+    place.
+
+    :param pop: the population, one permutation per row; numpy array of int
+    :param mutation_rate: the rate at which mutation events should occur; float
+    """
+    pop_size, num_files = pop.shape
+    if num_files < 2:
+        return
+    mutating = rand(pop_size, num_files) < mutation_rate
+    swap_index = randint(0, num_files - 1, (pop_size, num_files))
+    swap_index += swap_index >= np.arange(num_files)  # any position but its own
+
+    for i in np.flatnonzero(mutating.any(axis=0)):
+        rows = np.flatnonzero(mutating[:, i])
+        j = swap_index[rows, i]
+        pop[rows, i], pop[rows, j] = pop[rows, j], pop[rows, i]
+
+
 def file_order_objective(file_order_assn, max_memory, max_cpus, tasks):
     """
     Objective function for optimizing file order assignment, i.e. simply run calc_makespan on file_order_assn
@@ -101,7 +197,8 @@ def file_order_objective(file_order_assn, max_memory, max_cpus, tasks):
 
 
 def GA_file_order(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover_rate=0.9,
-                  mutation_rate=0.05):
+                  mutation_rate=0.05, cache=None, workers=None, executor=None, seed=None, control=None,
+                  heuristic_seeds=False, progress=None, verbose=False):
     """
     A simple genetic algorithm to find an approximately optimal file ordering for minimizing makespan of a
     pipeline.
@@ -110,56 +207,105 @@ def GA_file_order(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, cro
     :param max_memory: the memory limits of the machine; int
     :param max_cpus: the number of cores in the machine; int
     :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
-    :param rounds: number of rounds to run the genetic algorithm; int
+    :param rounds: number of rounds to run the genetic algorithm, or None to run until the control stops it; int
     :param pop_size: population size; int
     :param crossover_rate: proportion of the time a crossover event occurs; float
     :param mutation_rate: proportion of the time a mutation event occurs; float
+    :param cache: makespans of schedules already scored on this pipeline, e.g. shared with other optimizer runs,
+    or None to use a new cache; MakespanCache
+    :param workers: number of processes to score each generation with, or None to score in this process unless
+    an executor is given; int
+    :param executor: a process pool to score each generation with; concurrent.futures.Executor
+    :param seed: seed for the random number generators, a run with the same seed gives the same result whatever
+    the number of workers; int
+    :param control: budget and stall rule to stop early by, checked after every round, and where the best
+    schedule so far is reported, or None to run every round; RunControl
+    :param heuristic_seeds: start the population with the order from each heuristic heuristics.heuristic_orders
+    uses by default, or from each heuristic named in heuristics.HEURISTICS, the rest of the population is random;
+    bool or list of str
+    :param progress: called with the statistics of every round, e.g. a ProgressLog, or None; callable taking a
+    RoundStats
+    :param verbose: print the progress at most once a second, unless a progress callback is given, and the results;
+    bool
     :return: the lowest makespan and the assignment of cpus to tasks that achieved it; int, tuple of ints
     """
-    num_files = len(file_sizes)
+    control = control if control is not None else RunControl()
+    if rounds is None and not control.limited:
+        raise Exception("GA_file_order needs a number of rounds or a control with a budget or patience to stop it")
+    control.start()
+    if verbose and progress is None:
+        progress = ProgressLog()
 
-    # Create an initial population:
-    # an individual is a randomly generated list of file orderings for the given number of files
-    pop = [sample(file_sizes, num_files) for x in range(pop_size)]
+    num_files = len(file_sizes)
+    parallel = workers is not None or executor is not None
+
+    # Only this process draws random numbers, workers just score individuals
+    if seed is not None:
+        numpy_seed(seed)
+        random_seed(seed)
+
+    # Create an initial population: an individual is a randomly generated ordering of the given number of files,
+    # a row of the positions of the files in file_sizes
+    sizes = np.array(file_sizes)
+    pop = np.array([sample(range(num_files), num_files) for x in range(pop_size)]).reshape(pop_size, num_files)
+
+    # Durations and memory of every task for every file are calculated once for all rounds, and individuals
+    # scored before are looked up instead of simulated again
+    if cache is None:
+        cache = MakespanCache(CompiledPipeline(file_sizes, tasks, max_cpus, max_memory))
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(cache.pipeline)
+
+    # Replace the first individuals with good orders to converge from, after drawing the random ones so a seed
+    # gives the same random individuals either way
+    if heuristic_seeds:
+        orders = list(heuristic_orders(file_sizes, max_memory, max_cpus, tasks, pipeline=cache.pipeline,
+                                       heuristics=None if heuristic_seeds is True else heuristic_seeds).values())
+        pop[:len(orders)] = [order_positions(file_sizes, order) for order in orders][:pop_size]
 
     # Store best (and worst) makespans found so far and file orders that achieved them
     best_file_order, best_makespan = None, inf
     worst_file_order, worst_makespan = None, 0
 
-    # Run the genetic algorithm for the specified number of rounds
-    for round in range(rounds):
-        # Score all individuals in the population
-        makespans = [file_order_objective(file_order_assn,
-                                          max_memory,
-                                          max_cpus,
-                                          tasks) for file_order_assn in pop]
-
-        # Update best (and worst) solution found so far
-        # Remapping indexes of file_order_assn to actual file sizes
-        for i in range(pop_size):
-            if makespans[i] <= best_makespan:
-                best_file_order, best_makespan = pop[i], makespans[i]
-
-            if makespans[i] >= worst_makespan:
-                worst_file_order, worst_makespan = pop[i], makespans[i]
-
-        print(f"Round {round}: best makespan {best_makespan} achieved with file order assignment {best_file_order}")
-
-        # Create the next generation
-        parents = [tournament(pop, pop_size, makespans) for x in range(pop_size)]
-
-        next_gen = list()
-        for i in range(0, pop_size, 2):
-            parent1, parent2 = parents[i], parents[i + 1]
-            children = crossover(parent1, parent2, crossover_rate)
-            for child in children:
-                mutate(child, mutation_rate)
-                next_gen.append(child)
-
-        pop = next_gen
-
-    print(f"Final best makespan {best_makespan}, achieved using parameters {best_file_order}")
-    print(f"Final worst makespan {worst_makespan}, achieved using parameters {worst_file_order}")
+    with PoolEvaluator(cache.pipeline, workers, executor) if parallel else nullcontext() as evaluator:
+        # Run the genetic algorithm for the specified number of rounds
+        for round in range(rounds) if rounds is not None else count():
+            # Score all individuals in the population at once
+            makespans = cache.makespan_batch(file_orders=sizes[pop], evaluator=evaluator)
+
+            # Update best (and worst) solution found so far, the last individual of equal makespans wins
+            # Remapping positions of the files to actual file sizes
+            scores = np.asarray(makespans)
+            if scores.min() <= best_makespan:
+                i = pop_size - 1 - scores[::-1].argmin()
+                best_file_order, best_makespan = sizes[pop[i]].tolist(), makespans[i]
+
+            if scores.max() >= worst_makespan:
+                i = pop_size - 1 - scores[::-1].argmax()
+                worst_file_order, worst_makespan = sizes[pop[i]].tolist(), makespans[i]
+
+            control.record(best_makespan, best_file_order)
+            control.iteration(pop_size)
+
+            if progress is not None:
+                progress(round_stats(round, makespans, best_makespan, best_file_order, diversity(pop), control))
+            if control.should_stop():
+                if verbose:
+                    print(f"Stopping early: {control.stop_reason}")
+                break
+
+            # Create the next generation, mating pairs of parents who each won a tournament to create two children
+            parents = pop[tournament_batch(makespans, pop_size + pop_size % 2)]
+            children = crossover_batch(parents[0::2], parents[1::2], crossover_rate)
+            pop = np.stack(children, axis=1).reshape(-1, num_files)[:pop_size]
+            mutate_batch(pop, mutation_rate)
+
+    if verbose:
+        print(f"Final best makespan {best_makespan}, achieved using parameters {best_file_order}")
+        print(f"Final worst makespan {worst_makespan}, achieved using parameters {worst_file_order}")
+        print(f"Makespan cache: {cache.cache_info()}")
+        if control.gap() is not None:
+            print(f"Gap to the lower bound of {control.lower_bound}: {control.gap():.1%}")
 
     return best_makespan, best_file_order
 
@@ -0,0 +1,292 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from math import inf
+from random import Random, sample
+from random import seed as random_seed
+from timeit import default_timer
+
+import numpy as np
+from numpy.random import randint
+from numpy.random import seed as numpy_seed
+
+from calc_makespan import CompiledPipeline, PipelineTask
+from heuristics import heuristic_orders
+from lower_bounds import pipeline_lower_bound
+from makespan_cache import MakespanCache
+from progress import diversity, round_stats, ProgressLog
+from run_control import RunControl
+import GA_optimize_both as GA_both
+from GA_optimize_file_order_only import order_positions
+import GA_optimize_task_cpus_only as GA_cpus
+
+# Which islands each island's migrants go to, see migrate
+TOPOLOGIES = ("ring", "complete", "random")
+
+# Makespans of the pipeline every island sent to this worker process evolves, loaded once by the pool
+_worker_cache = None
+
+
+def main():
+    """ Compare one population against the same number of individuals split into islands """
+    task_a = PipelineTask(name="A", step=0, time_factor=7, space_factor=3, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=10, space_factor=1, cpus=12)
+    task_c = PipelineTask(name="C", step=2, time_factor=3, space_factor=2, cpus=4)
+    tasks = [task_a, task_b, task_c]
+    file_sizes = sample(range(1, 100), 40)
+
+    start = default_timer()
+    best_makespan, best_params = GA_both.GA_both(file_sizes, max_memory=400, max_cpus=32, tasks=tasks, rounds=100,
+                                                 pop_size=200, crossover_rate=0.9, mutation_rate=0.05, seed=1)
+    single = default_timer() - start
+
+    start = default_timer()
+    island_makespan, island_params = GA_islands(file_sizes, max_memory=400, max_cpus=32, tasks=tasks, rounds=100,
+                                                pop_size=50, crossover_rate=0.9, mutation_rate=0.05, islands=4,
+                                                workers=4, seed=1)
+    print(f"One population: {best_makespan} in {single:.1f}s")
+    print(f"4 islands: {island_makespan} in {default_timer() - start:.1f}s")
+
+
+def GA_islands(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover_rate, mutation_rate, islands=4,
+               migration_interval=10, migrants=2, topology="ring", workers=None, seed=None, cache=None,
+               control=None, heuristic_seeds=False, progress=None, verbose=False):
+    """
+    An island model of the genetic algorithm of GA_both: several populations evolve apart, each in its own worker
+    process, and every migration_interval rounds the best few individuals of each island replace the worst of
+    the islands the topology sends them to. Islands only exchange migrants, so more islands use more cores at
+    about the same cost per round, and the islands drifting apart keeps more diversity than one population. That
+    only pays off in time with workers > 1: without workers the islands are evolved one after another, at the
+    cost of one population as large as all of them.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param rounds: number of rounds to run the genetic algorithm on each island, or None to run until the control
+    stops it; int
+    :param pop_size: population size of each island; int
+    :param crossover_rate: proportion of the time a crossover event occurs; float
+    :param mutation_rate: proportion of the time a mutation event occurs; float
+    :param islands: number of populations; int
+    :param migration_interval: rounds between migrations; int
+    :param migrants: number of individuals each island sends at a migration; int
+    :param topology: where migrants go, "ring" to the next island, "complete" to every other island or "random"
+    to one other island picked at random each migration; str
+    :param workers: number of processes to evolve the islands in, or None to evolve them one after another in
+    this process; int
+    :param seed: seed for the random number generators, a run with the same seed gives the same result whatever
+    the number of workers; int
+    :param cache: makespans of schedules already scored on this pipeline, or None to use a new cache. Only used
+    by islands evolved in this process; MakespanCache
+    :param control: budget and stall rule to stop early by, checked after every migration, and where the best
+    schedule so far is reported, or None to run every round; RunControl
+    :param heuristic_seeds: start each island with the order from one heuristic heuristics.heuristic_orders uses by
+    default, or one named in heuristics.HEURISTICS, and the CPUs set on the tasks, the rest of the population is
+    random; bool or list of str
+    :param progress: called with the statistics of every migration interval, over every island, e.g. a
+    ProgressLog, or None; callable taking a RoundStats
+    :param verbose: print the progress at most once a second, unless a progress callback is given, and the results;
+    bool
+    :return: the lowest makespan and the file ordering / assignment of cpus to tasks that achieved it; list of
+    lists
+    """
+    if topology not in TOPOLOGIES:
+        raise Exception(f"Unknown topology {topology}, expected one of {TOPOLOGIES}")
+    control = control if control is not None else RunControl()
+    if rounds is None and not control.limited:
+        raise Exception("GA_islands needs a number of rounds or a control with a budget or patience to stop it")
+    control.start()
+    if verbose and progress is None:
+        progress = ProgressLog()
+
+    if cache is None:
+        cache = MakespanCache(CompiledPipeline(file_sizes, tasks, max_cpus, max_memory))
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(cache.pipeline, any_cpus=True)
+
+    # Every random number the islands use is seeded from here, one seed per island per migration interval, so
+    # results don't depend on which process evolves which island
+    rng = Random(seed)
+    populations = []
+    for island in range(islands):
+        numpy_seed(rng.getrandbits(32))
+        random_seed(rng.getrandbits(32))
+        # File orders are kept as the positions of the files in file_sizes, as in GA_both, so crossover keeps
+        # every file even if some have the same size
+        populations.append([[sample(range(len(file_sizes)), len(file_sizes)),
+                             randint(1, max_cpus + 1, len(tasks)).tolist()] for x in range(pop_size)])
+    if heuristic_seeds:
+        cpu_assn = [min(task.cpus, max_cpus) for task in tasks]
+        orders = list(heuristic_orders(file_sizes, max_memory, max_cpus, tasks, cpu_assn, cache.pipeline,
+                                       None if heuristic_seeds is True else heuristic_seeds).values())
+        for island, pop in enumerate(populations):
+            pop[0] = [order_positions(file_sizes, orders[island % len(orders)]), cpu_assn.copy()]
+    scores = [None] * islands  # makespans of each island's population, once scored
+
+    best_params, best_makespan = None, inf
+    executor = ProcessPoolExecutor(workers, initializer=_load_cache, initargs=(cache.pipeline,)) \
+        if workers is not None else None
+    try:
+        for epoch in count():
+            done = epoch * migration_interval
+            if rounds is not None and done >= rounds:
+                break
+            generations = migration_interval if rounds is None else min(migration_interval, rounds - done)
+
+            jobs = [(populations[island], scores[island], file_sizes, generations, rng.getrandbits(32), max_cpus,
+                     crossover_rate, mutation_rate) for island in range(islands)]
+            if executor is not None:
+                results = list(executor.map(_evolve_island, *zip(*jobs)))
+            else:
+                results = [_evolve_island(*job, cache=cache) for job in jobs]
+
+            evaluations = 0
+            for island, (pop, makespans, island_makespan, island_params, island_evaluations) in enumerate(results):
+                populations[island], scores[island] = pop, makespans
+                evaluations += island_evaluations
+                if _rank(island_makespan) < _rank(best_makespan):
+                    best_params, best_makespan = island_params, island_makespan
+
+            migrate(populations, scores, migrants, topology, rng)
+
+            control.record(best_makespan, best_params)
+            control.iteration(evaluations)
+            if progress is not None:
+                individuals = [individual for pop in populations for individual in pop]
+                makespans = [makespan for island_scores in scores for makespan in island_scores]
+                spread = diversity([individual[0] for individual in individuals],
+                                   [individual[1] for individual in individuals])
+                progress(round_stats(done + generations, makespans, best_makespan, best_params, spread, control))
+            if control.should_stop():
+                if verbose:
+                    print(f"Stopping early: {control.stop_reason}")
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if verbose:
+        print(f"Final best makespan {best_makespan}, achieved using parameters {best_params}")
+        if control.gap() is not None:
+            print(f"Gap to the lower bound of {control.lower_bound}: {control.gap():.1%}")
+
+    return best_makespan, best_params
+
+
+def migrate(populations, scores, migrants, topology, rng):
+    """
+    Copy the best individuals of each island over the worst individuals of the islands the topology sends them
+    to. Every island picks its migrants before any arrive, and an island never receives more than it has
+    individuals.
+
+    :param populations: the population of each island, changed in place; list of lists
+    :param scores: the makespan of each individual of each island, changed in place; list of lists of int
+    :param migrants: number of individuals each island sends; int
+    :param topology: "ring" sends to the next island, "complete" to every other island and "random" to one other
+    island picked at random; str
+    :param rng: picks the destinations for the random topology; random.Random
+    """
+    num_islands = len(populations)
+    if num_islands < 2 or migrants <= 0:
+        return
+
+    arriving = [[] for island in range(num_islands)]
+    for island, (pop, makespans) in enumerate(zip(populations, scores)):
+        best = sorted(range(len(pop)), key=lambda i: _rank(makespans[i]))[:migrants]
+        leaving = [([pop[i][0].copy(), pop[i][1].copy()], makespans[i]) for i in best]
+
+        if topology == "ring":
+            destinations = [(island + 1) % num_islands]
+        elif topology == "complete":
+            destinations = [other for other in range(num_islands) if other != island]
+        else:
+            destinations = [rng.choice([other for other in range(num_islands) if other != island])]
+        for destination in destinations:
+            arriving[destination].extend(leaving)
+
+    for island, (pop, makespans) in enumerate(zip(populations, scores)):
+        worst = sorted(range(len(pop)), key=lambda i: _rank(makespans[i]), reverse=True)
+        for i, (individual, makespan) in zip(worst, arriving[island]):
+            pop[i], makespans[i] = individual, makespan
+
+
+def _rank(makespan):
+    """
+    Sort key that puts impossible schedules after every possible one.
+
+    :param makespan: the makespan of a schedule, -1 if it is impossible; int
+    :return: the key; tuple
+    """
+    return makespan < 0, makespan
+
+
+def _load_cache(pipeline):
+    """
+    Worker initializer, keeps a cache of the pipeline for every island this worker evolves.
+
+    :param pipeline: the pipeline schedules are evaluated on; CompiledPipeline
+    """
+    global _worker_cache
+    _worker_cache = MakespanCache(pipeline)
+
+
+def _evolve_island(pop, makespans, file_sizes, generations, seed, max_cpus, crossover_rate, mutation_rate,
+                   cache=None):
+    """
+    Worker task, runs the genetic algorithm of GA_both on one island for some rounds.
+
+    :param pop: the population of the island, each file order as the positions of the files in file_sizes; list of
+    lists
+    :param makespans: makespan of each individual, or None if the population hasn't been scored yet; list of int
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param generations: number of rounds to run; int
+    :param seed: seed for the random number generators for these rounds; int
+    :param max_cpus: the number of cores in the machine; int
+    :param crossover_rate: proportion of the time a crossover event occurs; float
+    :param mutation_rate: proportion of the time a mutation event occurs; float
+    :param cache: makespans of the pipeline, or None for the one loaded when the worker started; MakespanCache
+    :return: the population after the last round and its makespans, the lowest makespan in any round and the
+    file sizes in processing order and CPU assignment that achieved it, and the number of individuals scored;
+    (list, list, int, list, int)
+    """
+    cache = cache if cache is not None else _worker_cache
+    numpy_seed(seed)
+    random_seed(seed)
+    pop_size = len(pop)
+    sizes = np.array(file_sizes)
+
+    # The island is evolved as GA_both evolves its population, an individual being a row of each array
+    pop_order = np.array([individual[0] for individual in pop]).reshape(pop_size, len(file_sizes))
+    pop_cpu = np.array([individual[1] for individual in pop]).reshape(pop_size, -1)
+
+    evaluations = 0
+    if makespans is None:
+        makespans = cache.makespan_batch(sizes[pop_order], pop_cpu)
+        evaluations += pop_size
+
+    best_i = min(range(pop_size), key=lambda i: _rank(makespans[i]))
+    best_makespan, best_params = makespans[best_i], [sizes[pop_order[best_i]].tolist(), pop_cpu[best_i].tolist()]
+
+    for generation in range(generations):
+        # Impossible schedules lose every tournament, as they rank last everywhere else on the islands
+        parents = GA_cpus.tournament_batch(np.where(np.asarray(makespans) < 0, inf, makespans),
+                                           pop_size + pop_size % 2)
+        orders1, cpus1, orders2, cpus2 = GA_both.crossover_batch(pop_order[parents[0::2]], pop_cpu[parents[0::2]],
+                                                                 pop_order[parents[1::2]], pop_cpu[parents[1::2]],
+                                                                 crossover_rate)
+        pop_order = np.stack((orders1, orders2), axis=1).reshape(-1, pop_order.shape[1])[:pop_size]
+        pop_cpu = np.stack((cpus1, cpus2), axis=1).reshape(-1, pop_cpu.shape[1])[:pop_size]
+        GA_both.mutate_batch(pop_order, pop_cpu, max_cpus, mutation_rate)
+
+        makespans = cache.makespan_batch(sizes[pop_order], pop_cpu)
+        evaluations += pop_size
+        for i in range(pop_size):
+            if _rank(makespans[i]) < _rank(best_makespan):
+                best_makespan, best_params = makespans[i], [sizes[pop_order[i]].tolist(), pop_cpu[i].tolist()]
+
+    pop = [[order.tolist(), cpus.tolist()] for order, cpus in zip(pop_order, pop_cpu)]
+    return pop, makespans, best_makespan, best_params, evaluations
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 from numpy.random import randint
 from numpy.random import rand
+from numpy.random import seed as numpy_seed
 from math import inf
+from contextlib import nullcontext
+from itertools import count
 
-from calc_makespan import calc_makespan, PipelineTask
+import numpy as np
+
+from calc_makespan import calc_makespan, CompiledPipeline, PipelineTask
+from lower_bounds import pipeline_lower_bound
+from makespan_cache import MakespanCache
+from parallel_evaluation import PoolEvaluator
+from progress import diversity, round_stats, ProgressLog
+from run_control import RunControl
 from time_brute import brute_force_cpus
 
 
@@ -16,7 +26,7 @@ def main():
 
     best_makespan, best_cpu_assn = GA_cpus(file_sizes=[26, 42, 31, 19, 55, 11, 61], max_memory=200, max_cpus=64,
                                            tasks=tasks, rounds=1000, pop_size=100, crossover_rate=0.9,
-                                           mutation_rate=0.2)
+                                           mutation_rate=0.2, verbose=True)
     # 3 tasks and 64 CPUs still doable by brute force
     opt_makespan, opt_cpu_assn = brute_force_cpus(file_sizes=[26, 42, 31, 19, 55, 11, 61], max_memory=200, max_cpus=64,
                                                   tasks=tasks)
@@ -77,25 +87,71 @@ def mutate(individual, max_cpus, mutation_rate):
             individual[i] = randint(1, max_cpus + 1)
 
 
+def tournament_batch(makespans, num_winners, num_competitors=3):
+    """
+    Perform num_winners tournaments at once, each between competitors randomly selected from the population, the
+    same as calling tournament num_winners times.
+
+    :param makespans: makespan for each individual in the population; list of int
+    :param num_winners: the number of tournaments; int
+    :param num_competitors: the number of competitors in a tournament; int
+    :return: the index in the population of the individual which won each competition; numpy array of int
+    """
+    makespans = np.asarray(makespans)
+    competitors = randint(0, makespans.size, (num_winners, num_competitors))
+    # argmin picks the first of equal makespans, so as in tournament a challenger has to be strictly better
+    return competitors[np.arange(num_winners), makespans[competitors].argmin(axis=1)]
+
+
+def crossover_batch(parents1, parents2, crossover_rate):
+    """
+    Perform a crossover event between each pair of parents at once, with frequency proportional to the given
+    crossover rate, the same as calling crossover on each pair.
+
+    :param parents1: the first parent of each pair, one individual per row; numpy array of int
+    :param parents2: the second parent of each pair; numpy array of int
+    :param crossover_rate: the rate at which crossover events should occur; float
+    :return: the first and second child of each pair; (numpy array of int, numpy array of int)
+    """
+    num_pairs, num_genes = parents1.shape
+    crossing = rand(num_pairs) < crossover_rate
+    x = randint(1, max(num_genes - 1, 2), num_pairs)  # crossover index, as in crossover
+
+    # Genes before the crossover index come from the first parent, the rest from the second, for the pairs crossing
+    first = (np.arange(num_genes)[None, :] < x[:, None]) | ~crossing[:, None]
+    return np.where(first, parents1, parents2), np.where(first, parents2, parents1)
+
+
+def mutate_batch(pop, max_cpus, mutation_rate):
+    """
+    Mutate every individual at once, the same as calling mutate on each. Mutates the population in place.
+
+    :param pop: the population, one individual per row; numpy array of int
+    :param max_cpus: max cpus, see mutate; int
+    :param mutation_rate: the rate at which mutation events should occur; float
+    """
+    mutating = rand(*pop.shape) < mutation_rate
+    pop[mutating] = randint(1, max_cpus + 1, np.count_nonzero(mutating))
+
+
 def cpu_objective(cpu_assn, file_sizes, max_memory, max_cpus, tasks):
     """
-    Objective function for optimizing task CPU assignment, i.e. run calc_makespan after setting cpus for each
-    task according to cpu_assn.
+    Objective function for optimizing task CPU assignment, i.e. run calc_makespan with the cpus for each task
+    given by cpu_assn. The tasks are not modified, so the same tasks can be scored concurrently.
 
     :param cpu_assn: a particular assignment of CPUs to tasks; tuple of int
     :return: the makespan for these parameters; int
     """
-    # Set each task's reserved cpus
-    for i, task in enumerate(tasks):
-        task_cpus = cpu_assn[i]
+    for task_cpus in cpu_assn:
         if task_cpus > max_cpus:
             raise Exception(f"Can't assign {task_cpus} to a task when the max is {max_cpus}")
-        task.cpus = task_cpus
 
-    return calc_makespan(file_sizes=file_sizes, max_memory=max_memory, max_cpus=max_cpus, tasks=tasks)
+    return calc_makespan(file_sizes=file_sizes, max_memory=max_memory, max_cpus=max_cpus, tasks=tasks,
+                         cpu_assignment=tuple(cpu_assn))
 
 
-def GA_cpus(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover_rate=0.9, mutation_rate=0.05):
+def GA_cpus(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover_rate=0.9, mutation_rate=0.05,
+            cache=None, workers=None, executor=None, seed=None, control=None, progress=None, verbose=False):
     """
     A simple genetic algorithm to find an approximately optimal task CPU assignment for minimizing makespan of a
     pipeline.
@@ -104,51 +160,92 @@ def GA_cpus(file_sizes, max_memory, max_cpus, tasks, rounds, pop_size, crossover
     :param max_memory: the memory limits of the machine; int
     :param max_cpus: the number of cores in the machine; int
     :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
-    :param rounds: number of rounds to run the genetic algorithm; int
+    :param rounds: number of rounds to run the genetic algorithm, or None to run until the control stops it; int
     :param pop_size: population size; int
     :param crossover_rate: proportion of the time a crossover event occurs; float
     :param mutation_rate: proportion of the time a mutation event occurs; float
+    :param cache: makespans of schedules already scored on this pipeline, e.g. shared with other optimizer runs,
+    or None to use a new cache; MakespanCache
+    :param workers: number of processes to score each generation with, or None to score in this process unless
+    an executor is given; int
+    :param executor: a process pool to score each generation with; concurrent.futures.Executor
+    :param seed: seed for the random number generator, a run with the same seed gives the same result whatever
+    the number of workers; int
+    :param control: budget and stall rule to stop early by, checked after every round, and where the best
+    schedule so far is reported, or None to run every round; RunControl
+    :param progress: called with the statistics of every round, e.g. a ProgressLog, or None; callable taking a
+    RoundStats
+    :param verbose: print the progress at most once a second, unless a progress callback is given, and the results;
+    bool
     :return: the lowest makespan and the assignment of cpus to tasks that achieved it; int, tuple of ints
     """
+    control = control if control is not None else RunControl()
+    if rounds is None and not control.limited:
+        raise Exception("GA_cpus needs a number of rounds or a control with a budget or patience to stop it")
+    control.start()
+    if verbose and progress is None:
+        progress = ProgressLog()
+
     num_tasks = len(tasks)
+    parallel = workers is not None or executor is not None
+
+    # Only this process draws random numbers, workers just score individuals
+    if seed is not None:
+        numpy_seed(seed)
 
-    # Create an initial population: an individual is a tuple of length num_tasks representing a CPU assignment
+    # Create an initial population: an individual is a row of length num_tasks representing a CPU assignment
     # of from 1 to max_cpus to each task
-    pop = [randint(1, max_cpus + 1, num_tasks).tolist() for x in range(pop_size)]
+    pop = randint(1, max_cpus + 1, (pop_size, num_tasks))
+
+    # Durations and memory of every task for every file and CPU count are calculated once for all rounds, and
+    # individuals scored before are looked up instead of simulated again
+    if cache is None:
+        cache = MakespanCache(CompiledPipeline(file_sizes, tasks, max_cpus, max_memory))
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(cache.pipeline, any_cpus=True)
 
     # Store best (and worst) makespans found so far and CPU assignments that achieved them
     best_cpu_assn, best_makespan = None, inf
     worst_cpu_assn, worst_makespan = None, 0  # just for curiosity
 
-    # Run the genetic algorithm for the specified number of rounds
-    for round in range(rounds):
-        # Score all individuals in the population
-        makespans = [cpu_objective(cpu_assn, file_sizes, max_memory, max_cpus, tasks) for cpu_assn in pop]
-
-        # Update best (and worst) solution found so far
-        for i in range(pop_size):
-            if makespans[i] <= best_makespan:
-                best_cpu_assn, best_makespan = pop[i], makespans[i]
-            if makespans[i] >= worst_makespan:
-                worst_cpu_assn, worst_makespan = pop[i], makespans[i]
-
-        print(f"Round {round}: best makespan {best_makespan} achieved with CPU assignment {best_cpu_assn}")
-
-        # Create the next generation
-        parents = [tournament(pop, pop_size, makespans) for x in range(pop_size)]
-        next_gen = list()
-        for i in range(0, pop_size, 2):
-            # Mate two parents who each won a tournament to create two children
-            parent1, parent2 = parents[i], parents[i + 1]
-            children = crossover(parent1, parent2, crossover_rate)
-            for child in children:
-                mutate(child, max_cpus, mutation_rate)
-                next_gen.append(child)
-
-        pop = next_gen
-
-    print(f"Final best makespan {best_makespan}, achieved using parameters {best_cpu_assn}")
-    print(f"Final worst makespan {worst_makespan}, achieved using parameters {worst_cpu_assn}")
+    with PoolEvaluator(cache.pipeline, workers, executor) if parallel else nullcontext() as evaluator:
+        # Run the genetic algorithm for the specified number of rounds
+        for round in range(rounds) if rounds is not None else count():
+            # Score all individuals in the population at once
+            makespans = cache.makespan_batch(file_orders=[file_sizes] * pop_size, cpu_assignments=pop,
+                                             evaluator=evaluator)
+
+            # Update best (and worst) solution found so far, the last individual of equal makespans wins
+            scores = np.asarray(makespans)
+            if scores.min() <= best_makespan:
+                i = pop_size - 1 - scores[::-1].argmin()
+                best_cpu_assn, best_makespan = pop[i].tolist(), makespans[i]
+            if scores.max() >= worst_makespan:
+                i = pop_size - 1 - scores[::-1].argmax()
+                worst_cpu_assn, worst_makespan = pop[i].tolist(), makespans[i]
+
+            control.record(best_makespan, best_cpu_assn)
+            control.iteration(pop_size)
+
+            if progress is not None:
+                progress(round_stats(round, makespans, best_makespan, best_cpu_assn, diversity(pop), control))
+            if control.should_stop():
+                if verbose:
+                    print(f"Stopping early: {control.stop_reason}")
+                break
+
+            # Create the next generation, mating pairs of parents who each won a tournament to create two children
+            parents = pop[tournament_batch(makespans, pop_size + pop_size % 2)]
+            children = crossover_batch(parents[0::2], parents[1::2], crossover_rate)
+            pop = np.stack(children, axis=1).reshape(-1, num_tasks)[:pop_size]
+            mutate_batch(pop, max_cpus, mutation_rate)
+
+    if verbose:
+        print(f"Final best makespan {best_makespan}, achieved using parameters {best_cpu_assn}")
+        print(f"Final worst makespan {worst_makespan}, achieved using parameters {worst_cpu_assn}")
+        print(f"Makespan cache: {cache.cache_info()}")
+        if control.gap() is not None:
+            print(f"Gap to the lower bound of {control.lower_bound}: {control.gap():.1%}")
 
     return best_makespan, best_cpu_assn
 
@@ -0,0 +1,72 @@
+import gc
+import tracemalloc
+from random import randint, seed
+from time import perf_counter
+
+from calc_makespan import calc_makespan, PipelineTask, Job, Sample, _job_columns
+
+
+def main():
+    """ Compare memory and allocations of the job object model against the job columns used by calc_makespan """
+    seed(5800)
+    num_samples, num_steps = 5000, 8
+    file_sizes = [randint(1, 60) for i in range(num_samples)]
+    tasks = [PipelineTask(name=f"Step {i}", step=i, time_factor=randint(1, 10), space_factor=randint(1, 3),
+                          cpus=randint(1, 8)) for i in range(num_steps)]
+
+    print(f"{num_samples} samples x {num_steps} steps = {num_samples * num_steps} jobs")
+    print(f"{'representation':<16}{'peak KiB':>12}{'blocks':>10}")
+
+    peak, blocks = measure(build_objects, file_sizes, tasks)
+    print(f"{'Job/Sample':<16}{peak / 1024:>12.1f}{blocks:>10}")
+
+    peak, blocks = measure(_job_columns, file_sizes, tasks, [task.cpus for task in tasks])
+    print(f"{'columns':<16}{peak / 1024:>12.1f}{blocks:>10}")
+
+    peak, blocks = measure(calc_makespan, file_sizes, 400, 32, tasks)
+    print(f"{'calc_makespan':<16}{peak / 1024:>12.1f}{'-':>10}")
+
+    # Garbage collections triggered while evaluating repeatedly, e.g. as an optimizer would
+    evaluations = 10
+    gc.collect()
+    collections = sum(stat["collections"] for stat in gc.get_stats())
+    start = perf_counter()
+    for i in range(evaluations):
+        calc_makespan(file_sizes, 400, 32, tasks)
+    elapsed = perf_counter() - start
+    collections = sum(stat["collections"] for stat in gc.get_stats()) - collections
+    print(f"{evaluations} evaluations: {elapsed / evaluations * 1000:.1f} ms each, {collections} garbage collections")
+
+
+def build_objects(file_sizes, tasks):
+    """
+    Build a Sample for each file and a Job for each (task, sample) pair, i.e. the objects a simulation had to
+    allocate before jobs were stored as columns.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :return: the jobs, row i column j contains ith task for the jth sample; list of lists of Job
+    """
+    samples = [Sample(i, size) for i, size in enumerate(file_sizes)]
+    return [[Job(sample, task) for sample in samples] for task in tasks]
+
+
+def measure(func, *args):
+    """
+    Call func with args while tracing memory allocations.
+
+    :param func: the function to measure; callable
+    :return: peak traced memory in bytes and number of memory blocks still held by the result; int, int
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak, blocks
+
+
+if __name__ == "__main__":
+    main()
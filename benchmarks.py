@@ -0,0 +1,339 @@
+import argparse
+import json
+import platform
+import subprocess
+from collections import namedtuple
+from datetime import datetime, timezone
+from random import Random
+from random import seed as random_seed
+from time import perf_counter
+
+import numpy as np
+
+from benchmark_memory import measure
+from calc_makespan import calc_makespan, CompiledPipeline, PipelineTask, SimulationStats
+from GA_optimize_both import GA_both
+from heuristics import best_heuristic
+from lower_bounds import pipeline_lower_bound
+from makespan_cache import MakespanCache
+from run_control import RunControl
+from simulated_annealing import joint_annealing, simulated_annealing
+
+# A synthetic problem, see synthetic_instance
+Instance = namedtuple("Instance", ["name", "file_sizes", "tasks", "max_cpus", "max_memory"])
+
+# Sizes of the problems makespan evaluation is timed on, files x steps
+THROUGHPUT_SIZES = [(files, steps) for files in (50, 200, 1000) for steps in (2, 4, 8)]
+QUICK_THROUGHPUT_SIZES = [(50, 2), (200, 4)]
+
+# Populations scored at once, files x steps x population size
+BATCH_SIZES = [(200, 4, 100), (200, 4, 1000), (1000, 4, 100)]
+QUICK_BATCH_SIZES = [(200, 4, 100)]
+
+# Problems the optimizers are run on
+OPTIMIZER_INSTANCES = [(40, 3), (100, 4)]
+QUICK_OPTIMIZER_INSTANCES = [(40, 3)]
+
+
+def main():
+    """ Run the benchmark suite, write the results as JSON and compare them against a baseline """
+    parser = argparse.ArgumentParser(description="Benchmark makespan evaluation and the optimizers")
+    parser.add_argument("--out", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--quick", action="store_true", help="fewer, smaller problems and shorter runs")
+    parser.add_argument("--budget", type=float, help="seconds each optimizer runs for")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative change in speed or memory counted as a regression")
+    args = parser.parse_args()
+
+    results = run_suite(quick=args.quick, time_budget=args.budget)
+    write_results(results, args.out)
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+def synthetic_instance(num_files, num_steps, seed=0):
+    """
+    A fixed random problem: the same arguments always give the same files and tasks, so runs of the suite on
+    different versions of the code are comparable. Files are 1 to 100 units, tasks take 1 to 10 time units and 1 to
+    3 memory units per unit of file on 1, 2, 4 or 8 CPUs, on a machine with 32 CPUs and memory for about 8 average
+    files at once.
+
+    :param num_files: the number of files; int
+    :param num_steps: the number of steps in the pipeline; int
+    :param seed: which of the problems of this size; int
+    :return: the problem; Instance
+    """
+    rng = Random(f"{num_files}x{num_steps}/{seed}")
+    file_sizes = [rng.randint(1, 100) for i in range(num_files)]
+    tasks = [PipelineTask(name=f"Step {step}", step=step, time_factor=rng.randint(1, 10),
+                          space_factor=rng.randint(1, 3), cpus=rng.choice((1, 2, 4, 8))) for step in range(num_steps)]
+    return Instance(f"{num_files}x{num_steps}/{seed}", file_sizes, tasks, max_cpus=32, max_memory=800)
+
+
+def run_suite(quick=False, time_budget=None, seeds=None):
+    """
+    Run every benchmark.
+
+    :param quick: fewer, smaller problems and shorter runs, e.g. to check the suite works; bool
+    :param time_budget: seconds each optimizer runs for, or None for 1 second when quick and 10 otherwise; float
+    :param seeds: seeds each optimizer is run with, or None for 0 to 2 (just 0 when quick); list of int
+    :return: the results and what they were measured on, as written by write_results; dict
+    """
+    time_budget = time_budget if time_budget is not None else 1 if quick else 10
+    seeds = seeds if seeds is not None else [0] if quick else [0, 1, 2]
+    min_time = 0.2 if quick else 1
+
+    results = {"meta": environment(), "throughput": [], "batch": [], "memory": [], "optimizers": []}
+    for num_files, num_steps in QUICK_THROUGHPUT_SIZES if quick else THROUGHPUT_SIZES:
+        instance = synthetic_instance(num_files, num_steps)
+        results["throughput"].append(bench_throughput(instance, min_time))
+        print(f"Throughput {instance.name}: {results['throughput'][-1]}")
+
+    for num_files, num_steps, pop_size in QUICK_BATCH_SIZES if quick else BATCH_SIZES:
+        results["batch"].append(bench_batch(synthetic_instance(num_files, num_steps), pop_size))
+        print(f"Batch {results['batch'][-1]}")
+
+    for num_files, num_steps in QUICK_THROUGHPUT_SIZES[-1:] if quick else THROUGHPUT_SIZES[-1:]:
+        results["memory"].append(bench_memory(synthetic_instance(num_files, num_steps)))
+        print(f"Memory {results['memory'][-1]}")
+
+    for num_files, num_steps in QUICK_OPTIMIZER_INSTANCES if quick else OPTIMIZER_INSTANCES:
+        instance = synthetic_instance(num_files, num_steps)
+        for optimizer in OPTIMIZERS:
+            for seed in seeds:
+                results["optimizers"].append(bench_optimizer(optimizer, instance, time_budget, seed))
+                run = results["optimizers"][-1]
+                gap = f", gap {run['gap']:.1%}" if run["gap"] is not None else ""
+                print(f"{optimizer} on {instance.name}, seed {seed}: {run['makespan']} in {run['seconds']:.2f}s{gap}")
+
+    return results
+
+
+def environment():
+    """
+    What the benchmarks run on, so results from different machines or versions aren't mistaken for a regression.
+
+    :return: the time, code version and machine; dict
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"time": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "processor": platform.processor(), "system": platform.system()}
+
+
+def bench_throughput(instance, min_time=1.0):
+    """
+    Time evaluating random orders of a problem: calc_makespan from scratch, CompiledPipeline.makespan one order at a
+    time, and CompiledPipeline.makespan_batch 64 orders at a time.
+
+    :param instance: the problem; Instance
+    :param min_time: least seconds to time each way of evaluating for, split into 5 repeats; float
+    :return: the size of the problem and the most evaluations per second of any repeat of each way; dict
+    """
+    rng = Random(0)
+    orders = [rng.sample(instance.file_sizes, len(instance.file_sizes)) for i in range(64)]
+    pipeline = CompiledPipeline(instance.file_sizes, instance.tasks, instance.max_cpus, instance.max_memory)
+
+    def rate(evaluate, per_call, repeats=5):
+        # The best of several repeats, as other processes only ever slow a repeat down
+        rates = []
+        for repeat in range(repeats):
+            calls, start = 0, perf_counter()
+            while calls == 0 or perf_counter() - start < min_time / repeats:
+                evaluate(orders[calls % len(orders)])
+                calls += 1
+            rates.append(calls * per_call / (perf_counter() - start))
+        return max(rates)
+
+    return {"instance": instance.name, "files": len(instance.file_sizes), "steps": len(instance.tasks),
+            "calc_makespan": rate(lambda order: calc_makespan(order, instance.max_memory, instance.max_cpus,
+                                                              instance.tasks), 1),
+            "makespan": rate(pipeline.makespan, 1),
+            "makespan_batch": rate(lambda order: pipeline.makespan_batch(orders), len(orders))}
+
+
+def bench_batch(instance, pop_size, repeats=3):
+    """
+    Time scoring a GA population with random file orders and CPUs: CompiledPipeline.makespan_batch for the whole
+    population at once, and a loop of CompiledPipeline.makespan over it. Batch scoring is only worth having while it
+    is at least as fast as the loop.
+
+    :param instance: the problem; Instance
+    :param pop_size: the number of schedules in the population; int
+    :param repeats: times to score the population each way, keeping the quickest; int
+    :return: the size of the problem and the population, and the evaluations per second of each way; dict
+    """
+    rng = Random(0)
+    orders = [rng.sample(instance.file_sizes, len(instance.file_sizes)) for i in range(pop_size)]
+    cpus = [[rng.randint(1, instance.max_cpus) for task in instance.tasks] for i in range(pop_size)]
+    pipeline = CompiledPipeline(instance.file_sizes, instance.tasks, instance.max_cpus, instance.max_memory)
+
+    def rate(evaluate):
+        seconds = []
+        for repeat in range(repeats):
+            start = perf_counter()
+            evaluate()
+            seconds.append(perf_counter() - start)
+        return pop_size / min(seconds)
+
+    return {"instance": instance.name, "files": len(instance.file_sizes), "steps": len(instance.tasks),
+            "population": pop_size,
+            "makespan_batch": rate(lambda: pipeline.makespan_batch(orders, cpus)),
+            "makespan_loop": rate(lambda: [pipeline.makespan(order, order_cpus)
+                                           for order, order_cpus in zip(orders, cpus)])}
+
+
+def bench_memory(instance):
+    """
+    Measure the peak memory of evaluating a problem with calc_makespan and with CompiledPipeline.makespan_batch.
+
+    :param instance: the problem; Instance
+    :return: the size of the problem and the peak traced memory in KiB of each; dict
+    """
+    rng = Random(0)
+    orders = [rng.sample(instance.file_sizes, len(instance.file_sizes)) for i in range(64)]
+    pipeline = CompiledPipeline(instance.file_sizes, instance.tasks, instance.max_cpus, instance.max_memory)
+    return {"instance": instance.name, "files": len(instance.file_sizes), "steps": len(instance.tasks),
+            "calc_makespan": measure(calc_makespan, instance.file_sizes, instance.max_memory, instance.max_cpus,
+                                     instance.tasks)[0] / 1024,
+            "makespan_batch": measure(pipeline.makespan_batch, orders)[0] / 1024}
+
+
+def bench_optimizer(optimizer, instance, time_budget, seed):
+    """
+    Run an optimizer on a problem for a time budget, recording its best makespan every time it improves.
+
+    :param optimizer: the name of the optimizer in OPTIMIZERS; str
+    :param instance: the problem; Instance
+    :param time_budget: seconds the optimizer runs for; float
+    :param seed: seed for the optimizer's random numbers; int
+    :return: the optimizer, problem and seed, the best makespan found and the lower bound, the time and evaluations
+    taken, the time-to-quality curve as [seconds, evaluations, makespan] at every improvement, and what the
+    simulations of the run did, see SimulationStats; dict
+    """
+    curve = []
+    control = RunControl(time_budget=time_budget)
+    control.on_improvement = lambda makespan, params: curve.append([control.elapsed(), control.evaluations,
+                                                                    makespan])
+    pipeline = CompiledPipeline(instance.file_sizes, instance.tasks, instance.max_cpus, instance.max_memory)
+    control.lower_bound = pipeline_lower_bound(pipeline, any_cpus=optimizer in ("GA_both", "joint_annealing"))
+    pipeline.stats = SimulationStats()
+
+    start = perf_counter()
+    OPTIMIZERS[optimizer](instance, control, seed, MakespanCache(pipeline))
+    seconds = perf_counter() - start
+
+    makespan = control.best()[0]
+    return {"optimizer": optimizer, "instance": instance.name, "seed": seed, "makespan": makespan,
+            "lower_bound": control.lower_bound, "gap": control.gap(), "seconds": seconds,
+            "evaluations": control.evaluations, "curve": curve, "simulation": pipeline.stats.as_dict()}
+
+
+def _run_heuristics(instance, control, seed, cache):
+    """ Best of the constructive heuristics, a baseline every optimizer should beat """
+    makespan, order = best_heuristic(instance.file_sizes, instance.max_memory, instance.max_cpus, instance.tasks,
+                                     pipeline=cache.pipeline)
+    control.start()
+    control.record(makespan, order)
+    control.iteration(len(order))
+
+
+def _run_GA_both(instance, control, seed, cache):
+    """ GA over file order and CPUs, stopped by the control's time budget """
+    GA_both(instance.file_sizes, instance.max_memory, instance.max_cpus, instance.tasks, rounds=None, pop_size=100,
+            crossover_rate=0.9, mutation_rate=0.05, seed=seed, cache=cache, control=control)
+
+
+def _run_simulated_annealing(instance, control, seed, cache):
+    """ Annealing over file order only, with the CPUs set on the tasks """
+    random_seed(seed)
+    simulated_annealing(instance.file_sizes, instance.max_memory, instance.max_cpus, instance.tasks, temp_arr=[],
+                        makespan_arr=[], cache=cache, control=control)
+
+
+def _run_joint_annealing(instance, control, seed, cache):
+    """ Annealing over file order and CPUs together, in this process """
+    joint_annealing(instance.file_sizes, instance.max_memory, instance.max_cpus, instance.tasks,
+                    max_evaluations=None, seed=seed, cache=cache, control=control)
+
+
+# Each optimizer benchmarked, by name
+OPTIMIZERS = {"heuristics": _run_heuristics, "GA_both": _run_GA_both,
+              "simulated_annealing": _run_simulated_annealing, "joint_annealing": _run_joint_annealing}
+
+
+def write_results(results, path):
+    """
+    Write benchmark results as JSON.
+
+    :param results: the results of run_suite; dict
+    :param path: the file to write; str
+    """
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def compare(baseline, current, tolerance=0.2, quality_tolerance=0.01):
+    """
+    Find what got worse between two runs of the suite: evaluation that got slower or used more memory by more than
+    tolerance, or an optimizer whose mean makespan over its seeds got higher by more than quality_tolerance. Only
+    benchmarks in both runs are compared, and speed is only comparable between runs on the same machine.
+
+    :param baseline: the results of the earlier run; dict
+    :param current: the results of the run to check; dict
+    :param tolerance: relative change in speed or memory counted as a regression, e.g. 0.2 for 20%, as runs on a
+    busy machine vary by 10% or more; float
+    :param quality_tolerance: relative increase in mean makespan counted as a regression; float
+    :return: a description of each regression; list of str
+    """
+    regressions = []
+
+    def rows(results, section, key):
+        return {tuple(row[k] for k in key): row for row in results.get(section, [])}
+
+    for section, key_fields, higher_is_better in (("throughput", ["instance"], True),
+                                                  ("batch", ["instance", "population"], True),
+                                                  ("memory", ["instance"], False)):
+        before, after = rows(baseline, section, key_fields), rows(current, section, key_fields)
+        for key in before.keys() & after.keys():
+            for metric, old in before[key].items():
+                new = after[key].get(metric)
+                if metric in ("instance", "files", "steps", "population") or not old or new is None:
+                    continue
+                change = (new - old) / old
+                if (change < -tolerance) if higher_is_better else (change > tolerance):
+                    where = key[0] if len(key) == 1 else f"{key[0]} with a population of {key[1]}"
+                    regressions.append(f"{section} {metric} on {where}: {old:.1f} -> {new:.1f} ({change:+.0%})")
+
+    def mean_makespans(results):
+        runs = {}
+        for run in results.get("optimizers", []):
+            runs.setdefault((run["optimizer"], run["instance"]), []).append(run["makespan"])
+        return {key: sum(makespans) / len(makespans) for key, makespans in runs.items()}
+
+    before, after = mean_makespans(baseline), mean_makespans(current)
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] if before[key] > 0 else 0
+        if change > quality_tolerance:
+            regressions.append(f"{key[0]} on {key[1]}: mean makespan {before[key]:.1f} -> {after[key]:.1f} "
+                               f"({change:+.1%})")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,533 @@
+from bisect import insort
+from heapq import heappop, heappush
+from itertools import product
+from math import ceil, inf
+from random import sample
+from timeit import default_timer
+
+import numpy as np
+
+from calc_makespan import CompiledPipeline, PipelineTask
+from lower_bounds import pipeline_lower_bound
+from run_control import RunControl
+from time_brute import brute_force_order
+
+
+def main():
+    """ Compare the exact branch and bound solver against brute force, then solve instances brute force can't """
+    task_a = PipelineTask(name="A", step=0, time_factor=4, space_factor=1, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=6, space_factor=1, cpus=12)
+    tasks = [task_a, task_b]
+
+    file_sizes = sample(range(1, 20), 8)
+    start = default_timer()
+    opt_makespan, opt_order = brute_force_order(file_sizes, max_memory=64, max_cpus=16, tasks=tasks)
+    print(f"Brute force: {opt_makespan} with order {opt_order} in {default_timer() - start:.2f}s")
+
+    start = default_timer()
+    best_makespan, best_order = branch_and_bound_order(file_sizes, max_memory=64, max_cpus=16, tasks=tasks)
+    print(f"Branch and bound: {best_makespan} with order {best_order} in {default_timer() - start:.2f}s")
+
+    for file_sizes in ([25, 15, 10, 5, 33, 8, 22, 9, 18, 18, 28, 42, 37],
+                       [8, 9, 10, 12, 7, 15, 22, 19, 11, 37, 45, 44, 2, 11, 5]):
+        start = default_timer()
+        best_makespan, best_order = branch_and_bound_order(file_sizes, max_memory=64, max_cpus=16, tasks=tasks)
+        print(f"Branch and bound, {len(file_sizes)} files: {best_makespan} with order {best_order} "
+              f"in {default_timer() - start:.2f}s")
+
+
+def branch_and_bound_order(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, control=None):
+    """
+    Find the input order of the given file_sizes with the lowest makespan, the same optimum brute_force_order
+    finds. Orders are built one file at a time, and a partial order is dropped as soon as a lower bound on every
+    order starting with it is no better than the best order found so far.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param control: budget to stop early by, checked for every partial order, and where the best order so far is
+    reported, or None to search until the optimum is proven; RunControl
+    :return: the optimal makespan and the parameters used, the best found if stopped early; (int, tuple of int)
+    """
+    pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    control = control if control is not None else RunControl()
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(pipeline, cpu_assignment)
+    return _OrderSearch(pipeline, cpu_assignment).solve(control=control)
+
+
+def branch_and_bound(file_sizes, max_memory, max_cpus, tasks, control=None):
+    """
+    Find the input order of the given file_sizes and the task cpu assignment with the lowest makespan, the same
+    optimum brute_force finds. CPU assignments are searched in order of their lower bound, and stop once no
+    remaining assignment's bound beats the best schedule found so far.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param control: budget to stop early by, checked for every partial order, and where the best schedule so far
+    is reported, or None to search until the optimum is proven; RunControl
+    :return: the optimal makespan and the parameters used, the best found if stopped early; (int, tuple of tuples
+    of ints)
+    """
+    control = control if control is not None else RunControl()
+    control.start()
+    pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(pipeline, any_cpus=True)
+    cpu_assns = product(*[range(1, max_cpus + 1) for task in tasks])  # each task can use between 1 and the max cpus
+
+    searches = sorted((_OrderSearch(pipeline, cpu_assn) for cpu_assn in cpu_assns),
+                      key=lambda search: search.lower_bound)
+
+    best_makespan, best_params = inf, None
+    for search in searches:
+        if search.lower_bound >= best_makespan:
+            break  # no remaining assignment can do better
+
+        makespan, order = search.solve(best_makespan, control, with_cpus=True)
+        if makespan < best_makespan:
+            best_makespan, best_params = makespan, (order, search.cpu_assignment)
+        if control.should_stop():
+            break
+
+    return best_makespan, best_params
+
+
+class _OrderSearch:
+    """
+    Depth first branch and bound over the distinct orders of a pipeline's files for one CPU assignment.
+
+    A partial order is simulated exactly for as long as the files not yet placed provably can't start: at every
+    point where jobs are scheduled, the step 0 jobs of placed files are checked first, so while the resources
+    they leave can't fit the smallest unplaced file's first job, the schedule so far doesn't depend on how the
+    rest is ordered. Bounds then come from that exact partial schedule.
+    """
+
+    max_groups = 8  # serial groups checked per partial order
+
+    def __init__(self, pipeline, cpu_assignment=None):
+        """
+        Construct a new instance of class _OrderSearch.
+
+        :param pipeline: the pipeline to schedule; CompiledPipeline
+        :param cpu_assignment: CPUs assigned to each task in the order the tasks were given, or None for the CPUs
+        set on the tasks; list of int
+        """
+        if pipeline.valid and not pipeline.linear:
+            raise Exception("Branch and bound only supports pipelines with one task per step, not DAG pipelines")
+        self.pipeline = pipeline
+        self.cpu_assignment = tuple(cpu_assignment if cpu_assignment is not None else pipeline.default_cpus)
+        self.max_cpus = pipeline.max_cpus
+        self.max_memory = pipeline.max_memory
+
+        # Distinct file sizes and how many files have each, orders only branch once per distinct size
+        self.values = pipeline.sizes.tolist()
+        counts = {size: 0 for size in self.values}
+        for size in pipeline.file_sizes:
+            counts[size] += 1
+        self.counts = [counts[size] for size in self.values]
+        self.num_files = len(pipeline.file_sizes)
+
+        self.feasible = pipeline.valid and (self.num_files == 0 or
+                                            (pipeline.feasible and max(self.cpu_assignment) <= self.max_cpus))
+        if not self.feasible:
+            self.lower_bound = -1
+            return
+
+        # Durations and memory of each step for each distinct size, e.g. duration[i][v] is step i on values[v]
+        self.cpus = [self.cpu_assignment[i] for i in pipeline.step_order]
+        self.duration = [pipeline.duration[step][cpus - 1] for step, cpus in enumerate(self.cpus)]
+        self.memory = pipeline.memory
+        self.num_steps = len(self.cpus)
+
+        # Time left for a sample from the start of a step, and CPU / memory area of the remaining steps
+        num_values = len(self.values)
+        self.tail = [[0] * num_values for step in range(self.num_steps + 1)]
+        self.cpu_area = [[0] * num_values for step in range(self.num_steps + 1)]
+        self.mem_area = [[0] * num_values for step in range(self.num_steps + 1)]
+        for step in reversed(range(self.num_steps)):
+            for v in range(num_values):
+                duration = self.duration[step][v]
+                self.tail[step][v] = self.tail[step + 1][v] + duration
+                self.cpu_area[step][v] = self.cpu_area[step + 1][v] + duration * self.cpus[step]
+                self.mem_area[step][v] = self.mem_area[step + 1][v] + duration * self.memory[step][v]
+
+        # Jobs of a step can only run a few at a time, and jobs that pairwise never fit together run one after
+        # another, so their work adds up
+        self.capacity = [min(self.max_cpus // self.cpus[step],
+                             self.max_memory // max(min(self.memory[step]), 1) if num_values else 1)
+                         for step in range(self.num_steps)]
+        self.min_tail = [min(self.tail[step + 1], default=0) for step in range(self.num_steps)]
+        work = [[self.duration[step][v] * self.counts[v] for v in range(num_values)]
+                for step in range(self.num_steps)]
+        self._group_jobs(work)
+        bottleneck = max((min(self.tail[0][v] - self.tail[step][v] for v in range(num_values)) +
+                          sum(work[step]) / self.capacity[step] + self.min_tail[step]
+                          for step in range(self.num_steps) if num_values), default=0)
+        bottleneck = max(bottleneck, self._group_bound(work, self.group_head))
+
+        # Bounds are rounded up when every duration is a whole number
+        self.whole = all(float(duration).is_integer() for step in self.duration for duration in step)
+        self.lower_bound = self._round(max(
+            max((self.tail[0][v] for v in range(num_values)), default=0),
+            sum(self.cpu_area[0][v] * self.counts[v] for v in range(num_values)) / self.max_cpus,
+            sum(self.mem_area[0][v] * self.counts[v] for v in range(num_values)) / self.max_memory,
+            bottleneck))
+
+    def _group_jobs(self, work):
+        """
+        Find serial groups, i.e. groups of jobs no two of which can run at the same time because together they
+        need more CPUs or memory than there is, and which jobs of a group every other job fits beside. Jobs are
+        told apart by step and file size, so where several files have the same size their jobs must not fit
+        beside each other either. Groups are grown greedily from each job, heaviest work first.
+
+        :param work: work of the whole pipeline per step and size index; list of lists
+        """
+        # Everything is over every (step, size index), flattened step by step
+        num_values = len(self.values)
+        self.job_cpus = np.repeat(np.array(self.cpus, dtype=float), num_values)
+        self.job_memory = np.array(self.memory, dtype=float).ravel()
+        apart = ((self.job_cpus[:, None] + self.job_cpus[None, :] > self.max_cpus) |
+                 (self.job_memory[:, None] + self.job_memory[None, :] > self.max_memory))
+        job_work = np.ravel(work)
+        counts = np.tile(self.counts, self.num_steps)
+        job_step = np.repeat(np.arange(self.num_steps), num_values)
+
+        jobs = [job for job in np.argsort(-job_work, kind="stable").tolist()
+                if job_work[job] > 0 and (counts[job] == 1 or apart[job, job])]
+
+        # Grow each group from one job of one step, and also on to other steps, since jobs left out of a group may
+        # use the CPUs its jobs leave
+        groups = set()
+        for first in jobs:
+            for candidates in ([job for job in jobs if job_step[job] == job_step[first]], jobs):
+                group, allowed = [first], apart[first].copy()
+                for job in candidates:
+                    if allowed[job] and job != first:
+                        group.append(job)
+                        allowed &= apart[job]
+                if len(group) > 1 or counts[first] > 1:
+                    groups.add(tuple(sorted(group)))
+        groups = sorted(groups)
+
+        self.in_group = np.zeros((len(groups), len(job_work)))
+        for i, group in enumerate(groups):
+            self.in_group[i, list(group)] = 1
+        # Time each job can run beside a group, counting every file of its size as they may run side by side
+        self.fits_beside = (1 - self.in_group)[:, :, None] * self.in_group[:, None, :] * ~apart * counts[:, None]
+        tail = np.array(self.tail[1:], dtype=float).ravel()
+        head = np.array([[self.tail[0][v] - self.tail[step][v] for v in range(num_values)]
+                         for step in range(self.num_steps)], dtype=float).ravel()
+        self.group_tail = np.array([tail[list(group)].min() for group in groups])
+        self.group_head = np.array([head[list(group)].min() for group in groups])
+
+        # Only keep the groups that bound the whole pipeline best, as every group is checked at every order tried
+        best = np.argsort(-self._group_times(work, self.group_head), kind="stable")[:self.max_groups]
+        self.in_group, self.fits_beside = self.in_group[best], self.fits_beside[best]
+        self.group_tail, self.group_head = self.group_tail[best], self.group_head[best]
+
+    def _group_bound(self, work, head=0):
+        """
+        Time needed for the work left of the serial groups.
+
+        :param work: work left per step and size index; list of lists
+        :param head: time before each group can start; numpy array
+        :return: the time needed from now, the longest over the groups; float
+        """
+        return float(np.max(self._group_times(work, head))) if len(self.in_group) else 0
+
+    def _group_times(self, work, head=0):
+        """
+        Time needed for the work left of each serial group. The jobs of a group run one after another, the sample
+        of its last job still has the steps after it to do, and jobs of other steps share the machine with the
+        group only in the CPUs and memory its jobs leave, and only while one they fit beside runs, so the area
+        that doesn't fit beside the group needs time of its own.
+
+        :param work: work left per step and size index; list of lists
+        :param head: time before each group can start; numpy array
+        :return: the time needed from now for each group; numpy array
+        """
+        work = np.ravel(work)
+        group_work = self.in_group @ work
+        beside_time = self.fits_beside @ work
+        tail = np.where(group_work > 0, self.group_tail, 0)
+        bound = head + tail
+
+        # The same for CPUs and memory
+        for use, limit in ((self.job_cpus, self.max_cpus), (self.job_memory, self.max_memory)):
+            area = work * use
+            spare_area = group_work * limit - self.in_group @ area
+            beside_area = np.minimum(area, use * beside_time).sum(axis=1)
+            other_area = (1 - self.in_group) @ area - np.minimum(beside_area, spare_area)
+            bound = np.maximum(bound, other_area / limit)
+        return group_work + bound
+
+    def solve(self, best_makespan=inf, control=None, with_cpus=False):
+        """
+        Search for the best order.
+
+        :param best_makespan: only orders with a lower makespan than this are looked for; int
+        :param control: budget to stop early by and where better orders are reported, or None to search until
+        the optimum is proven; RunControl
+        :param with_cpus: report the order and the CPU assignment to the control instead of just the order; bool
+        :return: the optimal makespan and order, the best found if stopped early, or best_makespan and None if no
+        order beats it; (int, tuple)
+        """
+        if not self.feasible:
+            return -1, tuple(self.pipeline.file_sizes)
+
+        self.control = control if control is not None else RunControl()
+        self.control.start()
+        self.with_cpus = with_cpus
+        self.best_makespan, self.best_order = best_makespan, None
+
+        # Start from the best of a few simple orders so pruning starts early
+        for order in (self.pipeline.file_sizes, sorted(self.pipeline.file_sizes, reverse=True),
+                      sorted(self.pipeline.file_sizes)):
+            makespan = self.pipeline.makespan(order, self.cpu_assignment)
+            if makespan < self.best_makespan:
+                self._improve(makespan, tuple(order))
+            self.control.iteration()
+
+        if self.best_makespan > self.lower_bound:
+            self.seen = set()  # schedules already reached by another partial order, which leave the same search
+            root = _PartialSchedule(self.num_steps, self.max_cpus, self.max_memory)
+            self._advance(root, self.num_files)
+            self._visit(root, self.num_files)
+
+        return self.best_makespan, self.best_order
+
+    def _visit(self, state, remaining):
+        """
+        Try every distinct next file after a partial order, most promising first.
+
+        :param state: the exact schedule of the partial order; _PartialSchedule
+        :param remaining: number of files not placed yet; int
+        """
+        if remaining == 0:
+            if state.makespan < self.best_makespan:
+                self._improve(state.makespan, tuple(self.values[v] for v in state.order))
+            return
+        if self.control.should_stop():
+            return
+
+        children = []
+        for v, count in enumerate(self.counts):
+            if count == 0:
+                continue
+            self.counts[v] -= 1
+            child = state.copy()
+            child.order.append(v)
+            child.ready[0].append(len(child.order) - 1)
+            self._advance(child, remaining - 1)
+            if remaining <= 2:
+                self._visit(child, remaining - 1)  # at most one order left to try, cheaper than bounding it
+            else:
+                key = (tuple(self.counts), child.key())
+                if key not in self.seen:
+                    self.seen.add(key)
+                    bound = self._bound(child, remaining - 1)
+                    self.control.iteration()
+                    if bound < self.best_makespan:
+                        children.append((bound, v, child))
+            self.counts[v] += 1
+
+        children.sort(key=lambda item: item[:2])
+        for bound, v, child in children:
+            if bound >= self.best_makespan or self.best_makespan <= self.lower_bound:
+                break  # the rest can't do better, or the best order is already proven optimal
+            self.counts[v] -= 1
+            self._visit(child, remaining - 1)
+            self.counts[v] += 1
+
+    def _improve(self, makespan, order):
+        """
+        Keep a new best order and report it to the control.
+
+        :param makespan: the makespan of the order; int
+        :param order: the file sizes in processing order; tuple of int
+        """
+        self.best_makespan, self.best_order = makespan, order
+        self.control.record(makespan, (order, self.cpu_assignment) if self.with_cpus else order)
+
+    def _advance(self, state, remaining):
+        """
+        Simulate a partial order for as long as the files not placed yet can't start, or to the end if every
+        file is placed. Stops before the first round of scheduling in which an unplaced file might start.
+
+        :param state: the schedule of the partial order, modified in place; _PartialSchedule
+        :param remaining: number of files not placed yet; int
+        """
+        duration, memory, cpus, order = self.duration, self.memory, self.cpus, state.order
+        running, ready, num_steps = state.running, state.ready, self.num_steps
+        available_cpus, available_mem, t = state.available_cpus, state.available_mem, state.t
+        min_memory = min((memory[0][v] for v, count in enumerate(self.counts) if count > 0), default=inf) \
+            if remaining > 0 else inf
+
+        while True:
+            # Step 0 jobs of placed files are checked first, see what they leave for the unplaced files
+            if remaining > 0:
+                left_cpus, left_mem = available_cpus, available_mem
+                for position in ready[0]:
+                    if cpus[0] <= left_cpus and memory[0][order[position]] <= left_mem:
+                        left_cpus -= cpus[0]
+                        left_mem -= memory[0][order[position]]
+                if cpus[0] <= left_cpus and min_memory <= left_mem:
+                    break
+
+            # Schedule every job that fits, step by step, then in file order
+            for step in range(num_steps):
+                if not ready[step]:
+                    continue
+                waiting = []
+                step_cpus, step_memory, step_duration = cpus[step], memory[step], duration[step]
+                for position in ready[step]:
+                    v = order[position]
+                    if step_cpus <= available_cpus and step_memory[v] <= available_mem:
+                        available_cpus -= step_cpus
+                        available_mem -= step_memory[v]
+                        heappush(running, (t + step_duration[v], position, step))
+                    else:
+                        waiting.append(position)
+                ready[step] = waiting
+
+            if not running:
+                break
+
+            # Move clock forward to the next job end and finish every job ending then
+            t = running[0][0]
+            while running and running[0][0] == t:
+                end, position, step = heappop(running)
+                available_cpus += cpus[step]
+                available_mem += memory[step][order[position]]
+                if step + 1 < num_steps:
+                    insort(ready[step + 1], position)
+            state.makespan = t
+
+        state.available_cpus, state.available_mem, state.t = available_cpus, available_mem, t
+
+    def _bound(self, state, remaining):
+        """
+        Lower bound on the makespan of every order starting with a partial order.
+
+        :param state: the schedule of the partial order, advanced as far as it is exact; _PartialSchedule
+        :param remaining: number of files not placed yet; int
+        :return: the lower bound; int
+        """
+        if remaining == 0 and not state.running:
+            return state.makespan
+
+        t, order, duration = state.t, state.order, self.duration
+        bound = self.lower_bound
+        cpu_area = mem_area = 0
+        work = [[0] * len(self.counts) for step in range(self.num_steps)]  # work left per step and file size
+
+        # Unplaced files start no earlier than now
+        if remaining > 0:
+            for v, count in enumerate(self.counts):
+                if count > 0:
+                    bound = max(bound, t + self.tail[0][v])
+                    cpu_area += self.cpu_area[0][v] * count
+                    mem_area += self.mem_area[0][v] * count
+                    for step in range(self.num_steps):
+                        work[step][v] += duration[step][v] * count
+
+        # Running jobs end when scheduled, waiting jobs start no earlier than now
+        for end, position, step in state.running:
+            v = order[position]
+            bound = max(bound, end + self.tail[step + 1][v])
+            cpu_area += (end - t) * self.cpus[step] + self.cpu_area[step + 1][v]
+            mem_area += (end - t) * self.memory[step][v] + self.mem_area[step + 1][v]
+            work[step][v] += end - t
+            for later in range(step + 1, self.num_steps):
+                work[later][v] += duration[later][v]
+        for step, waiting in enumerate(state.ready):
+            for position in waiting:
+                v = order[position]
+                bound = max(bound, t + self.tail[step][v])
+                cpu_area += self.cpu_area[step][v]
+                mem_area += self.mem_area[step][v]
+                for later in range(step, self.num_steps):
+                    work[later][v] += duration[later][v]
+
+        # What is left must fit in the machine from now on
+        bound = max(bound, t + cpu_area / self.max_cpus, t + mem_area / self.max_memory)
+        for step in range(self.num_steps):
+            step_work = sum(work[step])
+            if step_work:
+                bound = max(bound, t + step_work / self.capacity[step] + self.min_tail[step])
+        if self._round(bound) < self.best_makespan:  # only worth the serial groups if the rest didn't prune
+            bound = max(bound, t + self._group_bound(work))
+        return self._round(bound)
+
+    def _round(self, bound):
+        """
+        Round a lower bound up to a whole time unit when every duration is a whole number.
+
+        :param bound: a lower bound on the makespan; float
+        :return: the bound; int or float
+        """
+        return ceil(bound - 1e-9) if self.whole else bound
+
+
+class _PartialSchedule:
+    """
+    The exact state of the schedule of a partial order at the current time point.
+    """
+
+    __slots__ = ("order", "t", "available_cpus", "available_mem", "running", "ready", "makespan")
+
+    def __init__(self, num_steps, max_cpus, max_memory):
+        """
+        Construct a new instance of class _PartialSchedule, with nothing placed at time 0.
+
+        :param num_steps: number of steps in the pipeline; int
+        :param max_cpus: the number of cores in the machine; int
+        :param max_memory: the memory limits of the machine; int
+        """
+        self.order = []  # index of the size of each placed file
+        self.t = 0
+        self.available_cpus = max_cpus
+        self.available_mem = max_memory
+        self.running = []  # min-heap of (end time, position, step) for running jobs
+        self.ready = [[] for step in range(num_steps)]  # positions waiting to start each step, in file order
+        self.makespan = 0
+
+    def key(self):
+        """
+        Identify the schedule by what is left of it. Files that have finished don't matter any more, and for the
+        others only their relative order does, so different partial orders can leave identical schedules.
+
+        :return: the time and the size index, step and end time (None if waiting) of each unfinished file in file
+        order; tuple
+        """
+        jobs = {position: (step, end) for end, position, step in self.running}
+        for step, waiting in enumerate(self.ready):
+            for position in waiting:
+                jobs[position] = (step, None)
+        return self.t, tuple((self.order[position],) + jobs[position] for position in sorted(jobs))
+
+    def copy(self):
+        """
+        Copy the schedule so a different file can be placed next.
+
+        :return: the copy; _PartialSchedule
+        """
+        state = _PartialSchedule.__new__(_PartialSchedule)
+        state.order = self.order.copy()
+        state.t = self.t
+        state.available_cpus = self.available_cpus
+        state.available_mem = self.available_mem
+        state.running = self.running.copy()
+        state.ready = [waiting.copy() for waiting in self.ready]
+        state.makespan = self.makespan
+        return state
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,18 @@ Pipeline Scheduling Optimization
 Liz Codd, Rachel Dao, Evan Haines, Gino Romanello
 7/23/22
 """
+import csv
+from bisect import bisect_right, insort
+from collections import namedtuple
+from heapq import heapify, heappop, heappush
 from math import inf, log2, sqrt
+from time import perf_counter
 
+import numpy as np
 
-def calc_makespan(file_sizes, max_memory, max_cpus, tasks):
+
+def calc_makespan(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None,
+                  stats=None, policy=None):
     """
     Calculates the duration of each task for each file, then uses this
     information to calculate the total makespan of the pipeline assuming the
@@ -16,103 +24,722 @@ def calc_makespan(file_sizes, max_memory, max_cpus, tasks):
     given order, and the next task starts as soon as enough resources become
     available.
 
+    Tasks that share a step, or that name their predecessors, make the
+    pipeline a DAG: a task of a file is ready once every one of its
+    predecessors for that file has finished, so independent branches of the
+    same file run at the same time.
+
     :param file_sizes: size of the files rounded to the nearest unit; int
     :param max_memory: the memory limits of the machine; int
     :param max_cpus: the number of cores in the machine; int
     :param tasks: a list of tasks to be completed for each file in the order
     listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order the tasks
+    are listed, or None to use the CPUs set on the tasks; list of int
+    :param stats: where to add up what the simulation did and the time it
+    spent, e.g. the same stats for every evaluation of an optimizer run, or
+    None to not measure anything; SimulationStats
+    :param policy: which ready jobs start first and how jobs behind one that
+    doesn't fit may start before it, or None for step order then file order,
+    starting every job that fits; dispatch.DispatchPolicy
     :return: the makespan of the pipeline in the same units given in the tasks;
     int
     """
-    num_steps = len(tasks)
     num_samples = len(file_sizes)
-    samples = [Sample(i, file_sizes[i]) for i in range(num_samples)]
+    if cpu_assignment is None:
+        cpu_assignment = [task.cpus for task in tasks]
 
-    # Sorting task by step number beforehand
-    tasks.sort(key=lambda task: task.step)
+    # Sorting task (and CPU assignment) by step number beforehand, leaving the
+    # caller's list and tasks untouched
+    order = sorted(range(len(tasks)), key=lambda i: tasks[i].step)
+    tasks = [tasks[i] for i in order]
+    cpus = [cpu_assignment[i] for i in order]
 
     # Return -1 if any step is invalid.
-    for i in range(len(tasks)):
-        if tasks[i].step != i:
-            return -1
+    predecessors = _task_graph(tasks)
+    if predecessors is None:
+        return -1
 
-    # All jobs to be scheduled, e.g. row i column j contains ith task for
-    # the jth sample
-    all_jobs = [[Job(sample, task) for sample in samples] for task in tasks]
-    num_remaining_jobs = num_steps * num_samples
+    # All jobs to be scheduled as parallel columns indexed by job id, e.g. job
+    # i * num_samples + j is the ith task for the jth sample
+    started = perf_counter() if stats is not None else 0
+    duration, memory = _job_columns(file_sizes, tasks, cpus)
+    if stats is not None:
+        stats.build_time += perf_counter() - started
 
     # Return -1 if any job is impossible
-    for step in all_jobs:
-        for job in step:
-            if job.memory > max_memory or job.cpus > max_cpus:
-                return -1
+    if num_samples > 0 and (max(cpus, default=0) > max_cpus or
+                            max(memory, default=0) > max_memory):
+        return -1
+
+    if policy is not None:
+        return _simulate_policy(duration, memory, cpus, predecessors,
+                                num_samples, max_memory, max_cpus, policy,
+                                stats)
+    if not _is_linear(tasks):
+        return _simulate_dag(duration, memory, cpus, predecessors, num_samples,
+                             max_memory, max_cpus, stats)
+    return _simulate(duration, memory, cpus, num_samples, max_memory, max_cpus,
+                     stats)
+
+
+def calc_schedule(file_sizes, max_memory, max_cpus, tasks,
+                  cpu_assignment=None, policy=None):
+    """
+    Calculates the schedule calc_makespan simulates, i.e. when every job
+    starts and ends, e.g. for a dispatch plan or a Gantt chart. The jobs are
+    only recorded when a schedule is asked for, so calc_makespan doesn't pay
+    for it.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order
+    listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order the tasks
+    are listed, or None to use the CPUs set on the tasks; list of int
+    :param policy: the dispatch policy, see calc_makespan; DispatchPolicy
+    :return: every job and the makespan, with no jobs and a makespan of -1 if
+    calc_makespan would return -1; ScheduleTrace
+    """
+    pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    pipeline.policy = policy
+    return pipeline.schedule(file_sizes, cpu_assignment)
+
+
+def _job_columns(file_sizes, tasks, cpus):
+    """
+    Calculate the duration and memory of every job, e.g. the ith task for the
+    jth sample is job i * len(file_sizes) + j.
+
+    :param file_sizes: size of the files in processing order; list of int
+    :param tasks: tasks sorted by step; list of PipelineTask
+    :param cpus: CPUs used by each step; list of int
+    :return: duration and memory columns indexed by job id; list, list
+    """
+    duration = []
+    memory = []
+    for task, step_cpus in zip(tasks, cpus):
+        parallel_func, time_factor = task.parallel_func, task.time_factor
+        duration.extend([parallel_func(size, time_factor, step_cpus)
+                         for size in file_sizes])
+        memory.extend([size * task.space_factor for size in file_sizes])
 
-    # Resources currently available
+    return duration, memory
+
+
+def _task_graph(tasks):
+    """
+    Work out which tasks each task waits for. A task with predecessors set
+    waits for the tasks with those names, and any other task for every task
+    of the step before it, so a pipeline with one task per step is a chain.
+
+    :param tasks: tasks sorted by step; list of PipelineTask
+    :return: the positions in tasks of the predecessors of each task, or None
+    if the steps skip a number or don't start at 0, or a predecessor is
+    missing, ambiguous or not in an earlier step; list of lists of int
+    """
+    steps = [task.step for task in tasks]
+    if steps and (steps[0] != 0 or
+                  any(b - a > 1 for a, b in zip(steps, steps[1:]))):
+        return None
+
+    positions = {}
+    for i, task in enumerate(tasks):
+        positions.setdefault(task.name, []).append(i)
+
+    predecessors = []
+    for i, task in enumerate(tasks):
+        if task.predecessors is None:
+            predecessors.append([k for k in range(i)
+                                 if steps[k] == task.step - 1])
+            continue
+        before = set()
+        for name in task.predecessors:
+            found = positions.get(name, [])
+            if len(found) != 1 or steps[found[0]] >= task.step:
+                return None
+            before.add(found[0])
+        predecessors.append(sorted(before))
+    return predecessors
+
+
+def _is_linear(tasks):
+    """
+    Check whether tasks sorted by step form a chain of one task per step,
+    which the main engine simulates, rather than a DAG.
+
+    :param tasks: tasks sorted by step, with a valid task graph; list of
+    PipelineTask
+    :return: whether the pipeline is a chain; bool
+    """
+    return all(task.step == i and task.predecessors is None
+               for i, task in enumerate(tasks))
+
+
+def _simulate(duration, memory, cpus, num_samples, max_memory, max_cpus,
+              stats=None):
+    """
+    Run the pipeline on one machine: the next task of a sample starts as soon
+    as enough resources are available, checking ready jobs step by step, then
+    in file order, and starting every job that fits.
+
+    :param duration: duration of each job, indexed by job id; list
+    :param memory: memory of each job, indexed by job id; list
+    :param cpus: CPUs used by each step; list of int
+    :param num_samples: number of samples in the pipeline; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param stats: where to add up what the simulation did, or None;
+    SimulationStats
+    :return: the makespan; int
+    """
+    state = _EngineState(memory, cpus, num_samples, max_memory, max_cpus)
+    return _run(state, duration, memory, cpus, num_samples, stats=stats)
+
+
+def _run(state, duration, memory, cpus, num_samples, checkpoints=None,
+         stats=None, trace=None):
+    """
+    Run the engine from a state until every job has finished, see _simulate.
+
+    :param state: where the schedule is up to, modified in place;
+    _EngineState
+    :param duration: duration of each job, indexed by job id; list
+    :param memory: memory of each job, indexed by job id; list
+    :param cpus: CPUs used by each step; list of int
+    :param num_samples: number of samples in the pipeline; int
+    :param checkpoints: where to record the state before rounds of scheduling
+    that later swaps can restart from, or None; CheckpointedSchedule
+    :param stats: where to add up what the simulation did, or None. Counts and
+    times are only taken once per round of scheduling, so running without
+    stats costs one check a round; SimulationStats
+    :param trace: where to add the (end time, job id) of every job as it
+    finishes, taken at the same time as the stats, or None; list
+    :return: the makespan; int
+    """
+    num_steps = len(cpus)
+    available_cpus = state.available_cpus
+    available_mem = state.available_mem
+    running = state.running  # min-heap of (end time, job id) for running jobs
+    ready = state.ready
+    size = state.size
+    makespan = state.makespan  # latest end time of a job in schedule
+    t = state.t
+    reach = state.reach
+
+    instrumented = stats is not None or trace is not None
+    if instrumented:
+        stats = stats if stats is not None else SimulationStats()
+        stats.evaluations += 1
+        depth = size.bit_length() - 1  # nodes a descent of a ready tree visits
+        queued = None  # running jobs after the last round of admission
+        misses = 0  # checks of a ready tree that found no job fits
+
+    # Keep the clock running until all jobs finish
+    while True:
+        if checkpoints is not None and \
+                reach - checkpoints.reach[-1] >= checkpoints.spacing:
+            checkpoints.record(_EngineState.snapshot(
+                t, available_cpus, available_mem, running, ready, size,
+                makespan, reach))
+
+        if instrumented:
+            # The jobs that ended since the last round of admission finished
+            now = perf_counter()
+            if queued is not None:
+                stats.events += 1
+                stats.finished += queued - len(running)
+                stats.completion_time += now - started
+            started, queued = now, len(running)
+
+        # Go through the ready samples step by step and schedule every job
+        # that fits in file order, decreasing resources
+        for step in range(num_steps):
+            tree = ready[step]
+            step_cpus = cpus[step]
+            offset = step * num_samples - size
+            job = -1
+            while step_cpus <= available_cpus and tree[1] <= available_mem:
+                # Descend to the leftmost sample whose job fits
+                node = 1
+                while node < size:
+                    node *= 2
+                    if tree[node] > available_mem:
+                        node += 1
+
+                job = offset + node
+                available_cpus -= step_cpus
+                available_mem -= memory[job]
+                heappush(running, (t + duration[job], job))
+
+                # The sample is no longer waiting for this step
+                tree[node] = lowest = inf
+                while node > 1:
+                    sibling = tree[node ^ 1]
+                    if sibling < lowest:
+                        lowest = sibling
+                    node //= 2
+                    if tree[node] == lowest:
+                        break
+                    tree[node] = lowest
+
+            if instrumented and step_cpus <= available_cpus:
+                # The check that ended the step read the root of the tree
+                misses += 1
+
+            if step == 0 and checkpoints is not None:
+                # Samples after the last one started can't start yet, the
+                # first of them from which none would fit in what is left
+                # whatever their order is how far swaps leave this unchanged
+                first = job + 1
+                if step_cpus <= available_cpus:
+                    first = bisect_right(checkpoints.suffix_memory,
+                                         available_mem, first)
+                reach = max(reach, first)
+
+        if instrumented:
+            # Every job started is pushed on running, and each step checks
+            # once more than it starts jobs, when the next job doesn't fit.
+            # A check reads the root of the tree unless the CPUs are used up,
+            # and only descends once the root shows a job fits, so every
+            # descent finds one after reading depth more nodes
+            admitted, queued = len(running) - queued, len(running)
+            stats.admitted += admitted
+            stats.admission_checks += admitted + num_steps
+            stats.scanned += admitted * (depth + 1) + misses
+            misses = 0
+            now = perf_counter()
+            stats.admission_time += now - started
+            started = now
+
+            # The jobs ending next are about to finish
+            if trace is not None and running:
+                ending = running[0][0]
+                trace.extend(entry for entry in running if entry[0] == ending)
+
+        if not running:
+            break
+
+        t = running[0][0]  # move clock forward to the next job end
+
+        # Every running job ending now finishes, gives back its resources and
+        # makes its sample wait for the next step
+        while running and running[0][0] == t:
+            job = heappop(running)[1]
+            step, sample = divmod(job, num_samples)
+            available_cpus += cpus[step]
+            available_mem += memory[job]
+            if step + 1 < num_steps:
+                tree = ready[step + 1]
+                node = size + sample
+                job_memory = memory[job + num_samples]
+                tree[node] = job_memory
+                while node > 1:
+                    node //= 2
+                    if tree[node] <= job_memory:
+                        break
+                    tree[node] = job_memory
+
+        makespan = t
+
+    state.t, state.available_cpus, state.available_mem = \
+        t, available_cpus, available_mem
+    state.makespan, state.reach = makespan, reach
+    return makespan
+
+
+def _simulate_dag(duration, memory, cpus, predecessors, num_samples,
+                  max_memory, max_cpus, stats=None, trace=None):
+    """
+    Run a DAG pipeline on one machine. Each job counts the predecessors it is
+    still waiting for, and becomes ready when the count reaches 0. Ready jobs
+    start by the rules of _simulate: task by task in step order, then in file
+    order, starting every job that fits.
+
+    :param duration: duration of each job, indexed by job id; list
+    :param memory: memory of each job, indexed by job id; list
+    :param cpus: CPUs used by each task, in step order; list of int
+    :param predecessors: positions of the tasks each task waits for, see
+    _task_graph; list of lists of int
+    :param num_samples: number of samples in the pipeline; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param stats: where to add up what the simulation did, or None;
+    SimulationStats
+    :param trace: where to add the (end time, job id) of every job as it
+    finishes, or None; list
+    :return: the makespan; int
+    """
+    num_tasks = len(cpus)
+    successors = [[] for task in range(num_tasks)]
+    for task, before in enumerate(predecessors):
+        for predecessor in before:
+            successors[predecessor].append(task)
+
+    # Predecessors each job is still waiting for, and the samples whose job
+    # of each task is ready, in file order
+    waiting = [len(before) for before in predecessors
+               for sample in range(num_samples)]
+    ready = [list(range(num_samples)) if not before else []
+             for before in predecessors]
+
+    available_cpus = max_cpus
     available_mem = max_memory
+    running = []  # min-heap of (end time, job id) for running jobs
+    makespan = t = 0
+    if stats is not None:
+        stats.evaluations += 1
+
+    while True:
+        started = perf_counter() if stats is not None else 0
+        for task in range(num_tasks):
+            queue = ready[task]
+            task_cpus = cpus[task]
+            if not queue or task_cpus > available_cpus:
+                continue
+            offset = task * num_samples
+            kept = []
+            for sample in queue:
+                job = offset + sample
+                if task_cpus <= available_cpus and \
+                        memory[job] <= available_mem:
+                    available_cpus -= task_cpus
+                    available_mem -= memory[job]
+                    heappush(running, (t + duration[job], job))
+                else:
+                    kept.append(sample)
+            if stats is not None:
+                stats.admission_checks += len(queue)
+                stats.admitted += len(queue) - len(kept)
+            ready[task] = kept
+        if stats is not None:
+            now = perf_counter()
+            stats.admission_time += now - started
+            started = now
+
+        if not running:
+            break
+
+        # Every running job ending now finishes, gives back its resources and
+        # counts down the jobs of its sample that wait for it
+        t = running[0][0]
+        while running and running[0][0] == t:
+            entry = heappop(running)
+            if trace is not None:
+                trace.append(entry)
+            task, sample = divmod(entry[1], num_samples)
+            available_cpus += cpus[task]
+            available_mem += memory[entry[1]]
+            for successor in successors[task]:
+                job = successor * num_samples + sample
+                waiting[job] -= 1
+                if waiting[job] == 0:
+                    insort(ready[successor], sample)
+            if stats is not None:
+                stats.finished += 1
+        makespan = t
+        if stats is not None:
+            stats.events += 1
+            stats.completion_time += perf_counter() - started
+
+    return makespan
+
+
+# What a dispatch policy knows about a ready job to rank it by: its step (the
+# position of its task in step order for a DAG pipeline), the position of its
+# file in the file order, its duration, memory and CPUs, the longest time from
+# its start to the end of its file, and when it became ready
+ReadyJob = namedtuple("ReadyJob", ["step", "sample", "duration", "memory",
+                                   "cpus", "critical_path", "ready_time"])
+
+
+def _simulate_policy(duration, memory, cpus, predecessors, num_samples,
+                     max_memory, max_cpus, policy, stats=None, trace=None):
+    """
+    Run a pipeline on one machine, starting ready jobs in the order a
+    dispatch policy ranks them. Ready jobs wait in a priority queue, and
+    after every job end they are tried in priority order. What happens to
+    the jobs behind one that doesn't fit depends on policy.backfill:
+
+    - "greedy": every job that fits starts, as in _simulate
+    - "aggressive": the first job that doesn't fit is given a reservation at
+      the earliest time it will, and jobs behind it only start if they don't
+      delay it
+    - "conservative": every job that doesn't fit is given a reservation, and
+      jobs behind them only start if they delay none of them
+    - "none": no job starts behind one that doesn't fit
+
+    :param duration: duration of each job, indexed by job id; list
+    :param memory: memory of each job, indexed by job id; list
+    :param cpus: CPUs used by each task, in step order; list of int
+    :param predecessors: positions of the tasks each task waits for, see
+    _task_graph; list of lists of int
+    :param num_samples: number of samples in the pipeline; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param policy: ranks ready jobs, lower first, and sets the backfilling;
+    dispatch.DispatchPolicy
+    :param stats: where to add up what the simulation did, or None;
+    SimulationStats
+    :param trace: where to add the (end time, job id) of every job as it
+    finishes, or None; list
+    :return: the makespan; int
+    """
+    num_tasks = len(cpus)
+    backfill = policy.backfill
+    successors = [[] for task in range(num_tasks)]
+    for task, before in enumerate(predecessors):
+        for predecessor in before:
+            successors[predecessor].append(task)
+
+    # Longest time from the start of each job to the end of its file
+    critical_path = list(duration)
+    for task in reversed(range(num_tasks)):
+        for sample in range(num_samples):
+            job = task * num_samples + sample
+            critical_path[job] += max(
+                (critical_path[successor * num_samples + sample]
+                 for successor in successors[task]), default=0)
+
+    def make_ready(job, t):
+        task, sample = divmod(job, num_samples)
+        heappush(ready, (policy.priority(ReadyJob(
+            task, sample, duration[job], memory[job], cpus[task],
+            critical_path[job], t)), job))
+
+    waiting = [len(before) for before in predecessors
+               for sample in range(num_samples)]
+    ready = []  # min-heap of (priority, job id) for ready jobs
+    for job, count in enumerate(waiting):
+        if count == 0:
+            make_ready(job, 0)
+
     available_cpus = max_cpus
+    available_mem = max_memory
+    running = []  # min-heap of (end time, job id) for running jobs
+    makespan = t = 0
+    if stats is not None:
+        stats.evaluations += 1
 
-    schedule = []  # list of scheduled jobs
-    makespan = 0  # latest end time of a job in schedule
-    t = 0  # initialize a clock
+    while True:
+        started = perf_counter() if stats is not None else 0
+        if ready:
+            # Resources free over time if nothing else starts, as a step
+            # function of [from time, CPUs, memory], for reservations
+            profile = None
+            if backfill != "greedy":
+                profile = [[t, available_cpus, available_mem]]
+                for end, job in sorted(running):
+                    task = job // num_samples
+                    if end != profile[-1][0]:
+                        profile.append(list(profile[-1]))
+                        profile[-1][0] = end
+                    profile[-1][1] += cpus[task]
+                    profile[-1][2] += memory[job]
 
-    # Keep the clock running until all jobs finish
-    while num_remaining_jobs > 0:
-        # update this to track when next running job ends (so we can jump to
-        # that time point)
-        next_t = inf
-
-        # Check which running jobs have finished, give back their resources,
-        # mark the step as completed, and update next time point
-        for job in schedule:
-            if job.end_time == t:
-                job.is_running = False
-                available_cpus += job.cpus
-                available_mem += job.memory
-                job.sample.steps_completed += 1
-                num_remaining_jobs -= 1
-            elif job.end_time > t and job.is_running:
-                next_t = min(next_t, job.end_time)
-
-        # Go through jobs and schedule next runnable job, decreasing
-        # resources and updating next_t and makespan
-        for step in all_jobs:
-            for job in step:
-                if not job.is_running and job.sample.steps_completed == job.task.step and \
-                        job.cpus <= available_cpus and job.memory <= available_mem:
-                    job.is_running = True
-                    job.start_time = t
-                    job.end_time = t + job.duration
-
-                    available_cpus -= job.cpus
-                    available_mem -= job.memory
-
-                    next_t = min(next_t, job.end_time)
-                    makespan = max(makespan, job.end_time)
-                    schedule.append(job)
-
-        t = next_t  # move clock forward
+            kept = []
+            blocked = False
+            checks = 0
+            while ready:
+                entry = heappop(ready)
+                job = entry[1]
+                task = job // num_samples
+                if blocked and backfill == "none":
+                    kept.append(entry)
+                    continue
+
+                checks += 1
+                if profile is None:
+                    start = t if cpus[task] <= available_cpus and \
+                        memory[job] <= available_mem else None
+                else:
+                    start = _earliest_fit(profile, cpus[task], memory[job],
+                                          duration[job])
+                if start == t:
+                    available_cpus -= cpus[task]
+                    available_mem -= memory[job]
+                    heappush(running, (t + duration[job], job))
+                    if profile is not None:
+                        _reserve(profile, t, t + duration[job], cpus[task],
+                                 memory[job])
+                    if stats is not None:
+                        stats.admitted += 1
+                else:
+                    kept.append(entry)
+                    if backfill == "conservative" or \
+                            (backfill == "aggressive" and not blocked):
+                        _reserve(profile, start, start + duration[job],
+                                 cpus[task], memory[job])
+                    blocked = True
+            if stats is not None:
+                stats.admission_checks += checks
+            ready = kept
+            heapify(ready)
+        if stats is not None:
+            now = perf_counter()
+            stats.admission_time += now - started
+            started = now
+
+        if not running:
+            break
+
+        # Every running job ending now finishes, gives back its resources and
+        # counts down the jobs of its sample that wait for it
+        t = running[0][0]
+        while running and running[0][0] == t:
+            entry = heappop(running)
+            if trace is not None:
+                trace.append(entry)
+            task, sample = divmod(entry[1], num_samples)
+            available_cpus += cpus[task]
+            available_mem += memory[entry[1]]
+            for successor in successors[task]:
+                job = successor * num_samples + sample
+                waiting[job] -= 1
+                if waiting[job] == 0:
+                    make_ready(job, t)
+            if stats is not None:
+                stats.finished += 1
+        makespan = t
+        if stats is not None:
+            stats.events += 1
+            stats.completion_time += perf_counter() - started
 
     return makespan
 
 
+def _earliest_fit(profile, cpus, memory, duration):
+    """
+    Find the earliest time a job fits in a resource profile for all of its
+    duration.
+
+    :param profile: free resources over time, see _simulate_policy; list of
+    lists
+    :param cpus: CPUs the job uses; int
+    :param memory: memory the job uses; int
+    :param duration: how long the job runs; int
+    :return: when the job can start; int
+    """
+    for i, (start, free_cpus, free_mem) in enumerate(profile):
+        end = start + duration
+        for time, free_cpus, free_mem in profile[i:]:
+            if time >= end and time > start:
+                return start
+            if cpus > free_cpus or memory > free_mem:
+                break
+        else:
+            return start
+    return profile[-1][0]
+
+
+def _reserve(profile, start, end, cpus, memory):
+    """
+    Take a job's resources out of a resource profile from when it starts
+    until it ends, splitting the steps of the profile at those times.
+
+    :param profile: free resources over time, see _simulate_policy, modified
+    in place; list of lists
+    :param start: when the job starts; int
+    :param end: when the job ends; int
+    :param cpus: CPUs the job uses; int
+    :param memory: memory the job uses; int
+    """
+    for time in (start, end):
+        i = bisect_right(profile, [time, inf, inf]) - 1
+        if profile[i][0] != time:
+            profile.insert(i + 1, [time, profile[i][1], profile[i][2]])
+    for step in profile:
+        if start <= step[0] < end:
+            step[1] -= cpus
+            step[2] -= memory
+
+
+def calc_makespan_batch(file_orders, cpu_assignments, max_memory, max_cpus,
+                        tasks, stats=None, policy=None):
+    """
+    Calculates the makespan of many candidate schedules of the same pipeline,
+    e.g. a whole GA population. Each candidate is a file order and an
+    assignment of CPUs to the tasks. The duration and memory tables are built
+    once for every candidate, and each candidate is then simulated on its own,
+    giving the same results as calling calc_makespan on each candidate in
+    turn.
+
+    :param file_orders: one ordering of the file sizes per candidate, e.g. row
+    i is the file order of candidate i; 2-D array-like of int
+    :param cpu_assignments: CPUs assigned to each task (in the order the tasks
+    are listed) per candidate, or None to use the CPUs set on the tasks; 2-D
+    array-like of int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file; list of
+    PipelineTask
+    :param stats: where to add up what the simulation did, see calc_makespan;
+    SimulationStats
+    :param policy: the dispatch policy, see calc_makespan; DispatchPolicy
+    :return: the makespan of each candidate, -1 where calc_makespan would
+    return -1; numpy array of int (float if durations are not integers)
+    """
+    started = perf_counter() if stats is not None else 0
+    sizes = np.atleast_2d(np.asarray(file_orders))
+    pipeline = CompiledPipeline(sizes.ravel().tolist(), tasks, max_cpus,
+                                max_memory)
+    pipeline.policy = policy
+    if stats is not None:
+        stats.build_time += perf_counter() - started
+    pipeline.stats = stats
+    return pipeline.makespan_batch(sizes, cpu_assignments)
+
+
+def _parallel_durations(task, sizes, cpus):
+    """
+    Apply a task's parallel_func to arrays of file sizes and CPU counts,
+    falling back to calling it element by element if it does not accept
+    arrays.
+
+    :param task: the task being performed; PipelineTask
+    :param sizes: file sizes; numpy array
+    :param cpus: CPUs assigned to the task, broadcastable against sizes; numpy
+    array
+    :return: the duration of the task for each file; numpy array
+    """
+    sizes, cpus = np.broadcast_arrays(sizes, cpus)
+    try:
+        duration = np.asarray(task.parallel_func(sizes, task.time_factor,
+                                                 cpus))
+        if duration.shape == sizes.shape:
+            return duration
+    except (TypeError, ValueError):
+        pass
+
+    if sizes.size == 0:
+        return np.zeros(sizes.shape, dtype=np.int64)
+    return np.vectorize(task.parallel_func)(sizes, task.time_factor, cpus)
+
+
 class PipelineTask:
     """
     A class to contain information and methods for a pipeline task
     """
 
     def __init__(self, name, step, time_factor, space_factor, cpus,
-                 parallel_func=lambda size, time, cpus: size * time // cpus):
+                 parallel_func=lambda size, time, cpus: size * time // cpus,
+                 predecessors=None):
         """
         Construct a new instance of class PipelineTask.
 
         :param name: name of the task; str
-        :param step: which step the task is in the pipeline; int
+        :param step: which step the task is in the pipeline, tasks in the same
+        step can run at the same time for a file; int
         :param time_factor: time units required to complete this task for a
         file size of 1 unit using 1 CPU. e.g. input of 50 means "50 minutes for
         a 1 Gb file using 1 CPU"; int
         :param space_factor: the peak RAM required to process a file size of 1
         unit; int
         :param cpus: the number of CPUs designated for this task; int
+        :param predecessors: names of the tasks in earlier steps that must
+        finish for a file before this task starts on it, or None for every
+        task of the step before; list of str
         """
         self.name = name
         self.step = step
@@ -120,16 +747,155 @@ class PipelineTask:
         self.space_factor = space_factor
         self.cpus = cpus
         self.parallel_func = parallel_func
+        self.predecessors = predecessors
 
     def __repr__(self):
         return f"Task #{self.step}: {self.name}"
 
 
+class ScheduleTrace:
+    """
+    When every job of a schedule ran and what it held, as parallel numpy
+    columns with one row per job sorted by start time (then step, then
+    sample):
+
+    - sample: position of the job's file in the file order
+    - file_size: size of the file
+    - step: the step of the pipeline the job is, or for a DAG pipeline the
+      position of its task in the tasks sorted by step
+    - start, end: when the job started and ended
+    - cpus, memory: what the job held while it ran
+    """
+
+    COLUMNS = ("sample", "file_size", "step", "start", "end", "cpus",
+               "memory")
+
+    def __init__(self, makespan, max_cpus, max_memory, sample, file_size,
+                 step, start, end, cpus, memory):
+        """
+        Construct a new instance of class ScheduleTrace.
+
+        :param makespan: the makespan of the schedule, -1 if it is
+        impossible; int
+        :param max_cpus: the number of cores in the machine; int
+        :param max_memory: the memory limits of the machine; int
+        :param sample, file_size, step, start, end, cpus, memory: each column,
+        see ScheduleTrace; numpy array
+        """
+        self.makespan = makespan
+        self.max_cpus = max_cpus
+        self.max_memory = max_memory
+        self.sample = sample
+        self.file_size = file_size
+        self.step = step
+        self.start = start
+        self.end = end
+        self.cpus = cpus
+        self.memory = memory
+
+    def __len__(self):
+        return len(self.sample)
+
+    def __repr__(self):
+        return f"ScheduleTrace({len(self)} jobs, makespan {self.makespan})"
+
+    def columns(self):
+        """
+        Every column by name.
+
+        :return: the columns in the order of COLUMNS; dict of numpy array
+        """
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    def utilization(self):
+        """
+        The CPUs and memory in use over time, as a step function: from
+        times[i] until times[i + 1] the jobs running hold cpus[i] CPUs and
+        memory[i] memory, and nothing is held from the last time on.
+
+        :return: every time a job starts or ends, and the CPUs and memory in
+        use from each time on; (numpy array, numpy array, numpy array)
+        """
+        times = np.unique(np.concatenate([self.start, self.end]))
+        starts = np.searchsorted(times, self.start)
+        ends = np.searchsorted(times, self.end)
+
+        cpus = np.zeros(times.size, dtype=np.int64)
+        np.add.at(cpus, starts, self.cpus)
+        np.add.at(cpus, ends, -self.cpus)
+        memory = np.zeros(times.size, dtype=self.memory.dtype)
+        np.add.at(memory, starts, self.memory)
+        np.add.at(memory, ends, -self.memory)
+        return times, np.cumsum(cpus), np.cumsum(memory)
+
+    def to_csv(self, path):
+        """
+        Write the jobs as CSV, one row per job with a header of the column
+        names.
+
+        :param path: the file to write; str
+        """
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(self.COLUMNS)
+            writer.writerows(zip(*(column.tolist() for column in
+                                   self.columns().values())))
+
+    def to_parquet(self, path):
+        """
+        Write the jobs as a Parquet table with one column per column of the
+        trace. Needs pyarrow, which is only imported here.
+
+        :param path: the file to write; str
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Writing Parquet needs pyarrow, e.g. pip install "
+                            "pyarrow, or use to_csv")
+        pyarrow.parquet.write_table(pyarrow.table(self.columns()), path)
+
+
+def _schedule_trace(makespan, finished, duration, memory, cpus, file_order,
+                    max_cpus, max_memory):
+    """
+    Build the trace of a simulation from the jobs it finished.
+
+    :param makespan: the makespan of the schedule; int
+    :param finished: the (end time, job id) of every job; list of tuples
+    :param duration: duration of each job, indexed by job id; list
+    :param memory: memory of each job, indexed by job id; list
+    :param cpus: CPUs used by each step; list of int
+    :param file_order: the file sizes in processing order; list of int
+    :param max_cpus: the number of cores in the machine; int
+    :param max_memory: the memory limits of the machine; int
+    :return: the trace; ScheduleTrace
+    """
+    num_samples = len(file_order)
+    end, job = (np.array(column) for column in zip(*finished)) if finished \
+        else (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    step, sample = np.divmod(job, num_samples)
+    start = end - np.asarray(duration)[job]
+
+    order = np.lexsort((sample, step, start))
+    return ScheduleTrace(makespan, max_cpus, max_memory, sample[order],
+                         np.asarray(file_order)[sample[order]], step[order],
+                         start[order], end[order],
+                         np.asarray(cpus, dtype=np.int64)[step[order]],
+                         np.asarray(memory)[job[order]])
+
+
 class Job:
     """
-    A class to contain information about a specific job
+    A class to contain information about a specific job. calc_makespan keeps
+    jobs as columns indexed by job id, this class is for inspecting a single
+    job.
     """
 
+    __slots__ = ("sample", "task", "duration", "memory", "cpus", "is_running",
+                 "start_time", "end_time")
+
     def __init__(self, sample, task):
         """
         Construct a new instance of class Job.
@@ -159,6 +925,8 @@ class Sample:
     pipeline.
     """
 
+    __slots__ = ("sample_id", "file_size", "steps_completed")
+
     def __init__(self, sample_id, file_size):
         """
         Construct a new instance of class Sample.
@@ -172,3 +940,629 @@ class Sample:
 
     def __repr__(self):
         return f"Sample {self.sample_id}, size {self.file_size}"
+
+
+class SimulationStats:
+    """
+    What simulations did and where their time went, added up over every
+    simulation it is given to, e.g. by calc_makespan(..., stats=stats) or by
+    setting the stats of a CompiledPipeline an optimizer run evaluates on.
+
+    Counts are of events (the clock moving to the next job end), jobs
+    finished, admission checks (looking for the
+    next waiting job of a step that fits), jobs admitted, and waiting jobs or
+    ready-tree nodes scanned to find them. Times are of building the job
+    columns, admitting jobs and finishing jobs, in seconds.
+
+    Without a dispatch policy the ready jobs of a step are kept in a tree of
+    the smallest memory below each node, and scanned counts the nodes read:
+    the root at every check the CPUs allow, and the nodes below it on the way
+    to each job admitted. Checks only descend once the root shows a job fits,
+    so no descent fails.
+    """
+
+    FIELDS = ("evaluations", "events", "finished", "admission_checks",
+              "admitted", "scanned", "build_time", "admission_time",
+              "completion_time")
+
+    def __init__(self):
+        """
+        Construct a new instance of class SimulationStats, with everything at
+        0.
+        """
+        self.evaluations = 0
+        self.events = 0
+        self.finished = 0
+        self.admission_checks = 0
+        self.admitted = 0
+        self.scanned = 0
+        self.build_time = 0.0
+        self.admission_time = 0.0
+        self.completion_time = 0.0
+
+    def merge(self, other):
+        """
+        Add another stats' counts and times to these, e.g. from a worker
+        process.
+
+        :param other: the stats to add; SimulationStats
+        :return: these stats; SimulationStats
+        """
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        return self
+
+    def as_dict(self):
+        """
+        Every count and time by name, e.g. to write as JSON.
+
+        :return: the stats; dict
+        """
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return "SimulationStats(" + ", ".join(
+            f"{field}={value:.3f}" if isinstance(value, float) else
+            f"{field}={value}" for field, value in self.as_dict().items()) + ")"
+
+
+class _EngineState:
+    """
+    Where a simulation is up to: the clock, the free resources, the running
+    jobs and the samples waiting for each step.
+    """
+
+    __slots__ = ("t", "available_cpus", "available_mem", "running", "ready",
+                 "size", "makespan", "reach")
+
+    def __init__(self, memory, cpus, num_samples, max_memory, max_cpus):
+        """
+        Construct a new instance of class _EngineState, at time 0 with every
+        sample waiting for the first step.
+
+        :param memory: memory of each job, indexed by job id; list
+        :param cpus: CPUs used by each step; list of int
+        :param num_samples: number of samples in the pipeline; int
+        :param max_memory: the memory limits of the machine; int
+        :param max_cpus: the number of cores in the machine; int
+        """
+        num_steps = len(cpus)
+        self.t = 0
+        self.available_cpus = max_cpus
+        self.available_mem = max_memory
+        self.running = []
+        self.makespan = 0
+        self.reach = 0  # see CheckpointedSchedule
+
+        # Samples waiting to start a step, one min-tree of job memory per step
+        # over the samples in file order (inf where the sample is not
+        # waiting), so the first waiting job that fits is found in log time,
+        # e.g. a sample enters tree i once it has completed step i - 1
+        self.size = 1
+        while self.size < num_samples:
+            self.size *= 2
+        self.ready = [[inf] * (2 * self.size) for step in range(num_steps)]
+        if num_steps > 0:
+            tree = self.ready[0]
+            tree[self.size:self.size + num_samples] = memory[:num_samples]
+            for node in range(self.size - 1, 0, -1):
+                tree[node] = min(tree[2 * node], tree[2 * node + 1])
+
+    @classmethod
+    def snapshot(cls, t, available_cpus, available_mem, running, ready, size,
+                 makespan, reach):
+        """
+        Copy a state so the simulation can go on from it more than once.
+
+        :return: the copy; _EngineState
+        """
+        state = cls.__new__(cls)
+        state.t = t
+        state.available_cpus = available_cpus
+        state.available_mem = available_mem
+        state.running = running.copy()
+        state.ready = [tree.copy() for tree in ready]
+        state.size = size
+        state.makespan = makespan
+        state.reach = reach
+        return state
+
+    def copy(self):
+        """
+        Copy this state.
+
+        :return: the copy; _EngineState
+        """
+        return _EngineState.snapshot(self.t, self.available_cpus,
+                                     self.available_mem, self.running,
+                                     self.ready, self.size, self.makespan,
+                                     self.reach)
+
+
+class CompiledPipeline:
+    """
+    A pipeline prepared once for evaluating many schedules of the same files,
+    e.g. by an optimizer that only reorders the files and changes the CPUs
+    assigned to tasks. The duration of every task for every file size and CPU
+    count and the memory of every task for every file size are calculated up
+    front, and the step and memory checks are only done here.
+    """
+
+    def __init__(self, file_sizes, tasks, max_cpus, max_memory):
+        """
+        Construct a new instance of class CompiledPipeline.
+
+        :param file_sizes: size of the files rounded to the nearest unit; int
+        :param tasks: a list of tasks to be completed for each file; list of
+        PipelineTask
+        :param max_cpus: the number of cores in the machine; int
+        :param max_memory: the memory limits of the machine; int
+        """
+        self.file_sizes = list(file_sizes)
+        self.max_cpus = max_cpus
+        self.max_memory = max_memory
+        self.num_steps = len(tasks)
+        self.default_cpus = tuple(task.cpus for task in tasks)
+
+        # Position in tasks of each step, -1 for everything if a step is
+        # invalid. A DAG pipeline has a row in the tables per task, in step
+        # order, and is simulated by the DAG engine
+        self.step_order = sorted(range(self.num_steps),
+                                 key=lambda i: tasks[i].step)
+        steps = [tasks[i] for i in self.step_order]
+        self.predecessors = _task_graph(steps)
+        self.valid = self.predecessors is not None
+        self.linear = self.valid and _is_linear(steps)
+
+        # Tables indexed by distinct file size, e.g. duration[i][c - 1][k] is
+        # the duration of step i using c CPUs for the kth smallest size
+        self.sizes = np.unique(np.asarray(self.file_sizes))
+        self.size_index = {size: k for k, size in
+                           enumerate(self.sizes.tolist())}
+        cpu_counts = np.arange(1, max_cpus + 1)[:, None]
+        durations = [_parallel_durations(task, self.sizes[None, :], cpu_counts)
+                     for task in steps]
+        self.duration_table = np.stack(durations) if steps else \
+            np.zeros((0, max_cpus, self.sizes.size), dtype=np.int64)
+        self.memory_table = np.array(
+            [self.sizes * task.space_factor for task in steps]).reshape(
+            self.num_steps, self.sizes.size)
+        self.duration = [table.tolist() for table in durations]
+        self.memory = self.memory_table.tolist()
+
+        # Every order uses every file, so a job that does not fit in memory
+        # makes every schedule impossible
+        self.feasible = self.valid and \
+            not (self.memory_table > max_memory).any()
+
+        # What every simulation of this pipeline does is added up here when
+        # set, e.g. over an optimizer run given a cache of this pipeline.
+        # Simulations in worker processes add to their own copy
+        self.stats = None
+
+        # The dispatch policy of every simulation of this pipeline, None for
+        # the step order of calc_makespan, see calc_makespan
+        self.policy = None
+
+    def makespan(self, file_order, cpu_assignment=None):
+        """
+        Calculate the makespan of the pipeline for one schedule, the same as
+        calc_makespan would.
+
+        :param file_order: the compiled file sizes in processing order; list of
+        int
+        :param cpu_assignment: CPUs assigned to each task in the order the
+        tasks were given, or None for the CPUs set on the tasks; list of int
+        :return: the makespan, -1 if the schedule is impossible; int
+        """
+        if not self.valid:
+            return -1
+
+        cpus = self._step_cpus(cpu_assignment)
+        num_samples = len(file_order)
+        if num_samples == 0:
+            return 0
+        if not self.feasible or max(cpus, default=0) > self.max_cpus:
+            return -1
+
+        stats = self.stats
+        started = perf_counter() if stats is not None else 0
+        duration, memory = self._job_columns(file_order, cpus)
+        if stats is not None:
+            stats.build_time += perf_counter() - started
+
+        if self.policy is not None:
+            return _simulate_policy(duration, memory, cpus, self.predecessors,
+                                    num_samples, self.max_memory,
+                                    self.max_cpus, self.policy, stats)
+        if not self.linear:
+            return _simulate_dag(duration, memory, cpus, self.predecessors,
+                                 num_samples, self.max_memory, self.max_cpus,
+                                 stats)
+        return _simulate(duration, memory, cpus, num_samples, self.max_memory,
+                         self.max_cpus, stats)
+
+    def schedule(self, file_order, cpu_assignment=None):
+        """
+        Calculate when every job of one schedule starts and ends, the same as
+        calc_schedule would.
+
+        :param file_order: the compiled file sizes in processing order; list of
+        int
+        :param cpu_assignment: CPUs assigned to each task in the order the
+        tasks were given, or None for the CPUs set on the tasks; list of int
+        :return: every job and the makespan, with no jobs and a makespan of -1
+        if the schedule is impossible; ScheduleTrace
+        """
+        cpus = self._step_cpus(cpu_assignment) if self.valid else []
+        if not self.valid or len(file_order) == 0 or not self.feasible or \
+                max(cpus, default=0) > self.max_cpus:
+            makespan = 0 if self.valid and len(file_order) == 0 else -1
+            return _schedule_trace(makespan, [], [], [], cpus, [],
+                                   self.max_cpus, self.max_memory)
+
+        duration, memory = self._job_columns(file_order, cpus)
+        finished = []
+        if self.policy is not None:
+            makespan = _simulate_policy(duration, memory, cpus,
+                                        self.predecessors, len(file_order),
+                                        self.max_memory, self.max_cpus,
+                                        self.policy, self.stats, finished)
+        elif self.linear:
+            state = _EngineState(memory, cpus, len(file_order),
+                                 self.max_memory, self.max_cpus)
+            makespan = _run(state, duration, memory, cpus, len(file_order),
+                            stats=self.stats, trace=finished)
+        else:
+            makespan = _simulate_dag(duration, memory, cpus, self.predecessors,
+                                     len(file_order), self.max_memory,
+                                     self.max_cpus, self.stats, finished)
+        return _schedule_trace(makespan, finished, duration, memory, cpus,
+                               file_order, self.max_cpus, self.max_memory)
+
+    def makespan_batch(self, file_orders, cpu_assignments=None):
+        """
+        Calculate the makespan of many schedules, the same as
+        calc_makespan_batch would. Each schedule is simulated on its own by
+        makespan: simulating a population in lockstep with one row of numpy
+        state per candidate costs O(candidates * files) array work per event,
+        and was measured 1.5 to 6 times slower than this loop.
+
+        :param file_orders: one ordering of the compiled file sizes per
+        candidate; 2-D array-like of int
+        :param cpu_assignments: CPUs assigned to each task in the order the
+        tasks were given per candidate, or None for the CPUs set on the tasks;
+        2-D array-like of int
+        :return: the makespan of each candidate, -1 where impossible; numpy
+        array of int (float if durations are not integers)
+        """
+        file_orders = np.atleast_2d(np.asarray(file_orders)).tolist()
+        if cpu_assignments is None:
+            cpu_assignments = [self.default_cpus] * len(file_orders)
+        elif isinstance(cpu_assignments, np.ndarray):
+            cpu_assignments = cpu_assignments.tolist()
+        return np.array([self.makespan(file_order, cpu_assignment)
+                         for file_order, cpu_assignment
+                         in zip(file_orders, cpu_assignments)], dtype=np.int64
+                        if np.issubdtype(self.duration_table.dtype, np.integer)
+                        else float)
+
+    def _job_columns(self, file_order, cpus):
+        """
+        Look up the duration and memory of every job of a schedule, as
+        _job_columns would calculate them.
+
+        :param file_order: the compiled file sizes in processing order; list of
+        int
+        :param cpus: CPUs used by each step; list of int
+        :return: duration and memory columns indexed by job id; list, list
+        """
+        index = self._size_indices(file_order)
+        duration = []
+        memory = []
+        for step, step_cpus in enumerate(cpus):
+            row = self.duration[step][step_cpus - 1]
+            duration.extend([row[k] for k in index])
+            row = self.memory[step]
+            memory.extend([row[k] for k in index])
+        return duration, memory
+
+    def _step_cpus(self, cpu_assignment):
+        """
+        Put a CPU assignment in step order.
+
+        :param cpu_assignment: CPUs assigned to each task in the order the
+        tasks were given, or None for the CPUs set on the tasks; list of int
+        :return: CPUs used by each step; list of int
+        """
+        if cpu_assignment is None:
+            cpu_assignment = self.default_cpus
+        cpus = [cpu_assignment[i] for i in self.step_order]
+        if min(cpus, default=1) < 1:
+            raise Exception(f"Can't assign {min(cpus)} CPUs to a task")
+        return cpus
+
+    def _size_indices(self, file_order):
+        """
+        Look up the table index of each file size.
+
+        :param file_order: the compiled file sizes in processing order; list of
+        int
+        :return: the index of each size in the tables; list of int
+        """
+        try:
+            return [self.size_index[size] for size in file_order]
+        except KeyError as size:
+            raise Exception(f"File size {size} is not one of the compiled file "
+                            f"sizes")
+
+
+class CheckpointedSchedule:
+    """
+    One schedule of a compiled pipeline, simulated with checkpoints of the
+    engine state so the makespan after swapping two files is found without
+    simulating from time 0 again, e.g. for annealing.
+
+    Swapping files i < j changes nothing until one of the files from i on
+    could start. Before each round of scheduling the engine works out how far
+    the schedule is fixed: after the first jobs of earlier files have
+    started, what is left fits no later file's first job whatever order they
+    are in. A swap restarts from the last checkpoint that is fixed up to i,
+    so swapping files late in a long order only simulates the end of it.
+    While at least KEEP_ADOPTED of the swaps scored by swap_makespan are
+    made, the checkpoints of the last one are kept so swapping the same files
+    next takes them over without simulating again. Keeping them makes
+    scoring a swap up to half as slow again, so below that share they are
+    dropped and swap simulates the order again.
+    Schedules of DAG pipelines or with a dispatch policy have no checkpoints
+    and simulate every swap from the start.
+    """
+
+    KEEP_ADOPTED = 0.3
+
+    def __init__(self, pipeline, file_order, cpu_assignment=None,
+                 spacing=None):
+        """
+        Construct a new instance of class CheckpointedSchedule and simulate
+        the schedule.
+
+        :param pipeline: the pipeline the schedule is for; CompiledPipeline
+        :param file_order: the compiled file sizes in processing order; list of
+        int
+        :param cpu_assignment: CPUs assigned to each task in the order the
+        tasks were given, or None for the CPUs set on the tasks; list of int
+        :param spacing: how many files apart checkpoints are kept, or None for
+        about 64 checkpoints over the order; int
+        """
+        self.pipeline = pipeline
+        self.file_order = list(file_order)
+        self.cpu_assignment = cpu_assignment
+        num_samples = len(self.file_order)
+        self.spacing = spacing or max(1, num_samples // 64)
+
+        self.reach = []  # how far the schedule is fixed at each checkpoint
+        self.states = []  # engine state at each checkpoint
+        self._scored = None  # the last swap scored, see swap_makespan
+        self._pending = None  # its checkpoints, if kept
+        self._adopted = 1.0  # recent share of the swaps scored that were made
+
+        self.cpus = pipeline._step_cpus(cpu_assignment) if pipeline.valid \
+            else []
+        self.feasible = pipeline.valid and num_samples > 0 and \
+            pipeline.feasible and max(self.cpus, default=0) <= \
+            pipeline.max_cpus
+        if not self.feasible:
+            self.makespan = -1 if num_samples > 0 or not pipeline.valid else 0
+            return
+        if not pipeline.linear or pipeline.policy is not None:
+            self.makespan = pipeline.makespan(self.file_order, cpu_assignment)
+            return
+
+        # Job columns as in CompiledPipeline.makespan
+        started = perf_counter() if pipeline.stats is not None else 0
+        self.duration, self.memory = pipeline._job_columns(self.file_order,
+                                                           self.cpus)
+
+        # Smallest first job of the files from each position on
+        self.suffix_memory = self.memory[:num_samples] + [inf]
+        for position in range(num_samples - 1, -1, -1):
+            self.suffix_memory[position] = min(
+                self.suffix_memory[position],
+                self.suffix_memory[position + 1])
+
+        state = _EngineState(self.memory, self.cpus, num_samples,
+                             pipeline.max_memory, pipeline.max_cpus)
+        if pipeline.stats is not None:
+            pipeline.stats.build_time += perf_counter() - started
+        self.record(state.copy())
+        self.makespan = _run(state, self.duration, self.memory, self.cpus,
+                             num_samples, self, pipeline.stats)
+
+    def swap_makespan(self, i, j):
+        """
+        Calculate the makespan with the files at two positions swapped,
+        leaving the schedule as it is.
+
+        :param i: position of one file; int
+        :param j: position of the other file; int
+        :return: the makespan, -1 if the schedule is impossible; int
+        """
+        self._pending = None
+        if self._scored is not None:
+            self._adopted *= 0.9
+        self._scored = None
+        if not self.feasible or \
+                self.file_order[i] == self.file_order[j]:
+            return self.makespan
+        if not self.pipeline.linear or self.pipeline.policy is not None:
+            order = self.file_order.copy()
+            order[i], order[j] = order[j], order[i]
+            return self.pipeline.makespan(order, self.cpu_assignment)
+
+        i, j = min(i, j), max(i, j)
+        self._scored = i, j
+        self._swap_columns(i, j)
+        try:
+            state = self._restart(i, j)
+            if self._adopted < self.KEEP_ADOPTED:
+                return _run(state, self.duration, self.memory, self.cpus,
+                            len(self.file_order), None, self.pipeline.stats)
+            run = _SwapRun(self, i, j)
+            run.checkpoint = self._checkpoint
+            run.reach.append(self.reach[self._checkpoint])
+            run.makespan = _run(state, self.duration, self.memory, self.cpus,
+                                len(self.file_order), run,
+                                self.pipeline.stats)
+        finally:
+            self._swap_columns(i, j)
+        self._pending = run
+        return run.makespan
+
+    def swap(self, i, j):
+        """
+        Swap the files at two positions and update the makespan and the
+        checkpoints.
+
+        :param i: position of one file; int
+        :param j: position of the other file; int
+        :return: the new makespan, -1 if the schedule is impossible; int
+        """
+        self.file_order[i], self.file_order[j] = \
+            self.file_order[j], self.file_order[i]
+        pending, self._pending = self._pending, None
+        if self._scored is not None:
+            made = self._scored == (min(i, j), max(i, j))
+            self._adopted = 0.9 * self._adopted + (0.1 if made else 0)
+            self._scored = None
+        if not self.feasible or \
+                self.file_order[i] == self.file_order[j]:
+            return self.makespan
+        if not self.pipeline.linear or self.pipeline.policy is not None:
+            self.makespan = self.pipeline.makespan(self.file_order,
+                                                   self.cpu_assignment)
+            return self.makespan
+
+        i, j = min(i, j), max(i, j)
+        self._swap_columns(i, j)
+        if pending is not None and (pending.i, pending.j) == (i, j):
+            # swap_makespan already ran this order from the same checkpoint
+            self.suffix_memory = pending.suffix_memory
+            self._checkpoint = pending.checkpoint
+            state = None
+        else:
+            for position in range(j, i, -1):
+                self.suffix_memory[position] = min(
+                    self.memory[position], self.suffix_memory[position + 1])
+            state = self._restart(i, j)
+
+        # Checkpoints after the restart point no longer hold for this order,
+        # the ones before it only need the swapped files' first jobs
+        del self.reach[self._checkpoint + 1:]
+        del self.states[self._checkpoint + 1:]
+        for checkpoint in self.states:
+            self._queue_first_jobs(checkpoint, i, j)
+        if state is None:
+            self.reach.extend(pending.reach[1:])
+            self.states.extend(pending.states)
+            self.makespan = pending.makespan
+        else:
+            self.makespan = _run(state, self.duration, self.memory, self.cpus,
+                                 len(self.file_order), self,
+                                 self.pipeline.stats)
+        return self.makespan
+
+    def record(self, state):
+        """
+        Keep a checkpoint, called by the engine.
+
+        :param state: a copy of the engine state before a round of scheduling;
+        _EngineState
+        """
+        self.reach.append(state.reach)
+        self.states.append(state)
+
+    def _restart(self, i, j):
+        """
+        Copy the state of the last checkpoint a swap of two positions doesn't
+        change, with the swapped files put in the queue of the first step.
+
+        :param i: position of one swapped file; int
+        :param j: position of the other swapped file; int
+        :return: the state to run the swapped schedule from; _EngineState
+        """
+        self._checkpoint = bisect_right(self.reach, min(i, j)) - 1
+        state = self.states[self._checkpoint].copy()
+        self._queue_first_jobs(state, i, j)
+        return state
+
+    def _queue_first_jobs(self, state, *positions):
+        """
+        Put the current first jobs of files that haven't started yet in the
+        queue of the first step.
+
+        :param state: an engine state from before the files could start,
+        modified in place; _EngineState
+        :param positions: positions of the files; int
+        """
+        tree = state.ready[0]
+        for position in positions:
+            node = state.size + position
+            tree[node] = self.memory[position]
+            while node > 1:
+                node //= 2
+                tree[node] = min(tree[2 * node], tree[2 * node + 1])
+
+    def _swap_columns(self, i, j):
+        """
+        Swap the jobs of two positions in the job columns.
+
+        :param i: position of one file; int
+        :param j: position of the other file; int
+        """
+        num_samples = len(self.file_order)
+        for offset in range(0, len(self.memory), num_samples):
+            a, b = offset + i, offset + j
+            self.duration[a], self.duration[b] = \
+                self.duration[b], self.duration[a]
+            self.memory[a], self.memory[b] = self.memory[b], self.memory[a]
+
+
+class _SwapRun:
+    """
+    The checkpoints recorded while CheckpointedSchedule.swap_makespan runs a
+    swapped order, for swap to take over if the swap is made.
+    """
+
+    __slots__ = ("i", "j", "spacing", "suffix_memory", "checkpoint", "reach",
+                 "states", "makespan")
+
+    def __init__(self, schedule, i, j):
+        """
+        Construct a new instance of class _SwapRun with no checkpoints, for a
+        schedule whose job columns already have positions i < j swapped.
+
+        :param schedule: the schedule the swap is scored on;
+        CheckpointedSchedule
+        :param i: the earlier swapped position; int
+        :param j: the later swapped position; int
+        """
+        self.i, self.j = i, j
+        self.spacing = schedule.spacing
+        self.suffix_memory = schedule.suffix_memory.copy()
+        for position in range(j, i, -1):
+            self.suffix_memory[position] = min(
+                schedule.memory[position], self.suffix_memory[position + 1])
+        self.checkpoint = None
+        self.reach = []
+        self.states = []
+        self.makespan = None
+
+    def record(self, state):
+        """
+        Keep a checkpoint, called by the engine.
+
+        :param state: a copy of the engine state before a round of scheduling;
+        _EngineState
+        """
+        self.reach.append(state.reach)
+        self.states.append(state)
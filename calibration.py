@@ -0,0 +1,381 @@
+import csv
+import json
+from collections import namedtuple
+from math import ceil
+
+import numpy as np
+
+from calc_makespan import PipelineTask
+
+# One past run of a task: which task, the size of its file, the CPUs it was given, how long it took and the most
+# memory it held, in the units of the pipeline
+RunRecord = namedtuple("RunRecord", ["task", "file_size", "cpus", "wall_time", "peak_rss"])
+
+# Serial fractions tried when fitting an Amdahl model
+_SERIAL_FRACTIONS = np.linspace(0, 1, 1001)
+
+
+def main():
+    """ Calibrate an example pipeline from a made up log and compare the CPUs worth giving each task """
+    rng = np.random.default_rng(1)
+    records = []
+    for size in rng.integers(5, 60, 40).tolist():
+        for cpus in (1, 2, 4, 8, 16):
+            # align scales well, qc barely uses more than 2 CPUs
+            records.append(RunRecord("align", size, cpus, 6 * size * (0.05 + 0.95 / cpus) * rng.uniform(0.95, 1.05),
+                                     2 * size + 3))
+            records.append(RunRecord("qc", size, cpus, 4 * size * (0.6 + 0.4 / cpus) * rng.uniform(0.95, 1.05),
+                                     size + 1))
+
+    calibrations = calibrate(records)
+    for calibration in calibrations.values():
+        print(calibration)
+
+    tasks = [PipelineTask(name="qc", step=0, time_factor=4, space_factor=1, cpus=8),
+             PipelineTask(name="align", step=1, time_factor=6, space_factor=2, cpus=8)]
+    file_sizes = [8, 9, 10, 12, 7, 15, 22, 19, 11, 37, 45, 44, 2, 11, 5, 6, 8, 27, 1, 19]
+    for task in calibrated_tasks(tasks, calibrations, file_sizes):
+        durations = [task.parallel_func(20, task.time_factor, cpus) for cpus in (1, 2, 4, 8, 16)]
+        print(f"{task}: a file of size 20 takes {durations} on 1, 2, 4, 8 and 16 CPUs, "
+              f"space factor {task.space_factor}")
+
+
+def read_run_log(path):
+    """
+    Read a log of past runs, as JSON lines if the path ends in .jsonl and as CSV with a header row otherwise. Each
+    record needs the fields of RunRecord.
+
+    :param path: the file to read; str
+    :return: the runs in the order logged; list of RunRecord
+    """
+    with open(path, newline="") as file:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in file if line.strip()]
+        else:
+            rows = list(csv.DictReader(file))
+
+    records = []
+    for number, row in enumerate(rows, 1):
+        missing = [field for field in RunRecord._fields if field not in row]
+        if missing:
+            raise Exception(f"Record {number} of {path} is missing {', '.join(missing)}")
+        records.append(RunRecord(task=row["task"], file_size=float(row["file_size"]), cpus=int(row["cpus"]),
+                                 wall_time=float(row["wall_time"]), peak_rss=float(row["peak_rss"])))
+    return records
+
+
+class AmdahlModel:
+    """
+    Duration of a task with a serial part that more CPUs don't speed up:
+    time * size ** size_exponent * (serial_fraction + (1 - serial_fraction) / cpus), rounded up to whole time units.
+    A parallel_func for PipelineTask that takes file sizes and CPUs as numbers or numpy arrays.
+    """
+
+    def __init__(self, serial_fraction, size_exponent=1.0):
+        """
+        Construct a new instance of class AmdahlModel.
+
+        :param serial_fraction: fraction of the time on 1 CPU that can't run in parallel, from 0 to 1; float
+        :param size_exponent: how the time grows with the file size, 1 for in proportion; float
+        """
+        self.serial_fraction = serial_fraction
+        self.size_exponent = size_exponent
+
+    def __call__(self, size, time, cpus):
+        return _whole_units(time * size ** self.size_exponent *
+                            (self.serial_fraction + (1 - self.serial_fraction) / cpus))
+
+    def __repr__(self):
+        return f"Amdahl model: serial fraction {self.serial_fraction:.3f}, size exponent {self.size_exponent:.2f}"
+
+
+class PowerLawModel:
+    """
+    Duration of a task that speeds up as a power of its CPUs: time * size ** size_exponent / cpus ** cpu_exponent,
+    rounded up to whole time units. A cpu_exponent of 1 is the default parallel_func of PipelineTask.
+    """
+
+    def __init__(self, cpu_exponent, size_exponent=1.0):
+        """
+        Construct a new instance of class PowerLawModel.
+
+        :param cpu_exponent: how the time falls with more CPUs, 1 for a perfect speedup and 0 for none; float
+        :param size_exponent: how the time grows with the file size, 1 for in proportion; float
+        """
+        self.cpu_exponent = cpu_exponent
+        self.size_exponent = size_exponent
+
+    def __call__(self, size, time, cpus):
+        return _whole_units(time * size ** self.size_exponent / cpus ** self.cpu_exponent)
+
+    def __repr__(self):
+        return f"Power law model: CPU exponent {self.cpu_exponent:.3f}, size exponent {self.size_exponent:.2f}"
+
+
+class PiecewiseModel:
+    """
+    Duration of a task measured at a few CPU counts: time * size ** size_exponent * slowdown(cpus), where the
+    slowdown is interpolated linearly between the CPU counts measured and is the nearest one's outside them. The
+    slowdown at the fewest CPUs measured is 1, so time is the time for a file size of 1 on those CPUs.
+    """
+
+    def __init__(self, cpus, slowdown, size_exponent=1.0):
+        """
+        Construct a new instance of class PiecewiseModel.
+
+        :param cpus: the CPU counts measured, in increasing order; list of int
+        :param slowdown: the time on each of those CPU counts over the time on the first; list of float
+        :param size_exponent: how the time grows with the file size, 1 for in proportion; float
+        """
+        self.cpus = list(cpus)
+        self.slowdown = list(slowdown)
+        self.size_exponent = size_exponent
+
+    def __call__(self, size, time, cpus):
+        slowdown = np.interp(cpus, self.cpus, self.slowdown)
+        return _whole_units(time * size ** self.size_exponent * (slowdown if np.ndim(slowdown) else float(slowdown)))
+
+    def __repr__(self):
+        points = ", ".join(f"{cpus}: {slowdown:.3f}" for cpus, slowdown in zip(self.cpus, self.slowdown))
+        return f"Piecewise model: slowdown {{{points}}}, size exponent {self.size_exponent:.2f}"
+
+
+class MemoryModel:
+    """
+    Peak memory of a task as a power of its file size: scale * size ** size_exponent.
+    """
+
+    def __init__(self, scale, size_exponent=1.0):
+        """
+        Construct a new instance of class MemoryModel.
+
+        :param scale: the peak memory for a file size of 1; float
+        :param size_exponent: how the memory grows with the file size, 1 for in proportion; float
+        """
+        self.scale = scale
+        self.size_exponent = size_exponent
+
+    def __call__(self, size):
+        return self.scale * np.asarray(size, dtype=float) ** self.size_exponent
+
+    def space_factor(self, file_sizes):
+        """
+        The smallest whole space factor of a PipelineTask that gives every file at least the memory of the model,
+        since the simulations hold size * space_factor memory for a job.
+
+        :param file_sizes: the sizes of the files to be scheduled; list of int
+        :return: the space factor; int
+        """
+        sizes = np.asarray(file_sizes, dtype=float)
+        sizes = sizes[sizes > 0]
+        if sizes.size == 0:
+            return ceil(self.scale)
+        return ceil((self(sizes) / sizes).max())
+
+    def __repr__(self):
+        return f"Memory model: {self.scale:.3f} * size ** {self.size_exponent:.2f}"
+
+
+class TaskCalibration:
+    """
+    The models fitted to the past runs of one task, see calibrate
+    """
+
+    def __init__(self, name, time_factor, time_model, memory_model, error, runs):
+        """
+        Construct a new instance of class TaskCalibration.
+
+        :param name: name of the task; str
+        :param time_factor: the time_factor to pass the time model; float
+        :param time_model: the fitted duration of the task, a parallel_func for PipelineTask; callable
+        :param memory_model: the fitted peak memory of the task; MemoryModel
+        :param error: mean relative error of the time model over the runs, e.g. 0.05 for 5%; float
+        :param runs: number of runs fitted; int
+        """
+        self.name = name
+        self.time_factor = time_factor
+        self.time_model = time_model
+        self.memory_model = memory_model
+        self.error = error
+        self.runs = runs
+
+    def task(self, step, cpus, file_sizes, predecessors=None):
+        """
+        Make a PipelineTask that plans with the fitted models.
+
+        :param step: which step the task is in the pipeline; int
+        :param cpus: the number of CPUs designated for the task; int
+        :param file_sizes: the sizes of the files to be scheduled, to set the space factor by; list of int
+        :param predecessors: names of the tasks the task waits for, see PipelineTask; list of str
+        :return: the task; PipelineTask
+        """
+        return PipelineTask(name=self.name, step=step, time_factor=self.time_factor,
+                            space_factor=self.memory_model.space_factor(file_sizes), cpus=cpus,
+                            parallel_func=self.time_model, predecessors=predecessors)
+
+    def __repr__(self):
+        return (f"Calibration of {self.name} from {self.runs} runs: time factor {self.time_factor:.3f}, "
+                f"{self.time_model}, {self.error:.1%} error; {self.memory_model}")
+
+
+def calibrate(records, models=("amdahl", "power_law", "piecewise")):
+    """
+    Fit a time and a memory model to the past runs of every task in a log. Each time model is fitted by least
+    squares on the logarithm of the wall time, and the one with the lowest Akaike information criterion is kept, so
+    the piecewise model, which has one parameter per CPU count, is only kept when it fits enough better. With a
+    single file size logged the time and memory are taken to grow in proportion to the file size, and with a single
+    CPU count only a power law with a perfect speedup is fitted, as nothing is known about how the task scales.
+
+    :param records: the past runs, e.g. from read_run_log; list of RunRecord
+    :param models: the time models to choose from, any of "amdahl", "power_law" and "piecewise"; tuple of str
+    :return: the calibration of each task, by task name; dict of TaskCalibration
+    """
+    unknown = set(models) - {"amdahl", "power_law", "piecewise"}
+    if unknown or not models:
+        raise Exception(f"Unknown time models {sorted(unknown)}, expected amdahl, power_law or piecewise")
+
+    runs = {}
+    for record in records:
+        if record.file_size <= 0 or record.cpus < 1 or record.wall_time <= 0 or record.peak_rss <= 0:
+            raise Exception(f"Can't fit a run with a size, time or memory of 0 or less, or no CPUs: {record}")
+        runs.setdefault(record.task, []).append(record)
+
+    calibrations = {}
+    for name, task_runs in runs.items():
+        size, cpus, wall_time, peak_rss = (np.array(column, dtype=float) for column in list(zip(*task_runs))[1:])
+        fits = [_fit_time(model, np.log(size), cpus, np.log(wall_time)) for model in models]
+        fits = [fit for fit in fits if fit is not None]
+        if not fits:
+            fits = [_fit_time("power_law", np.log(size), cpus, np.log(wall_time))]
+        criterion, time_factor, time_model = min(fits, key=lambda fit: fit[0])
+
+        predicted = np.asarray(time_model(size, time_factor, cpus), dtype=float)
+        scale, size_exponent = _fit_log_linear(np.log(size), np.log(peak_rss))
+        calibrations[name] = TaskCalibration(name, time_factor, time_model, MemoryModel(scale, size_exponent),
+                                             float(np.mean(np.abs(predicted - wall_time) / wall_time)), len(task_runs))
+    return calibrations
+
+
+def calibrated_tasks(tasks, calibrations, file_sizes):
+    """
+    Replace the time factor, parallel_func and space factor of the tasks that have a calibration, keeping their
+    step, CPUs and predecessors.
+
+    :param tasks: the tasks of the pipeline; list of PipelineTask
+    :param calibrations: the calibration of each task, by task name, e.g. from calibrate; dict of TaskCalibration
+    :param file_sizes: the sizes of the files to be scheduled, see TaskCalibration.task; list of int
+    :return: the tasks, calibrated where possible, in the same order; list of PipelineTask
+    """
+    return [calibrations[task.name].task(task.step, task.cpus, file_sizes, task.predecessors)
+            if task.name in calibrations else task for task in tasks]
+
+
+def _fit_time(model, log_size, cpus, log_time):
+    """
+    Fit one time model by least squares on the logarithm of the wall time, see calibrate.
+
+    :param model: which model to fit, "amdahl", "power_law" or "piecewise"; str
+    :param log_size: logarithm of the file size of each run; numpy array
+    :param cpus: CPUs of each run; numpy array
+    :param log_time: logarithm of the wall time of each run; numpy array
+    :return: the Akaike information criterion of the fit, the time factor and the model, or None if the runs can't
+    tell the model's parameters apart; tuple
+    """
+    levels = np.unique(cpus)
+    fit_size = np.unique(log_size).size > 1
+    if levels.size < 2 and model != "power_law":
+        return None
+
+    if model == "amdahl":
+        # The size exponent and scale are linear in the logarithm for a given serial fraction, so every serial
+        # fraction on a grid is fitted and the best one kept
+        best = None
+        for serial_fraction in _SERIAL_FRACTIONS:
+            target = log_time - np.log(serial_fraction + (1 - serial_fraction) / cpus)
+            coefficients, sse = _least_squares(log_size, target, fit_size)
+            if best is None or sse < best[0]:
+                best = (sse, serial_fraction, coefficients)
+        sse, serial_fraction, (log_scale, size_exponent) = best
+        return _criterion(sse, len(log_time), 2 + fit_size), np.exp(log_scale), \
+            AmdahlModel(float(serial_fraction), size_exponent)
+
+    if model == "power_law":
+        if levels.size < 2:
+            coefficients, sse = _least_squares(log_size, log_time + np.log(cpus), fit_size)
+            log_scale, size_exponent = coefficients
+            return _criterion(sse, len(log_time), 1 + fit_size), np.exp(log_scale), PowerLawModel(1.0, size_exponent)
+        coefficients, sse = _least_squares(log_size, log_time, fit_size, [-np.log(cpus)])
+        log_scale, size_exponent, cpu_exponent = coefficients
+        return _criterion(sse, len(log_time), 2 + fit_size), np.exp(log_scale), \
+            PowerLawModel(cpu_exponent, size_exponent)
+
+    # One scale per CPU count measured, sharing the size exponent
+    indicators = [cpus == level for level in levels[1:]]
+    coefficients, sse = _least_squares(log_size, log_time, fit_size, indicators)
+    log_scale, size_exponent, offsets = coefficients[0], coefficients[1], coefficients[2:]
+    slowdown = [1.0] + np.exp(offsets).tolist()
+    return _criterion(sse, len(log_time), levels.size + fit_size), np.exp(log_scale), \
+        PiecewiseModel([int(level) for level in levels], slowdown, size_exponent)
+
+
+def _least_squares(log_size, target, fit_size, columns=()):
+    """
+    Fit target = log scale + size exponent * log size + the other columns' coefficients by least squares.
+
+    :param log_size: logarithm of the file size of each run; numpy array
+    :param target: what to fit; numpy array
+    :param fit_size: fit the size exponent, otherwise take it to be 1; bool
+    :param columns: the other columns; list of numpy arrays
+    :return: the log scale, the size exponent and the other coefficients, then the sum of squared errors; (list,
+    float)
+    """
+    if not fit_size:
+        target = target - log_size
+    design = np.column_stack([np.ones_like(target)] + ([log_size] if fit_size else []) + list(columns))
+    coefficients = np.linalg.lstsq(design, target, rcond=None)[0].tolist()
+    sse = float(((design @ coefficients - target) ** 2).sum())
+    if not fit_size:
+        coefficients.insert(1, 1.0)
+    return coefficients, sse
+
+
+def _fit_log_linear(log_x, log_y):
+    """
+    Fit y = scale * x ** exponent by least squares on the logarithms, with an exponent of 1 when every x is the
+    same.
+
+    :param log_x: logarithm of x; numpy array
+    :param log_y: logarithm of y; numpy array
+    :return: the scale and the exponent; (float, float)
+    """
+    (log_scale, exponent), sse = _least_squares(log_x, log_y, np.unique(log_x).size > 1)
+    return float(np.exp(log_scale)), exponent
+
+
+def _criterion(sse, n, parameters):
+    """
+    The Akaike information criterion of a least squares fit, lower for a better fit with fewer parameters.
+
+    :param sse: sum of squared errors; float
+    :param n: number of points fitted; int
+    :param parameters: number of parameters fitted; int
+    :return: the criterion; float
+    """
+    return n * np.log(max(sse, 1e-12) / n) + 2 * parameters
+
+
+def _whole_units(duration):
+    """
+    Round durations up to whole time units, as the simulations expect, keeping numbers as numbers and arrays as
+    arrays.
+
+    :param duration: the durations; float or numpy array
+    :return: the rounded durations; int or numpy array of int
+    """
+    if isinstance(duration, np.ndarray):
+        return np.ceil(duration).astype(np.int64)
+    return ceil(duration)
+
+
+if __name__ == "__main__":
+    main()
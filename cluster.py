@@ -0,0 +1,248 @@
+from bisect import insort
+from heapq import heappop, heappush
+
+import numpy as np
+
+from calc_makespan import CompiledPipeline, PipelineTask
+
+
+def main():
+    """ Run an example on a cluster of a big and a small node """
+    task_a = PipelineTask(name="A", step=0, time_factor=4, space_factor=1, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=6, space_factor=1, cpus=12)
+    tasks = [task_a, task_b]
+    nodes = [Node(name="big", max_cpus=16, max_memory=64), Node(name="small", max_cpus=8, max_memory=48)]
+    file_sizes = [8, 9, 10, 12, 7, 15, 22, 19, 11, 37, 45, 44, 2, 11, 5, 6, 8, 27, 1, 19]
+
+    alternating = [[j % 2, 1 - j % 2] for j in range(len(file_sizes))]
+
+    print(f"Round robin over {nodes}: {calc_cluster_makespan(file_sizes, nodes, tasks)}")
+    print(f"Everything on the big node: "
+          f"{calc_cluster_makespan(file_sizes, nodes, tasks, placement=[[0, 0]] * len(file_sizes))}")
+    print(f"Changing node between steps: {calc_cluster_makespan(file_sizes, nodes, tasks, placement=alternating)}")
+    print(f"Changing node between steps, taking 3 time units per unit of file size: "
+          f"{calc_cluster_makespan(file_sizes, nodes, tasks, placement=alternating, transfer_factor=3)}")
+
+
+class Node:
+    """
+    A machine of a cluster, with its own cores and memory
+    """
+
+    def __init__(self, name, max_cpus, max_memory):
+        """
+        Construct a new instance of class Node.
+
+        :param name: name of the node; str
+        :param max_cpus: the number of cores in the node; int
+        :param max_memory: the memory limits of the node; int
+        """
+        self.name = name
+        self.max_cpus = max_cpus
+        self.max_memory = max_memory
+
+    def __repr__(self):
+        return f"Node {self.name}: {self.max_cpus} CPUs, {self.max_memory} memory"
+
+
+def calc_cluster_makespan(file_sizes, nodes, tasks, cpu_assignment=None, placement=None, transfer_factor=0):
+    """
+    Calculates the makespan of the pipeline on a cluster of nodes, each job running on the node it is placed on.
+    Every node schedules its own jobs by the rules of calc_makespan: the next task of a sample starts as soon as
+    enough resources are available on its node, checking ready jobs step by step, then in file order. A job uses
+    the CPUs assigned to its task, or every core of its node if that has fewer. A sample whose next task is placed
+    on another node than its last one has to be moved there first, taking transfer_factor time units per unit of
+    file size, so a transfer_factor above 0 favours keeping the steps of a sample on one node.
+
+    With a single node, every job on it and no transfer the makespan is the same as calc_makespan's.
+
+    :param file_sizes: size of the files rounded to the nearest unit, in processing order; int
+    :param nodes: the machines of the cluster; list of Node
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order the tasks are listed, or None to use the CPUs set
+    on the tasks; list of int
+    :param placement: the node of each task for each file, e.g. placement[j][i] is the index in nodes of the node
+    running the ith task (in the order the tasks are listed) of the jth file, or None to place every task of the
+    jth file on node j % len(nodes); list of lists of int
+    :param transfer_factor: time units to move a file size of 1 unit from one node to another; int
+    :return: the makespan of the pipeline in the same units given in the tasks, -1 if a job doesn't fit on its node
+    or a step is invalid; int
+    """
+    pipeline = ClusterPipeline(file_sizes, tasks, nodes, transfer_factor)
+    return pipeline.makespan(file_sizes, cpu_assignment, placement)
+
+
+class ClusterPipeline:
+    """
+    A pipeline prepared once for evaluating many schedules of the same files on the same cluster, e.g. by an
+    optimizer that reorders the files, changes the CPUs assigned to tasks and moves jobs between nodes. The
+    durations and memory come from a CompiledPipeline for the largest node.
+    """
+
+    def __init__(self, file_sizes, tasks, nodes, transfer_factor=0):
+        """
+        Construct a new instance of class ClusterPipeline.
+
+        :param file_sizes: size of the files rounded to the nearest unit; int
+        :param tasks: a list of tasks to be completed for each file; list of PipelineTask
+        :param nodes: the machines of the cluster; list of Node
+        :param transfer_factor: time units to move a file size of 1 unit from one node to another; int
+        """
+        if not nodes:
+            raise Exception("A cluster needs at least one node")
+        self.file_sizes = list(file_sizes)
+        self.tasks = list(tasks)
+        self.nodes = list(nodes)
+        self.transfer_factor = transfer_factor
+        self.node_cpus = [node.max_cpus for node in nodes]
+        self.node_memory = [node.max_memory for node in nodes]
+        self.max_cpus = max(self.node_cpus)
+        self.max_memory = max(self.node_memory)
+        self.pipeline = CompiledPipeline(file_sizes, tasks, self.max_cpus, self.max_memory)
+        if self.pipeline.valid and not self.pipeline.linear:
+            raise Exception("Clusters only support pipelines with one task per step, not DAG pipelines")
+        self.num_steps = self.pipeline.num_steps
+
+    def default_placement(self, num_files):
+        """
+        Place every task of the jth file on node j % len(nodes), see calc_cluster_makespan.
+
+        :param num_files: number of files; int
+        :return: the node of each task for each file; list of lists of int
+        """
+        return [[j % len(self.nodes)] * self.num_steps for j in range(num_files)]
+
+    def fits(self, file_order):
+        """
+        Find the nodes with enough memory for each task of each file, e.g. for an optimizer to only place jobs where
+        they fit.
+
+        :param file_order: the compiled file sizes; list of int
+        :return: whether the ith task (in the order the tasks were given) of the jth file fits on node k at [j, i, k];
+        numpy array of bool
+        """
+        index = np.asarray(self.pipeline._size_indices(file_order), dtype=np.int64)
+        memory = np.empty((len(index), self.num_steps), dtype=self.pipeline.memory_table.dtype)
+        memory[:, self.pipeline.step_order] = self.pipeline.memory_table[:, index].T
+        return memory[:, :, None] <= np.array(self.node_memory)[None, None, :]
+
+    def makespan(self, file_order, cpu_assignment=None, placement=None):
+        """
+        Calculate the makespan of the pipeline for one schedule, the same as calc_cluster_makespan would.
+
+        :param file_order: the compiled file sizes in processing order; list of int
+        :param cpu_assignment: CPUs assigned to each task in the order the tasks were given, or None for the CPUs
+        set on the tasks; list of int
+        :param placement: the node of each task for each file in file_order, or None for the default placement;
+        list of lists of int
+        :return: the makespan, -1 if the schedule is impossible; int
+        """
+        pipeline = self.pipeline
+        if not pipeline.valid:
+            return -1
+        num_samples = len(file_order)
+        if num_samples == 0:
+            return 0
+
+        cpus = pipeline._step_cpus(cpu_assignment)
+        if placement is None:
+            placement = self.default_placement(num_samples)
+        if len(placement) != num_samples:
+            raise Exception(f"Got a placement for {len(placement)} files, expected {num_samples}")
+
+        # Columns indexed by job id, as in calc_makespan, with the node of each job and the CPUs it uses there
+        index = pipeline._size_indices(file_order)
+        duration, memory, node_of, job_cpus = [], [], [], []
+        for step, (position, step_cpus) in enumerate(zip(pipeline.step_order, cpus)):
+            durations, memories = pipeline.duration[step], pipeline.memory[step]
+            for k, row in zip(index, placement):
+                node = row[position]
+                if not 0 <= node < len(self.nodes):
+                    raise Exception(f"Can't place a task on node {node} of a cluster of {len(self.nodes)}")
+                used = min(step_cpus, self.node_cpus[node])
+                if memories[k] > self.node_memory[node]:
+                    return -1
+                duration.append(durations[used - 1][k])
+                memory.append(memories[k])
+                node_of.append(node)
+                job_cpus.append(used)
+
+        transfer = [size * self.transfer_factor for size in file_order]
+        return _simulate_cluster(duration, memory, job_cpus, node_of, transfer, num_samples, self.num_steps,
+                                 self.node_cpus, self.node_memory)
+
+
+def _simulate_cluster(duration, memory, cpus, node_of, transfer, num_samples, num_steps, node_cpus, node_memory):
+    """
+    Run the pipeline on a cluster, see calc_cluster_makespan.
+
+    :param duration: duration of each job, indexed by job id; list
+    :param memory: memory of each job, indexed by job id; list
+    :param cpus: CPUs used by each job, indexed by job id; list of int
+    :param node_of: node each job runs on, indexed by job id; list of int
+    :param transfer: time to move each sample between nodes; list
+    :param num_samples: number of samples in the pipeline; int
+    :param num_steps: number of steps in the pipeline; int
+    :param node_cpus: the number of cores in each node; list of int
+    :param node_memory: the memory limits of each node; list of int
+    :return: the makespan; int
+    """
+    available_cpus = list(node_cpus)
+    available_mem = list(node_memory)
+    running = []  # min-heap of (end time, job id) for running jobs
+    moving = []  # min-heap of (arrival time, job id) for samples moving to the node of their next job
+
+    # Samples waiting for each step on each node, in file order
+    ready = [[[] for node in node_cpus] for step in range(num_steps)]
+    for sample in range(num_samples):
+        ready[0][node_of[sample]].append(sample)
+
+    makespan = t = 0
+    while True:
+        # Go through the ready samples step by step and start every job that fits on its node in file order
+        for step in range(num_steps):
+            offset = step * num_samples
+            for node, waiting in enumerate(ready[step]):
+                if not waiting:
+                    continue
+                kept = []
+                for sample in waiting:
+                    job = offset + sample
+                    if cpus[job] <= available_cpus[node] and memory[job] <= available_mem[node]:
+                        available_cpus[node] -= cpus[job]
+                        available_mem[node] -= memory[job]
+                        heappush(running, (t + duration[job], job))
+                    else:
+                        kept.append(sample)
+                ready[step][node] = kept
+
+        if not running and not moving:
+            break
+
+        # Move the clock forward to the next job end or arrival
+        t = running[0][0] if running and (not moving or running[0][0] <= moving[0][0]) else moving[0][0]
+
+        # Every running job ending now finishes, gives back its resources and sends its sample on to its next step
+        while running and running[0][0] == t:
+            job = heappop(running)[1]
+            node = node_of[job]
+            available_cpus[node] += cpus[job]
+            available_mem[node] += memory[job]
+            makespan = t
+            if job + num_samples < num_steps * num_samples:
+                sample = job % num_samples
+                if node_of[job + num_samples] == node or not transfer[sample]:
+                    insort(ready[job // num_samples + 1][node_of[job + num_samples]], sample)
+                else:
+                    heappush(moving, (t + transfer[sample], job + num_samples))
+
+        # Every sample arriving now waits for its next step on its new node
+        while moving and moving[0][0] == t:
+            job = heappop(moving)[1]
+            insort(ready[job // num_samples][node_of[job]], job % num_samples)
+
+    return makespan
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from calc_makespan import calc_makespan, PipelineTask
+
+
+def main():
+    """ Compare the makespan of every dispatch policy on an example """
+    task_a = PipelineTask(name="A", step=0, time_factor=4, space_factor=1, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=6, space_factor=1, cpus=12)
+    task_c = PipelineTask(name="C", step=1, time_factor=2, space_factor=2, cpus=4)
+    task_d = PipelineTask(name="D", step=2, time_factor=3, space_factor=1, cpus=6)
+    tasks = [task_a, task_b, task_c, task_d]
+    file_sizes = [8, 9, 10, 12, 7, 15, 22, 19, 11, 37, 45, 44, 2, 11, 5, 6, 8, 27, 1, 19]
+
+    for name, makespan in compare_policies(file_sizes, 100, 16, tasks).items():
+        print(f"{name}: {makespan}")
+
+
+class DispatchPolicy:
+    """
+    Which ready jobs a simulation starts first, and whether jobs behind one that doesn't fit yet may start before
+    it. Ready jobs are ranked by priority, lowest first:
+
+    - "step": the earliest step, then the earliest file in the file order, as calc_makespan does without a policy
+    - "fifo": the job that has been ready the longest
+    - "sjf": the shortest job
+    - "largest_memory": the job using the most memory
+    - "critical_path": the job with the longest time left until its file is done, counting the job itself
+
+    Every order breaks ties by step, then file order. When the job ranked first doesn't fit, backfill decides what
+    happens to the ones behind it:
+
+    - "greedy": every job that fits starts, as calc_makespan does without a policy
+    - "aggressive": the first job that doesn't fit is given a reservation at the earliest time it will, and the
+      jobs behind it only start if they end before then or leave it enough room (EASY backfilling)
+    - "conservative": every job that doesn't fit is given a reservation, so no job is ever delayed by one ranked
+      behind it
+    - "none": nothing starts until the first job fits
+
+    Other orders can be added by overriding priority, e.g.
+
+        class LastFileFirst(DispatchPolicy):
+            def priority(self, job):
+                return -job.sample, job.step
+
+        calc_makespan(file_sizes, 64, 16, tasks, policy=LastFileFirst(backfill="aggressive"))
+    """
+
+    ORDERS = ("step", "fifo", "sjf", "largest_memory", "critical_path")
+    BACKFILLS = ("greedy", "aggressive", "conservative", "none")
+
+    def __init__(self, order="step", backfill="greedy"):
+        """
+        Construct a new instance of class DispatchPolicy.
+
+        :param order: how ready jobs are ranked, one of ORDERS; str
+        :param backfill: what may start behind a job that doesn't fit, one of BACKFILLS; str
+        """
+        if order not in self.ORDERS and type(self).priority is DispatchPolicy.priority:
+            raise Exception(f"Unknown dispatch order {order}, expected one of {', '.join(self.ORDERS)}")
+        if backfill not in self.BACKFILLS:
+            raise Exception(f"Unknown backfilling {backfill}, expected one of {', '.join(self.BACKFILLS)}")
+        self.order = order
+        self.backfill = backfill
+
+    def __repr__(self):
+        return f"DispatchPolicy {self.order}, {self.backfill} backfilling"
+
+    def priority(self, job):
+        """
+        Rank a ready job, called once when it becomes ready.
+
+        :param job: what is known about the job; calc_makespan.ReadyJob
+        :return: a key that sorts before the keys of the jobs to start after it; tuple
+        """
+        if self.order == "fifo":
+            return job.ready_time, job.step, job.sample
+        if self.order == "sjf":
+            return job.duration, job.step, job.sample
+        if self.order == "largest_memory":
+            return -job.memory, job.step, job.sample
+        if self.order == "critical_path":
+            return -job.critical_path, job.step, job.sample
+        return job.step, job.sample
+
+
+def compare_policies(file_sizes, max_memory, max_cpus, tasks, policies=None, cpu_assignment=None):
+    """
+    Calculate the makespan of the same schedule under several dispatch policies.
+
+    :param file_sizes: size of the files rounded to the nearest unit, in processing order; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file; list of PipelineTask
+    :param policies: the policies to compare, or None for every order with every backfilling; list of
+    DispatchPolicy
+    :param cpu_assignment: CPUs assigned to each task in the order the tasks are listed, or None to use the CPUs
+    set on the tasks; list of int
+    :return: the makespan under each policy, keyed by "order/backfill"; dict
+    """
+    if policies is None:
+        policies = [DispatchPolicy(order, backfill) for order in DispatchPolicy.ORDERS
+                    for backfill in DispatchPolicy.BACKFILLS]
+    return {f"{policy.order}/{policy.backfill}": calc_makespan(file_sizes, max_memory, max_cpus, tasks,
+                                                               cpu_assignment, policy=policy)
+            for policy in policies}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+from bisect import bisect_right
+from timeit import default_timer
+
+from calc_makespan import CompiledPipeline, PipelineTask
+
+
+def main():
+    """ Compare the constructive heuristics on an example, each found in a fraction of a GA's time """
+    task_a = PipelineTask(name="A", step=0, time_factor=4, space_factor=1, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=6, space_factor=1, cpus=12)
+    tasks = [task_a, task_b]
+    file_sizes = [8, 9, 10, 12, 7, 15, 22, 19, 11, 37, 45, 44, 2, 11, 5, 6, 8, 27, 1, 19]
+    pipeline = CompiledPipeline(file_sizes, tasks, max_cpus=16, max_memory=64)
+
+    print(f"Input order: {pipeline.makespan(file_sizes)}")
+    for name, heuristic in HEURISTICS.items():
+        start = default_timer()
+        order = heuristic(file_sizes, 64, 16, tasks, pipeline=pipeline)
+        elapsed = default_timer() - start
+        print(f"{name}: {pipeline.makespan(order)} with order {order} in {elapsed * 1000:.2f}ms")
+
+
+def johnson_order(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, pipeline=None):
+    """
+    Order files by Johnson's rule, which is optimal for two steps with unlimited memory and one file per step at a
+    time: files that are quicker in the first step than in the second go first, in increasing first step time,
+    then the rest in decreasing second step time. With more than two steps the first and second half of the steps
+    are treated as one step each, and with one step files are in decreasing time.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param pipeline: these files and tasks already compiled, or None to compile them; CompiledPipeline
+    :return: the file sizes in processing order; list of int
+    """
+    durations = _step_durations(file_sizes, max_memory, max_cpus, tasks, cpu_assignment, pipeline)
+    half = (len(durations) + 1) // 2
+    first = [sum(step[k] for step in durations[:half]) for k in range(len(file_sizes))]
+    second = [sum(step[k] for step in durations[half:]) for k in range(len(file_sizes))]
+
+    if not durations[half:]:
+        return [file_sizes[k] for k in sorted(range(len(file_sizes)), key=lambda k: -first[k])]
+
+    quicker_first = sorted((k for k in range(len(file_sizes)) if first[k] <= second[k]), key=lambda k: first[k])
+    quicker_second = sorted((k for k in range(len(file_sizes)) if first[k] > second[k]), key=lambda k: -second[k])
+    return [file_sizes[k] for k in quicker_first + quicker_second]
+
+
+def neh_order(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, pipeline=None):
+    """
+    Order files by the NEH insertion heuristic: files are taken in decreasing total time over all steps, and each
+    is inserted at the position in the order so far that gives the lowest makespan. That takes about n^2 / 2
+    simulations instead of the single sort of the other heuristics, so suits up to a hundred or so files.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param pipeline: these files and tasks already compiled, or None to compile them; CompiledPipeline
+    :return: the file sizes in processing order; list of int
+    """
+    if pipeline is None:
+        pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    durations = _step_durations(file_sizes, max_memory, max_cpus, tasks, cpu_assignment, pipeline)
+    total = [sum(step[k] for step in durations) for k in range(len(file_sizes))]
+    if cpu_assignment is None:
+        cpu_assignment = pipeline.default_cpus
+
+    order = []
+    for k in sorted(range(len(file_sizes)), key=lambda k: -total[k]):
+        candidates = [order[:position] + [file_sizes[k]] + order[position:] for position in range(len(order) + 1)]
+        makespans = [pipeline.makespan(candidate, cpu_assignment) for candidate in candidates]
+        if min(makespans) < 0:
+            return list(file_sizes)  # no order is possible, so there is nothing to improve on
+        order = candidates[makespans.index(min(makespans))]  # earliest position wins ties
+    return order
+
+
+def lpt_order(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, pipeline=None):
+    """
+    Order files largest first (longest processing time), so the longest files don't finish last, in waves that
+    fit in memory together: each wave starts with the largest file left and is filled with the largest files that
+    still fit alongside it in memory, up to as many files as can run at once for CPUs. A wave's memory is counted
+    with the largest space factor of any task and its CPUs with the most CPUs of any task, as if every file in it
+    ran the same task at once, so with steps of different sizes a wave may leave memory or CPUs unused.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param pipeline: these files and tasks already compiled, or None to compile them; CompiledPipeline
+    :return: the file sizes in processing order; list of int
+    """
+    return _wave_order(file_sizes, max_memory, max_cpus, tasks, cpu_assignment)
+
+
+def spt_order(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, pipeline=None):
+    """
+    Order files smallest first (shortest processing time), so later steps get work as early as possible. Memory
+    is not taken into account: files are only sorted by size, which leaves as many files as possible in memory at
+    once but can't keep a large file from starting late next to other large ones.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param pipeline: these files and tasks already compiled, or None to compile them; CompiledPipeline
+    :return: the file sizes in processing order; list of int
+    """
+    return sorted(file_sizes)
+
+
+# Every heuristic by name, e.g. to seed an optimizer with one order of each
+HEURISTICS = {"Johnson": johnson_order, "NEH": neh_order, "LPT": lpt_order, "SPT": spt_order}
+
+# The heuristics used unless others are chosen, each a single sort of the files. NEH is added for up to
+# NEH_MAX_FILES files, as its simulations take about a second there and grow with the cube of the files
+DEFAULT_HEURISTICS = ("Johnson", "LPT", "SPT")
+NEH_MAX_FILES = 50
+
+
+def heuristic_orders(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, pipeline=None, heuristics=None):
+    """
+    Order files by several heuristics, e.g. to seed a GA population.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param pipeline: these files and tasks already compiled, or None to compile them; CompiledPipeline
+    :param heuristics: names in HEURISTICS of the heuristics to use, or None for DEFAULT_HEURISTICS and, for up to
+    NEH_MAX_FILES files, NEH; list of str
+    :return: the order found by each heuristic, keyed by its name in HEURISTICS; dict of list of int
+    """
+    if heuristics is None:
+        heuristics = list(DEFAULT_HEURISTICS) + (["NEH"] if len(file_sizes) <= NEH_MAX_FILES else [])
+    for name in heuristics:
+        if name not in HEURISTICS:
+            raise Exception(f"Unknown heuristic {name}, expected one of {', '.join(HEURISTICS)}")
+    if pipeline is None:
+        pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    return {name: HEURISTICS[name](file_sizes, max_memory, max_cpus, tasks, cpu_assignment, pipeline)
+            for name in heuristics}
+
+
+def best_heuristic(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, pipeline=None, heuristics=None):
+    """
+    Order files by several heuristics and keep the order with the lowest makespan.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param pipeline: these files and tasks already compiled, or None to compile them; CompiledPipeline
+    :param heuristics: names in HEURISTICS of the heuristics to use, or None for the ones heuristic_orders uses by
+    default; list of str
+    :return: the lowest makespan, -1 if no order is possible, and the order that achieved it; (int, list of int)
+    """
+    if pipeline is None:
+        pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    orders = list(heuristic_orders(file_sizes, max_memory, max_cpus, tasks, cpu_assignment, pipeline,
+                                   heuristics).values())
+    cpus = pipeline.default_cpus if cpu_assignment is None else list(cpu_assignment)
+    makespans = pipeline.makespan_batch(orders, [cpus] * len(orders)).tolist()
+    best = min(range(len(orders)), key=lambda i: (makespans[i] < 0, makespans[i]))
+    return makespans[best], orders[best]
+
+
+def _step_durations(file_sizes, max_memory, max_cpus, tasks, cpu_assignment, pipeline):
+    """
+    Look up how long each step takes for each file.
+
+    :param pipeline: these files and tasks already compiled, or None to compile them; CompiledPipeline
+    :return: row i column k is the duration of the ith step for the kth file; list of lists
+    """
+    if pipeline is None:
+        pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    if not pipeline.valid:
+        return [[0] * len(file_sizes)]
+    cpus = [min(step_cpus, max_cpus) for step_cpus in pipeline._step_cpus(cpu_assignment)]
+    index = pipeline._size_indices(file_sizes)
+    return [[pipeline.duration[step][step_cpus - 1][k] for k in index] for step, step_cpus in enumerate(cpus)]
+
+
+def _wave_order(file_sizes, max_memory, max_cpus, tasks, cpu_assignment):
+    """
+    Order files largest first in waves that fit in memory together, see lpt_order.
+
+    :return: the file sizes in processing order; list of int
+    """
+    if cpu_assignment is None:
+        cpu_assignment = [task.cpus for task in tasks]
+    wave_size = max(1, max_cpus // max(max(cpu_assignment, default=1), 1))
+    space_factor = max((task.space_factor for task in tasks), default=0)
+
+    left = sorted(file_sizes)  # files not ordered yet
+    order = []
+    while left:
+        wave = [left.pop()]
+        memory = max_memory - wave[0] * space_factor
+        while left and len(wave) < wave_size:
+            # Largest file that fits in the memory left
+            position = bisect_right(left, memory / space_factor if space_factor else left[-1]) - 1
+            if position < 0:
+                break
+            memory -= left[position] * space_factor
+            wave.append(left.pop(position))
+        order.extend(wave)
+    return order
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+from collections import namedtuple
+from math import ceil, inf
+
+import numpy as np
+
+from calc_makespan import CompiledPipeline, PipelineTask
+
+# Each bound on the makespan, see makespan_bounds
+MakespanBounds = namedtuple("MakespanBounds", ["cpu_area", "memory_area", "chain", "bottleneck"])
+
+
+def main():
+    """ Show how far the input order of an example is from its lower bound """
+    task_a = PipelineTask(name="A", step=0, time_factor=4, space_factor=1, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=6, space_factor=1, cpus=12)
+    tasks = [task_a, task_b]
+    file_sizes = [8, 9, 10, 12, 7, 15, 22, 19, 11, 37, 45, 44, 2, 11, 5, 6, 8, 27, 1, 19]
+    pipeline = CompiledPipeline(file_sizes, tasks, max_cpus=16, max_memory=64)
+
+    print(f"Bounds with the CPUs set on the tasks: {pipeline_bounds(pipeline)}")
+    print(f"Bounds with any CPUs: {pipeline_bounds(pipeline, any_cpus=True)}")
+    makespan, bound = pipeline.makespan(file_sizes), pipeline_lower_bound(pipeline)
+    print(f"Input order: {makespan}, lower bound {bound}, gap {optimality_gap(makespan, bound):.1%}")
+
+
+def lower_bound(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, any_cpus=False):
+    """
+    A makespan no schedule of the given files can beat, the greatest of makespan_bounds. When the schedule that
+    achieves it is found, no search has to go on.
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param any_cpus: bound every CPU assignment instead of just the one given, for optimizers that search CPUs;
+    bool
+    :return: the lower bound, rounded up when every duration is a whole number, 0 if no schedule is possible;
+    int or float
+    """
+    pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    return pipeline_lower_bound(pipeline, cpu_assignment, any_cpus)
+
+
+def makespan_bounds(file_sizes, max_memory, max_cpus, tasks, cpu_assignment=None, any_cpus=False):
+    """
+    Lower bounds on the makespan of any order of the given files, each from a different reason a schedule takes
+    time:
+
+    - cpu_area: all the CPU time of every job spread over every CPU
+    - memory_area: all the memory held over time by every job spread over all the memory
+    - chain: the time the slowest file takes through every step on its own, along the longest path of a DAG
+      pipeline
+    - bottleneck: for each step, the time before any of its jobs can start, its jobs run as many at a time as
+      fit in CPUs and memory, then the time the quickest file takes through the steps after it; the slowest step
+
+    :param file_sizes: size of the files rounded to the nearest unit; int
+    :param max_memory: the memory limits of the machine; int
+    :param max_cpus: the number of cores in the machine; int
+    :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+    :param cpu_assignment: CPUs assigned to each task in the order listed, or None to use the CPUs set on the
+    tasks; list of int
+    :param any_cpus: bound every CPU assignment instead of just the one given, for optimizers that search CPUs;
+    bool
+    :return: each bound, all 0 if no schedule is possible; MakespanBounds
+    """
+    pipeline = CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    return pipeline_bounds(pipeline, cpu_assignment, any_cpus)
+
+
+def pipeline_lower_bound(pipeline, cpu_assignment=None, any_cpus=False):
+    """
+    The same as lower_bound, for a pipeline already compiled.
+
+    :param pipeline: the pipeline to bound; CompiledPipeline
+    :param cpu_assignment: CPUs assigned to each task in the order the tasks were given, or None for the CPUs set
+    on the tasks; list of int
+    :param any_cpus: bound every CPU assignment instead of just the one given; bool
+    :return: the lower bound; int or float
+    """
+    bound = max(pipeline_bounds(pipeline, cpu_assignment, any_cpus))
+    whole = np.all(np.mod(pipeline.duration_table, 1) == 0)
+    return ceil(bound - 1e-9) if whole else bound
+
+
+def pipeline_bounds(pipeline, cpu_assignment=None, any_cpus=False):
+    """
+    The same as makespan_bounds, for a pipeline already compiled.
+
+    :param pipeline: the pipeline to bound; CompiledPipeline
+    :param cpu_assignment: CPUs assigned to each task in the order the tasks were given, or None for the CPUs set
+    on the tasks; list of int
+    :param any_cpus: bound every CPU assignment instead of just the one given; bool
+    :return: each bound; MakespanBounds
+    """
+    if not pipeline.valid or not pipeline.feasible or not pipeline.file_sizes:
+        return MakespanBounds(0, 0, 0, 0)
+
+    # CPU counts each step may use, a mask over duration_table's second axis
+    cpu_counts = np.arange(1, pipeline.max_cpus + 1)
+    if any_cpus:
+        allowed = np.ones((pipeline.num_steps, pipeline.max_cpus), dtype=bool)
+    else:
+        cpus = pipeline._step_cpus(cpu_assignment)
+        if max(cpus, default=0) > pipeline.max_cpus:
+            return MakespanBounds(0, 0, 0, 0)
+        allowed = cpu_counts[None, :] == np.array(cpus)[:, None]
+
+    # Everything is per step, CPU count and distinct file size, with the sizes weighted by how many files have them
+    counts = np.zeros(pipeline.sizes.size)
+    np.add.at(counts, np.searchsorted(pipeline.sizes, pipeline.file_sizes), 1)
+    duration = np.where(allowed[:, :, None], pipeline.duration_table, inf)
+    memory = pipeline.memory_table
+    quickest = duration.min(axis=1)  # quickest each step can be for each size
+
+    cpu_area = ((duration * cpu_counts[None, :, None]).min(axis=1) @ counts).sum() / pipeline.max_cpus
+    memory_area = (quickest * memory).sum(axis=0) @ counts / pipeline.max_memory
+
+    # Longest paths through the tasks before and after each task, which for a chain are the sums of the steps
+    # before and after it
+    head = np.zeros_like(quickest)
+    for task, before in enumerate(pipeline.predecessors):
+        for predecessor in before:
+            head[task] = np.maximum(head[task], head[predecessor] + quickest[predecessor])
+    tail = np.zeros_like(quickest)
+    for task in reversed(range(pipeline.num_steps)):
+        for predecessor in pipeline.predecessors[task]:
+            tail[predecessor] = np.maximum(tail[predecessor], tail[task] + quickest[task])
+    chain = (head + quickest + tail).max()
+
+    # Jobs of a step run at most as many at a time as fit in CPUs, and in memory even if they are the smallest
+    capacity = np.minimum(pipeline.max_cpus // cpu_counts[None, :],
+                          pipeline.max_memory // np.maximum(memory.min(axis=1), 1)[:, None])
+    step_time = (duration @ counts / capacity).min(axis=1)
+    bottleneck = (head.min(axis=1) + step_time + tail.min(axis=1)).max()
+
+    return MakespanBounds(*(float(bound) for bound in (cpu_area, memory_area, chain, bottleneck)))
+
+
+def cluster_lower_bound(cluster):
+    """
+    A makespan no schedule of a cluster can beat, whatever the order, CPUs and placement: the lower bound of one
+    machine with every core and all the memory of the cluster, which can run anything the cluster can at least as
+    soon.
+
+    :param cluster: the cluster pipeline to bound; cluster.ClusterPipeline
+    :return: the lower bound; int or float
+    """
+    pooled = CompiledPipeline(cluster.file_sizes, cluster.tasks, sum(cluster.node_cpus), sum(cluster.node_memory))
+    return pipeline_lower_bound(pooled, any_cpus=True)
+
+
+def optimality_gap(makespan, bound):
+    """
+    How far a makespan is from a lower bound, relative to the bound. The makespan is optimal if this is 0, but
+    may also be optimal while it isn't, as the bound can be lower than the optimum.
+
+    :param makespan: the makespan of a schedule; int
+    :param bound: a lower bound on the makespan of every schedule; int
+    :return: the gap, e.g. 0.05 for 5% above the bound; float
+    """
+    if bound <= 0:
+        return 0 if makespan <= 0 else inf
+    return (makespan - bound) / bound
+
+
+if __name__ == "__main__":
+    main()
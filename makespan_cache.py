@@ -0,0 +1,136 @@
+from collections import OrderedDict, namedtuple
+from hashlib import blake2b
+
+import numpy as np
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class MakespanCache:
+    """
+    A bounded least recently used cache of makespans for one pipeline, keyed on a 16 byte digest of the file order
+    and the CPU assignment of a schedule, so an entry takes a few hundred bytes however many files there are.
+    Optimizers re-score the same schedules many times (e.g. the elite of a converged
+    GA population, or a swap annealing has already tried), so these are looked up instead of simulated again.
+    One cache can be shared by every optimizer run on the same pipeline.
+    """
+
+    def __init__(self, pipeline, maxsize=100000):
+        """
+        Construct a new instance of class MakespanCache.
+
+        :param pipeline: the pipeline schedules are evaluated on; CompiledPipeline
+        :param maxsize: the most makespans kept, evicting the least recently used; int
+        """
+        self.pipeline = pipeline
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._makespans = OrderedDict()
+
+    def key(self, file_order, cpu_assignment=None):
+        """
+        Canonical form of a schedule, the same for lists, tuples and numpy arrays with equal values. The file order
+        is hashed to a 128 bit digest rather than kept whole, so two different orders only share a key with a
+        chance of about 1 in 2 ** 64 even after billions of schedules.
+
+        :param file_order: the file sizes in processing order; list of int
+        :param cpu_assignment: CPUs assigned to each task, or None for the CPUs set on the tasks; list of int
+        :return: the key of the schedule; (bytes, tuple of int)
+        """
+        if cpu_assignment is None:
+            cpu_assignment = self.pipeline.default_cpus
+        order = np.asarray(file_order)
+        order = order.astype(np.float64 if np.issubdtype(order.dtype, np.floating) else np.int64, copy=False)
+        return blake2b(order.tobytes(), digest_size=16).digest(), tuple(np.asarray(cpu_assignment).tolist())
+
+    def makespan(self, file_order, cpu_assignment=None, evaluate=None):
+        """
+        Look up the makespan of one schedule, simulating it if it is not cached.
+
+        :param file_order: the file sizes in processing order; list of int
+        :param cpu_assignment: CPUs assigned to each task, or None for the CPUs set on the tasks; list of int
+        :param evaluate: what to call for the makespan if it is not cached, e.g. to score a swap of a
+        CheckpointedSchedule from a checkpoint, or None to simulate the schedule from the start; callable taking no
+        arguments
+        :return: the makespan, -1 if the schedule is impossible; int
+        """
+        key = self.key(file_order, cpu_assignment)
+        makespan = self._lookup(key)
+        if makespan is None:
+            makespan = evaluate() if evaluate is not None else \
+                self.pipeline.makespan(np.asarray(file_order).tolist(), key[1])
+            self._store(key, makespan)
+        return makespan
+
+    def makespan_batch(self, file_orders, cpu_assignments=None, evaluator=None):
+        """
+        Look up the makespans of many schedules, simulating the ones that are not cached together in one batch.
+
+        :param file_orders: one ordering of the file sizes per schedule; 2-D array-like of int
+        :param cpu_assignments: CPUs assigned to each task per schedule, or None for the CPUs set on the tasks;
+        2-D array-like of int
+        :param evaluator: what simulates the missing schedules, e.g. a pool of workers for the same pipeline, or
+        None for the cache's pipeline; PoolEvaluator
+        :return: the makespan of each schedule, -1 where impossible; list
+        """
+        if cpu_assignments is None:
+            cpu_assignments = [None] * len(file_orders)
+        keys = [self.key(file_order, cpu_assignment)
+                for file_order, cpu_assignment in zip(file_orders, cpu_assignments)]
+
+        makespans = [self._lookup(key) for key in keys]
+
+        # Simulate each missing schedule once, even if it appears several times in the batch
+        missing = {}
+        for key, makespan, file_order in zip(keys, makespans, file_orders):
+            if makespan is None and key not in missing:
+                missing[key] = file_order
+        if missing:
+            evaluator = evaluator if evaluator is not None else self.pipeline
+            results = evaluator.makespan_batch(list(missing.values()), [key[1] for key in missing]).tolist()
+            for key, makespan in zip(missing, results):
+                self._store(key, makespan)
+            found = dict(zip(missing, results))
+            makespans = [found[key] if makespan is None else makespan for key, makespan in zip(keys, makespans)]
+
+        return makespans
+
+    def cache_info(self):
+        """
+        Report cache statistics.
+
+        :return: hits, misses, maximum and current size; CacheInfo
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._makespans))
+
+    def cache_clear(self):
+        """ Remove every makespan from the cache and reset the statistics """
+        self._makespans.clear()
+        self.hits = self.misses = 0
+
+    def _lookup(self, key):
+        """
+        Find a cached makespan, marking it as the most recently used and counting the hit or miss.
+
+        :param key: the key of a schedule, see key; tuple
+        :return: the makespan, or None if it is not cached; int
+        """
+        makespan = self._makespans.get(key)
+        if makespan is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._makespans.move_to_end(key)
+        return makespan
+
+    def _store(self, key, makespan):
+        """
+        Cache a makespan, evicting the least recently used one if the cache is full.
+
+        :param key: the key of a schedule, see key; tuple
+        :param makespan: the makespan of the schedule; int
+        """
+        self._makespans[key] = makespan
+        if len(self._makespans) > self.maxsize:
+            self._makespans.popitem(last=False)
@@ -0,0 +1,305 @@
+from bisect import insort
+from collections import namedtuple
+from heapq import heappop, heappush
+from math import inf
+from random import Random
+
+from calc_makespan import PipelineTask
+from run_control import RunControl
+
+# A job started by the online scheduler: when it runs, whose file it is, which step and what it holds
+Dispatch = namedtuple("Dispatch", ["start", "end", "sample", "file_size", "step", "cpus", "memory"])
+
+
+def main():
+    """ Stream files into a pipeline as they arrive, printing what starts """
+    task_a = PipelineTask(name="A", step=0, time_factor=4, space_factor=1, cpus=8)
+    task_b = PipelineTask(name="B", step=1, time_factor=6, space_factor=1, cpus=12)
+    scheduler = OnlineScheduler(max_memory=64, max_cpus=16, tasks=[task_a, task_b], horizon=8, time_budget=0.02)
+
+    arrivals = [(0, 25), (0, 15), (3, 10), (5, 5), (5, 33), (12, 8), (20, 22), (21, 9), (30, 18), (31, 42)]
+    for release_time, file_size in arrivals:
+        for dispatch in scheduler.submit(file_size, release_time):
+            print(dispatch)
+    for dispatch in scheduler.finish():
+        print(dispatch)
+    print(f"Makespan {scheduler.makespan}")
+
+
+class OnlineScheduler:
+    """
+    Schedules files that arrive over time, keeping the clock, the running jobs and the files waiting between calls
+    instead of simulating from time 0 again. Jobs start by the rules of calc_makespan: ready jobs are checked step
+    by step, files waiting for their first step in the planned order and files part way through in the order they
+    arrived, and every job that fits starts.
+
+    Every time a file arrives, the order of the files that haven't started is re-planned by a swap search limited to
+    the first horizon of them and to time_budget seconds, scoring each order by simulating what is known so far to
+    the end. Files already started are never moved, so the latency of an arrival is bounded by the search budget
+    whatever the number of files seen so far, e.g.
+
+        scheduler = OnlineScheduler(max_memory=64, max_cpus=16, tasks=tasks)
+        for dispatch in scheduler.submit(25, release_time=3):
+            print(dispatch)
+    """
+
+    def __init__(self, max_memory, max_cpus, tasks, cpu_assignment=None, horizon=8, time_budget=0.01,
+                 max_evaluations=None, seed=None):
+        """
+        Construct a new instance of class OnlineScheduler.
+
+        :param max_memory: the memory limits of the machine; int
+        :param max_cpus: the number of cores in the machine; int
+        :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
+        :param cpu_assignment: CPUs assigned to each task in the order the tasks are listed, or None to use the CPUs
+        set on the tasks; list of int
+        :param horizon: number of waiting files at the front of the plan the search may reorder, 0 to start files in
+        the order they arrive; int
+        :param time_budget: seconds the search may take per arrival, or None for no limit; float
+        :param max_evaluations: orders the search may score per arrival, or None for no limit; int
+        :param seed: seed for the search's random swaps; int
+        """
+        if cpu_assignment is None:
+            cpu_assignment = [task.cpus for task in tasks]
+        order = sorted(range(len(tasks)), key=lambda i: tasks[i].step)
+        self.tasks = [tasks[i] for i in order]
+        self.cpus = [cpu_assignment[i] for i in order]
+        if any(task.step != i or task.predecessors is not None for i, task in enumerate(self.tasks)):
+            raise Exception("The steps of the tasks must be 0, 1, 2, ..., DAG pipelines aren't supported online")
+        if max(self.cpus, default=0) > max_cpus:
+            raise Exception(f"Can't assign {max(self.cpus)} CPUs to a task when the max is {max_cpus}")
+        if time_budget is None and max_evaluations is None and horizon > 1:
+            raise Exception("The search needs a time budget or a number of evaluations per arrival")
+
+        self.max_memory = max_memory
+        self.max_cpus = max_cpus
+        self.horizon = horizon
+        self.time_budget = time_budget
+        self.max_evaluations = max_evaluations
+        self.evaluations = 0  # orders scored by every search so far
+        self._rng = Random(seed)
+
+        self.file_sizes = []  # size of each file, by sample id in order of arrival
+        self.release_times = []
+        self._state = _OnlineState(max_cpus, max_memory, self.cpus)
+        self._dispatched = []  # jobs started since the last call returned
+
+    @property
+    def t(self):
+        """ The clock, the time of the last arrival or job end simulated """
+        return self._state.t
+
+    @property
+    def makespan(self):
+        """ The latest end of a job started so far, the makespan once finish is called """
+        return self._state.makespan
+
+    @property
+    def waiting(self):
+        """ The sample ids of the files that haven't started, in the planned order """
+        return list(self._state.queues[0])
+
+    def submit(self, file_size, release_time=None):
+        """
+        A file arrives: move the clock to its release time, starting the jobs due before it, re-plan the files that
+        haven't started and start the jobs that fit now.
+
+        :param file_size: size of the file rounded to the nearest unit; int
+        :param release_time: when the file arrives, not before the clock, or None for now; int
+        :return: every job started since the last call, in the order they started; list of Dispatch
+        """
+        release_time = self.t if release_time is None else release_time
+        if release_time < self.t:
+            raise Exception(f"File released at {release_time} but the clock is already at {self.t}")
+        memory = [file_size * task.space_factor for task in self.tasks]
+        if max(memory, default=0) > self.max_memory:
+            raise Exception(f"A file of size {file_size} needs more than {self.max_memory} memory")
+
+        state = self._state
+        # Jobs ending at the release time give back their resources, but what starts then is left until the file
+        # has arrived and the plan includes it
+        state.run_until(release_time, self._dispatched, admit_last=False)
+        state.t = release_time
+
+        sample = len(self.file_sizes)
+        self.file_sizes.append(file_size)
+        self.release_times.append(release_time)
+        state.duration.append([task.parallel_func(file_size, task.time_factor, step_cpus)
+                               for task, step_cpus in zip(self.tasks, self.cpus)])
+        state.memory.append(memory)
+        state.queues[0].append(sample)
+
+        self._replan()
+        state.admit(self._dispatched)
+        return self._take()
+
+    def advance(self, t):
+        """
+        Move the clock to a time without an arrival, starting the jobs due up to then.
+
+        :param t: the time to move to, not before the clock; int
+        :return: every job started since the last call; list of Dispatch
+        """
+        if t < self.t:
+            raise Exception(f"Can't move the clock back from {self.t} to {t}")
+        self._state.run_until(t, self._dispatched)
+        self._state.t = t
+        return self._take()
+
+    def finish(self):
+        """
+        Run every file that has arrived to the end, e.g. when no more will.
+
+        :return: every job started since the last call; list of Dispatch
+        """
+        self._state.run_until(inf, self._dispatched)
+        return self._take()
+
+    def plan_makespan(self, order=None):
+        """
+        The makespan if no more files arrived and the waiting files started in the given order.
+
+        :param order: sample ids of the waiting files, or None for the planned order; list of int
+        :return: the makespan; int
+        """
+        return self._plan_score(order)[0]
+
+    def _plan_score(self, order=None):
+        """
+        Score a plan by simulating it to the end, see plan_makespan.
+
+        :param order: sample ids of the waiting files, or None for the planned order; list of int
+        :return: the makespan, then the sum of the times every file finishes; (int, int)
+        """
+        state = self._state.copy()
+        if order is not None:
+            state.queues[0] = list(order)
+        return state.run_until(inf), state.completion
+
+    def _replan(self):
+        """
+        Search for a better order of the first horizon waiting files, swapping two at a time and keeping every swap
+        that doesn't make the plan's makespan worse, until the budget of an arrival is used up. Plans with the same
+        makespan are common, so they are told apart by when the files finish on average, which also keeps files from
+        waiting long after they arrive.
+        """
+        plan = self._state.queues[0]
+        window = min(self.horizon, len(plan))
+        if window < 2:
+            return
+
+        control = RunControl(time_budget=self.time_budget, max_evaluations=self.max_evaluations)
+        control.start()
+        best = self._plan_score()
+        while not control.should_stop():
+            i, j = self._rng.sample(range(window), 2)
+            plan[i], plan[j] = plan[j], plan[i]
+            score = self._plan_score()
+            if score <= best:
+                best = score
+            else:
+                plan[i], plan[j] = plan[j], plan[i]
+            control.iteration()
+        self.evaluations += control.evaluations + 1
+
+    def _take(self):
+        """ Hand over the jobs started since the last call """
+        dispatched, self._dispatched = self._dispatched, []
+        return [Dispatch(start, end, sample, self.file_sizes[sample], step, self.cpus[step],
+                         self._state.memory[sample][step]) for start, end, sample, step in dispatched]
+
+
+class _OnlineState:
+    """
+    Where the online schedule is up to: the clock, the resources left, the running jobs and the files waiting for
+    each step. Copied to simulate a plan to the end without touching the schedule itself.
+    """
+
+    def __init__(self, max_cpus, max_memory, cpus):
+        """
+        Construct a new instance of class _OnlineState with nothing running or waiting.
+
+        :param max_cpus: the number of cores in the machine; int
+        :param max_memory: the memory limits of the machine; int
+        :param cpus: CPUs used by each step; list of int
+        """
+        self.t = 0
+        self.makespan = 0
+        self.completion = 0  # sum of the ends of the last steps started
+        self.available_cpus = max_cpus
+        self.available_mem = max_memory
+        self.running = []  # min-heap of (end time, sample, step) for running jobs
+        self.queues = [[] for step in cpus]  # samples waiting for each step
+        self.cpus = cpus
+        self.duration = []  # duration of each step of each sample
+        self.memory = []  # memory of each step of each sample
+
+    def copy(self):
+        """
+        Copy the state, sharing the job columns which only ever grow.
+
+        :return: the copy; _OnlineState
+        """
+        state = _OnlineState.__new__(_OnlineState)
+        state.__dict__.update(self.__dict__)
+        state.running = self.running.copy()
+        state.queues = [queue.copy() for queue in self.queues]
+        return state
+
+    def admit(self, dispatched=None):
+        """
+        Start every ready job that fits, step by step and in the order of each step's queue.
+
+        :param dispatched: where to add the (start, end, sample, step) of every job started, or None; list
+        """
+        last = len(self.queues) - 1
+        for step, queue in enumerate(self.queues):
+            step_cpus = self.cpus[step]
+            if not queue or step_cpus > self.available_cpus:
+                continue
+            kept = []
+            for sample in queue:
+                job_memory = self.memory[sample][step]
+                if step_cpus <= self.available_cpus and job_memory <= self.available_mem:
+                    self.available_cpus -= step_cpus
+                    self.available_mem -= job_memory
+                    end = self.t + self.duration[sample][step]
+                    heappush(self.running, (end, sample, step))
+                    if end > self.makespan:
+                        self.makespan = end
+                    if step == last:
+                        self.completion += end
+                    if dispatched is not None:
+                        dispatched.append((self.t, end, sample, step))
+                else:
+                    kept.append(sample)
+            self.queues[step] = kept
+
+    def run_until(self, limit, dispatched=None, admit_last=True):
+        """
+        Finish every job ending by a time, starting the jobs that fit after each end.
+
+        :param limit: the time to run to, inf to run until nothing is left; int
+        :param dispatched: where to add every job started, see admit, or None; list
+        :param admit_last: start the jobs that fit after the jobs ending at the limit finish, otherwise only finish
+        them; bool
+        :return: the latest end of every job started so far, the makespan once nothing is left; int
+        """
+        self.admit(dispatched)
+        running = self.running
+        while running and running[0][0] <= limit:
+            self.t = running[0][0]
+            while running and running[0][0] == self.t:
+                end, sample, step = heappop(running)
+                self.available_cpus += self.cpus[step]
+                self.available_mem += self.memory[sample][step]
+                if step + 1 < len(self.queues):
+                    insort(self.queues[step + 1], sample)
+            if self.t == limit and not admit_last:
+                break
+            self.admit(dispatched)
+        return self.makespan
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+import numpy as np
+
+# Pipeline loaded once into each worker process of a PoolEvaluator's own pool
+_worker_pipeline = None
+
+
+class PoolEvaluator:
+    """
+    Scores batches of schedules of a compiled pipeline in worker processes, each worker simulating one chunk of
+    the batch. Evaluation uses no randomness, so an optimizer gives the same results for a given seed whatever
+    the number of workers.
+    """
+
+    def __init__(self, pipeline, workers=None, executor=None):
+        """
+        Construct a new instance of class PoolEvaluator. With no executor a process pool is started and the
+        pipeline is sent to each worker once; with an executor the pipeline is sent along with every chunk since
+        its workers can't be initialized.
+
+        :param pipeline: the pipeline schedules are evaluated on; CompiledPipeline
+        :param workers: number of worker processes, or None for one per core; int
+        :param executor: an existing pool to submit chunks to instead of starting one; concurrent.futures.Executor
+        """
+        self.pipeline = pipeline
+        self.default_cpus = pipeline.default_cpus
+        self.own_executor = executor is None
+
+        if executor is None:
+            self.workers = workers or cpu_count()
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_load_pipeline, initargs=(pipeline,))
+        else:
+            self.workers = workers or getattr(executor, "_max_workers", None) or cpu_count()
+            self.executor = executor
+
+    def makespan(self, file_order, cpu_assignment=None):
+        """
+        Calculate the makespan of one schedule in this process, since it is not worth sending to a worker.
+
+        :param file_order: the file sizes in processing order; list of int
+        :param cpu_assignment: CPUs assigned to each task, or None for the CPUs set on the tasks; list of int
+        :return: the makespan, -1 if the schedule is impossible; int
+        """
+        return self.pipeline.makespan(file_order, cpu_assignment)
+
+    def makespan_batch(self, file_orders, cpu_assignments=None):
+        """
+        Calculate the makespans of many schedules, split into one chunk per worker.
+
+        :param file_orders: one ordering of the file sizes per schedule; 2-D array-like of int
+        :param cpu_assignments: CPUs assigned to each task per schedule, or None for the CPUs set on the tasks;
+        2-D array-like of int
+        :return: the makespan of each schedule, -1 where impossible; numpy array
+        """
+        file_orders = list(file_orders)
+        if cpu_assignments is None:
+            cpu_assignments = [self.default_cpus] * len(file_orders)
+        cpu_assignments = list(cpu_assignments)
+
+        chunk = max(1, -(-len(file_orders) // self.workers))  # ceiling division
+        pipeline = None if self.own_executor else self.pipeline
+        futures = [self.executor.submit(_evaluate_chunk, file_orders[i:i + chunk], cpu_assignments[i:i + chunk],
+                                        pipeline)
+                   for i in range(0, len(file_orders), chunk)]
+
+        results = [future.result() for future in futures]
+        return np.concatenate(results) if results else np.zeros(0, dtype=np.int64)
+
+    def close(self):
+        """ Shut down the worker processes if this evaluator started them """
+        if self.own_executor:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _load_pipeline(pipeline):
+    """
+    Worker initializer, keeps the pipeline for every chunk this worker evaluates.
+
+    :param pipeline: the pipeline schedules are evaluated on; CompiledPipeline
+    """
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+
+
+def _evaluate_chunk(file_orders, cpu_assignments, pipeline=None):
+    """
+    Worker task, calculates the makespans of one chunk of schedules.
+
+    :param file_orders: one ordering of the file sizes per schedule; list of lists of int
+    :param cpu_assignments: CPUs assigned to each task per schedule; list of lists of int
+    :param pipeline: the pipeline to use, or None for the one loaded when the worker started; CompiledPipeline
+    :return: the makespan of each schedule; numpy array
+    """
+    return (pipeline if pipeline is not None else _worker_pipeline).makespan_batch(file_orders, cpu_assignments)
@@ -0,0 +1,100 @@
+from collections import namedtuple
+from time import perf_counter
+
+import numpy as np
+
+# How a round of an optimizer went, see round_stats
+RoundStats = namedtuple("RoundStats", ["round", "best_makespan", "best_params", "mean_makespan", "worst_makespan",
+                                       "diversity", "evaluations", "evaluations_per_second", "gap"])
+
+
+def round_stats(round, makespans, best_makespan, best_params, diversity, control):
+    """
+    Summarize a round of an optimizer for its progress callback. Only called when there is a callback, so a run
+    without one spends nothing on statistics.
+
+    :param round: the number of the round, from 0; int
+    :param makespans: makespan of each individual scored in the round, -1 where impossible; list of int
+    :param best_makespan: the lowest makespan found so far; int
+    :param best_params: the parameters that achieved it, passed on as is so nothing is copied or formatted; any
+    :param diversity: fraction of the individuals in the round that are different, see diversity; float
+    :param control: the control of the run, for the evaluations and time so far and the lower bound; RunControl
+    :return: the statistics of the round; RoundStats
+    """
+    scores = np.asarray(makespans)
+    possible = scores[scores >= 0]
+    elapsed = control.elapsed()
+    return RoundStats(round=round,
+                      best_makespan=best_makespan,
+                      best_params=best_params,
+                      mean_makespan=float(possible.mean()) if possible.size else None,
+                      worst_makespan=possible.max().item() if possible.size else None,
+                      diversity=diversity,
+                      evaluations=control.evaluations,
+                      evaluations_per_second=control.evaluations / elapsed if elapsed > 0 else None,
+                      gap=control.gap())
+
+
+def diversity(*populations):
+    """
+    Fraction of the individuals of a population that are different from every other, 1 if they all are and
+    1 / size if they are all the same.
+
+    :param populations: the population, one individual per row, split into several arrays with the same number of
+    rows, e.g. file orders and CPUs; numpy arrays
+    :return: the fraction of distinct individuals; float
+    """
+    rows = np.concatenate([np.asarray(pop).reshape(len(pop), -1) for pop in populations], axis=1)
+    if len(rows) == 0:
+        return 0
+    # Hashing the bytes of each row is several times quicker than sorting the rows with np.unique
+    return len({row.tobytes() for row in rows}) / len(rows)
+
+
+class ProgressLog:
+    """
+    A progress callback that prints a line about a round at most every interval seconds, e.g.
+
+        GA_both(file_sizes, 200, 64, tasks, rounds=1000, pop_size=100, crossover_rate=0.9, mutation_rate=0.2,
+                progress=ProgressLog(interval=5))
+
+    Rounds in between are skipped without formatting anything, and the parameters of the best schedule, which can be
+    thousands of numbers long, are only printed when show_params is set.
+    """
+
+    def __init__(self, interval=1.0, show_params=False, file=None):
+        """
+        Construct a new instance of class ProgressLog.
+
+        :param interval: least seconds between two lines, 0 to print every round; float
+        :param show_params: also print the parameters of the best schedule; bool
+        :param file: where to print, or None for stdout; file object
+        """
+        self.interval = interval
+        self.show_params = show_params
+        self.file = file
+        self._last = None  # when the last line was printed
+
+    def __call__(self, stats):
+        """
+        Print a line about a round, unless one was printed less than interval seconds ago.
+
+        :param stats: the statistics of the round; RoundStats
+        """
+        now = perf_counter()
+        if self._last is not None and now - self._last < self.interval:
+            return
+        self._last = now
+
+        line = f"Round {stats.round}: best makespan {stats.best_makespan}"
+        if stats.mean_makespan is not None:
+            line += f", mean {stats.mean_makespan:.1f}, worst {stats.worst_makespan}"
+        if stats.diversity is not None:
+            line += f", {stats.diversity:.0%} distinct"
+        if stats.evaluations_per_second is not None:
+            line += f", {stats.evaluations_per_second:.0f} evaluations/s"
+        if stats.gap is not None:
+            line += f", gap {stats.gap:.1%}"
+        if self.show_params:
+            line += f" achieved with params {stats.best_params}"
+        print(line, file=self.file)
@@ -0,0 +1,279 @@
+from copy import deepcopy
+from math import inf
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from lower_bounds import optimality_gap
+
+
+class RunControl:
+    """
+    Decides when an optimizer stops and keeps the best schedule it has found so far. Every optimizer takes one as
+    its control argument and, after each iteration (a GA generation, an annealing temperature step, a schedule
+    tried by an exhaustive search), records its best schedule and asks whether to stop. A run stops when the time
+    budget or the evaluation budget is used up, when the best makespan has not improved for patience iterations,
+    when the best makespan reaches the lower bound so nothing better exists, or when stop is called, e.g. from
+    another thread, and the optimizer then returns the best schedule so far.
+
+    Another thread can poll best while the optimizer runs, and on_improvement is called with every new best
+    schedule as it is found. A control is meant for one run; start only sets the start time the first time it is
+    called, so optimizers that run others (restarts, one search per CPU assignment) share the budget.
+    """
+
+    def __init__(self, time_budget=None, max_evaluations=None, patience=None, min_improvement=0,
+                 on_improvement=None, parent=None, lower_bound=None):
+        """
+        Construct a new instance of class RunControl.
+
+        :param time_budget: seconds of wall-clock time the run may take, or None for no limit; float
+        :param max_evaluations: schedules the run may score, or None for no limit; int
+        :param patience: iterations in a row without improvement after which the run stops, or None to never
+        stop for that; int
+        :param min_improvement: how much lower a makespan must be to count as an improvement for patience; int
+        :param on_improvement: called with the makespan and parameters of every new best schedule; callable
+        :param parent: a control for the whole of a bigger run, e.g. of many restarts, that this run's schedules
+        and iterations are also reported to and that stops this run when it stops; RunControl
+        :param lower_bound: a makespan no schedule can beat, or None for the optimizer to set it from
+        lower_bounds when it starts; int
+        """
+        self.time_budget = time_budget
+        self.max_evaluations = max_evaluations
+        self.patience = patience
+        self.min_improvement = min_improvement
+        self.on_improvement = on_improvement
+        self.parent = parent
+        self.lower_bound = lower_bound
+
+        self.start_time = None
+        self.evaluations = 0
+        self.iterations = 0
+        self.stalled = 0  # iterations since the last improvement by at least min_improvement
+        self.stop_reason = None
+        self.best_makespan, self.best_params = inf, None
+
+        self._stall_makespan = inf  # best makespan when stalled was last reset
+        self._stop_requested = Event()
+        self._lock = Lock()
+
+    @property
+    def limited(self):
+        """ Whether the run stops on its own, i.e. it has a budget or a patience """
+        return self.time_budget is not None or self.max_evaluations is not None or self.patience is not None or \
+            (self.parent is not None and self.parent.limited)
+
+    def start(self):
+        """ Start the clock for the time budget, if it hasn't been started already """
+        if self.start_time is None:
+            self.start_time = perf_counter()
+        if self.parent is not None:
+            self.parent.start()
+
+    def elapsed(self):
+        """
+        Time since the run started.
+
+        :return: seconds since start was first called, 0 if it hasn't been; float
+        """
+        return 0 if self.start_time is None else perf_counter() - self.start_time
+
+    def remaining_time(self):
+        """
+        Time left of the time budget, of this run or a parent's if that is less.
+
+        :return: seconds left, never negative, or None if there is no time budget; float
+        """
+        remaining = None if self.time_budget is None else max(0, self.time_budget - self.elapsed())
+        if self.parent is not None:
+            parent_remaining = self.parent.remaining_time()
+            if remaining is None or (parent_remaining is not None and parent_remaining < remaining):
+                remaining = parent_remaining
+        return remaining
+
+    def progress(self):
+        """
+        How much of the budget is used up, the greater of the time and evaluations used, e.g. for a cooling
+        schedule.
+
+        :return: fraction of the budget used from 0 to 1, or None if there is no budget; float
+        """
+        fractions = []
+        if self.time_budget:
+            fractions.append(self.elapsed() / self.time_budget)
+        if self.max_evaluations:
+            fractions.append(self.evaluations / self.max_evaluations)
+        return min(max(fractions), 1) if fractions else None
+
+    def record(self, makespan, params):
+        """
+        Report a schedule found by the optimizer, keeping a copy of it if it is the best so far.
+
+        :param makespan: the makespan of the schedule, -1 if it is impossible; int
+        :param params: the parameters of the schedule, e.g. a file order; any
+        :return: whether the schedule is the best so far; bool
+        """
+        if makespan < 0 or makespan >= self.best_makespan:
+            return False
+
+        with self._lock:
+            self.best_makespan, self.best_params = makespan, deepcopy(params)
+        if self._stall_makespan - makespan >= self.min_improvement:
+            self._stall_makespan = makespan
+            self.stalled = -1  # the iteration this was found in doesn't count as stalled
+
+        if self.on_improvement is not None:
+            self.on_improvement(makespan, self.best_params)
+        if self.parent is not None:
+            self.parent.record(makespan, params)
+        return True
+
+    def iteration(self, evaluations=1):
+        """
+        Count the end of an iteration of the optimizer.
+
+        :param evaluations: number of schedules scored in the iteration; int
+        """
+        self.evaluations += evaluations
+        self.iterations += 1
+        self.stalled += 1
+        if self.parent is not None:
+            self.parent.iteration(evaluations)
+
+    def should_stop(self):
+        """
+        Check whether the optimizer should stop, setting stop_reason to why if so.
+
+        :return: whether to stop; bool
+        """
+        if self.stop_reason is None:
+            if self._stop_requested.is_set():
+                self.stop_reason = "stopped"
+            elif self.lower_bound is not None and self.best_makespan <= self.lower_bound:
+                self.stop_reason = "optimal"
+            elif self.time_budget is not None and self.elapsed() >= self.time_budget:
+                self.stop_reason = "time"
+            elif self.max_evaluations is not None and self.evaluations >= self.max_evaluations:
+                self.stop_reason = "evaluations"
+            elif self.patience is not None and self.stalled >= self.patience:
+                self.stop_reason = "stalled"
+            elif self.parent is not None and self.parent.should_stop():
+                self.stop_reason = self.parent.stop_reason
+        return self.stop_reason is not None
+
+    def gap(self):
+        """
+        How far the best makespan so far is from the lower bound, relative to the bound.
+
+        :return: the gap, e.g. 0.05 for 5% above the bound, or None if there is no bound or no schedule yet; float
+        """
+        if self.lower_bound is None or self.best_params is None:
+            return None
+        return optimality_gap(self.best_makespan, self.lower_bound)
+
+    def stop(self):
+        """ Ask the optimizer to stop after its current iteration, safe to call from any thread """
+        self._stop_requested.set()
+
+    def best(self):
+        """
+        The best schedule found so far, safe to call from any thread while the optimizer runs.
+
+        :return: the lowest makespan, inf if no schedule has been found, and the parameters that achieved it;
+        (int, any)
+        """
+        with self._lock:
+            return self.best_makespan, self.best_params
+
+
+class BackgroundRun:
+    """
+    An optimizer running in a thread of this process, so its best schedule can be polled or streamed while it
+    searches. The optimizer is given a control to report to, e.g.
+
+        run = BackgroundRun(GA_both, file_sizes, 200, 64, tasks, rounds=None, pop_size=100, crossover_rate=0.9,
+                            mutation_rate=0.2, control=RunControl(time_budget=30))
+        for makespan, params in run.improvements():
+            print(makespan, params)
+    """
+
+    def __init__(self, optimizer, *args, control=None, **kwargs):
+        """
+        Construct a new instance of class BackgroundRun and start the optimizer.
+
+        :param optimizer: the optimizer to run, e.g. GA_both; callable taking a control argument
+        :param args: positional arguments of the optimizer
+        :param control: when the optimizer stops, or None for a control with no limits; RunControl
+        :param kwargs: other keyword arguments of the optimizer
+        """
+        self.control = control if control is not None else RunControl()
+        self._improvements = Queue()
+        on_improvement = self.control.on_improvement
+
+        def stream(makespan, params):
+            self._improvements.put((makespan, params))
+            if on_improvement is not None:
+                on_improvement(makespan, params)
+
+        self.control.on_improvement = stream
+        self._result = self._error = None
+        self._thread = Thread(target=self._run, args=(optimizer, args, kwargs), daemon=True)
+        self._thread.start()
+
+    def _run(self, optimizer, args, kwargs):
+        """ Thread target, runs the optimizer and keeps its result or error """
+        try:
+            self._result = optimizer(*args, control=self.control, **kwargs)
+        except BaseException as error:
+            self._error = error
+        finally:
+            self._improvements.put(None)  # wakes up improvements to finish
+
+    def running(self):
+        """
+        Check whether the optimizer is still running.
+
+        :return: whether it is running; bool
+        """
+        return self._thread.is_alive()
+
+    def best(self):
+        """
+        The best schedule found so far.
+
+        :return: the lowest makespan, inf if no schedule has been found, and the parameters that achieved it;
+        (int, any)
+        """
+        return self.control.best()
+
+    def improvements(self, timeout=None):
+        """
+        Generate every new best schedule as the optimizer finds it, until it finishes. Meant to be iterated once.
+
+        :param timeout: seconds to wait for each improvement before giving up, or None to wait until the
+        optimizer finishes; float
+        :return: the makespan and parameters of each new best schedule; generator of (int, any)
+        """
+        while True:
+            try:
+                item = self._improvements.get(timeout=timeout)
+            except Empty:
+                return
+            if item is None:
+                return
+            yield item
+
+    def stop(self):
+        """ Ask the optimizer to stop after its current iteration """
+        self.control.stop()
+
+    def result(self, timeout=None):
+        """
+        Wait for the optimizer to finish.
+
+        :param timeout: seconds to wait, or None to wait until it finishes; float
+        :return: what the optimizer returned, or None if it is still running after timeout
+        """
+        self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
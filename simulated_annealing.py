@@ -1,6 +1,12 @@
 import math
 import calc_makespan as ms
+from cluster import ClusterPipeline
+from heuristics import best_heuristic
+from lower_bounds import cluster_lower_bound, pipeline_lower_bound
+from makespan_cache import MakespanCache
 import random as ran
+from concurrent.futures import ProcessPoolExecutor
+from run_control import RunControl
 from matplotlib import pyplot as plt
 
 def swap(sched, i, j):
@@ -41,7 +47,7 @@ def create_plot(jobs, max_memory, max_cpus, tasks, T=500, r=0.99, L=5, T_min = 0
 
 
 
-def simulated_annealing(jobs, max_memory, max_cpus, tasks, temp_arr=[], makespan_arr=[], T=500, r=0.99, L=5, T_min = 0.2):
+def simulated_annealing(jobs, max_memory, max_cpus, tasks, temp_arr=[], makespan_arr=[], T=500, r=0.99, L=5, T_min = 0.2, cache=None, control=None, heuristic_start=False):
   '''
   Simulated Annealing for heuristically solving the job shop 
   scheduling problem.
@@ -53,18 +59,41 @@ def simulated_annealing(jobs, max_memory, max_cpus, tasks, temp_arr=[], makespan
     should decrease between iterations). Must be positive and less than one
   L - number of positions swapped in each iteration
   T_min - the temperature at which a satisfactory ordering has been found
+  cache - makespans of orderings already scored on this pipeline (MakespanCache),
+    e.g. shared with other optimizer runs, looked up for the starting ordering and
+    every swap tried, and its compiled pipeline. A new cache is used if None
+  control - budget and stall rule to stop early by (RunControl), checked 
+    after every iteration, and where the current ordering is reported
+  heuristic_start - start from the best ordering of the constructive 
+    heuristics (see heuristics.best_heuristic) instead of the order of 
+    jobs, either the ones used by default or a list of their names
 
   returns - a heuristically-optimized ordering of jobs as a list
   '''
+  control = control if control is not None else RunControl()
+  control.start()
 
   frozen = False; #tracks if change occurs to the optimal makespan over the past few iterations
   s = jobs
-  make_span_s = ms.calc_makespan(s, max_memory, max_cpus, tasks)
+
+  #task durations and memory for every file are calculated once, every swap reuses them
+  if cache is None:
+    cache = MakespanCache(ms.CompiledPipeline(jobs, tasks, max_cpus, max_memory))
+  if heuristic_start:
+    s = best_heuristic(jobs, max_memory, max_cpus, tasks, pipeline=cache.pipeline,
+                       heuristics=None if heuristic_start is True else heuristic_start)[1]
+  if control.lower_bound is None:
+    control.lower_bound = pipeline_lower_bound(cache.pipeline)
+  make_span_s = cache.makespan(s)
 
   #abort if calc_makespan returns -1
   if make_span_s == -1:
     raise Exception("Trying to process inviable list of jobs")
 
+  #a swap only changes the schedule from when the earlier of the two files could start,
+  #so swaps are simulated from the last checkpoint before that
+  schedule = ms.CheckpointedSchedule(cache.pipeline, s)
+
   temp_arr.append(T)
   makespan_arr.append(make_span_s)
 
@@ -79,22 +108,24 @@ def simulated_annealing(jobs, max_memory, max_cpus, tasks, temp_arr=[], makespan
       i = ran.randint(0, len(jobs) - 1)
       j = ran.randint(0, len(jobs) - 1)
 
-      #swap elements and calculate makespan of s'
+      #calculate makespan of s', i.e. s with elements i and j swapped, unless
+      #it is cached. A swap scored here is kept by the schedule, so adopting it
+      #doesn't simulate it again
       s_prime = swap(s, i, j)
-      make_span_s_prime = ms.calc_makespan(s_prime, max_memory, max_cpus, tasks)
+      make_span_s_prime = cache.makespan(s_prime, evaluate=lambda: schedule.swap_makespan(i, j))
       
       #calculate and store change in makespan
       del_energy_state = make_span_s - make_span_s_prime
 
       if del_energy_state > 0:  # if s' makespan < s makespan, adopt s' as the 
         s = s_prime             #current minimum value
-        make_span_s = make_span_s_prime
+        make_span_s = schedule.swap(i, j)
       elif del_energy_state < 0:
         p = math.exp(-del_energy_state / T)
         random = ran.uniform(0, 1)
         if random > p:     #if s' makespan > s makespan, adopt s' as the
-          s = s_prime           #current minimum makespan upon a certain probablility
-          make_span_s = make_span_s_prime #this prevents us from getting stuck in local minima
+          s = s_prime      #current minimum makespan upon a certain probablility
+          make_span_s = schedule.swap(i, j) #this prevents us from getting stuck in local minima
       
       is_not_frozen += del_energy_state
       count += 1
@@ -111,10 +142,359 @@ def simulated_annealing(jobs, max_memory, max_cpus, tasks, temp_arr=[], makespan
     temp_arr.append(T)
     makespan_arr.append(make_span_s)
 
+    control.record(make_span_s, s)
+    control.iteration(count)
+    if control.should_stop():
+      frozen = True
+
   return s
 
 
 
+def joint_annealing(jobs, max_memory, max_cpus, tasks, time_budget=None, max_evaluations=10000, restarts=1,
+                    workers=None, cpu_move_rate=0.2, epoch=None, seed=None, cache=None, control=None,
+                    heuristic_start=False):
+  '''
+  Simulated Annealing over both the file order and the CPUs assigned 
+  to each task. Each move either swaps two files or changes the CPUs of 
+  one task. Instead of a fixed cooling rate, the temperature is adjusted 
+  after every epoch of moves so the share of uphill moves accepted 
+  follows a target that falls from 50% to 1% over the budget of the run.
+
+  params:
+  jobs - an array of jobs whose order is being optimized
+  time_budget - seconds of wall-clock time the whole search may take, 
+    or None for the control's time budget, if any
+  max_evaluations - schedules scored per restart, or None to only limit 
+    the time. One of the time budgets and max_evaluations must be set
+  restarts - number of independent runs, each from its own shuffled 
+    ordering, the best of which is returned
+  workers - number of processes the restarts are run in, or None to 
+    run them one after another in this process
+  cpu_move_rate - share of moves that change the CPUs of a task rather 
+    than swap two files
+  epoch - number of moves between temperature updates, or None for the 
+    number of files plus the number of tasks
+  seed - seed for the random moves; without a time budget the same seed 
+    gives the same result with any number of workers
+  cache - makespans of orderings already scored on this pipeline (MakespanCache), 
+    used for its compiled pipeline. A new cache is used if None
+  control - budget and stall rule for the whole search (RunControl), where 
+    the best schedule so far is reported. Restarts run in this process 
+    check it after every epoch and report every new best schedule; 
+    restarts run by workers are only reported when they finish
+  heuristic_start - start the first restart from the best ordering of the 
+    constructive heuristics (see heuristics.best_heuristic) instead of the 
+    order of jobs, either the ones used by default or a list of their names
+
+  returns - the lowest makespan found and the ordering of jobs and 
+    assignment of CPUs to tasks that achieved it, as [ordering, cpus]
+  '''
+  control = control if control is not None else RunControl()
+  control.start()
+  if time_budget is None:
+    time_budget = control.remaining_time()
+  if time_budget is None and max_evaluations is None:
+    raise Exception("Joint annealing needs a time budget or a number of evaluations")
+
+  if cache is None:
+    cache = MakespanCache(ms.CompiledPipeline(jobs, tasks, max_cpus, max_memory))
+  pipeline = cache.pipeline
+  if control.lower_bound is None:
+    control.lower_bound = pipeline_lower_bound(pipeline, any_cpus=True)
+
+  #start from the CPUs set on the tasks, within what the machine has
+  cpus = [min(max(task.cpus, 1), max_cpus) for task in tasks]
+  if cache.makespan(jobs, cpus) == -1:
+    raise Exception("Trying to process inviable list of jobs")
+  start = jobs
+  if heuristic_start:
+    start = best_heuristic(jobs, max_memory, max_cpus, tasks, cpus, pipeline,
+                           None if heuristic_start is True else heuristic_start)[1]
+
+  #restarts running at the same time share the time budget's wall-clock time
+  if time_budget is not None:
+    time_budget = time_budget * min(workers or 1, restarts) / restarts
+
+  rng = ran.Random(seed)
+  runs = [(pipeline, start, cpus, time_budget, max_evaluations, cpu_move_rate, epoch, rng.getrandbits(64), run > 0,
+           control.lower_bound) for run in range(restarts)]
+  if workers is None:
+    results = []
+    for run in runs:
+      results.append(_anneal_run(*run, parent=control))
+      if control.should_stop():
+        break
+  else:
+    with ProcessPoolExecutor(workers) as executor:
+      results = []
+      for result in executor.map(_anneal_run, *zip(*runs)):
+        control.record(result[0], result[1])
+        control.iteration(result[2])
+        results.append(result)
+
+  #the earliest restart wins ties, so the result does not depend on the workers
+  best_makespan, best_params, evaluations = min(results, key=lambda result: result[0])
+  return best_makespan, best_params
+
+
+def _anneal_run(pipeline, jobs, cpus, time_budget, max_evaluations, cpu_move_rate, epoch, seed, shuffle,
+                lower_bound=None, parent=None):
+  '''
+  One run of joint_annealing.
+
+  params:
+  pipeline - the compiled pipeline schedules are scored on
+  jobs - the starting ordering of jobs
+  cpus - the starting assignment of CPUs to tasks
+  shuffle - whether to start from a random ordering of jobs instead
+  seed - seed for the random moves of this run
+  lower_bound - makespan at which the run stops, as nothing can beat it
+  parent - control of the whole search (RunControl), or None
+  (the rest as in joint_annealing)
+
+  returns - the lowest makespan found, the ordering of jobs and 
+    assignment of CPUs that achieved it as [ordering, cpus], and the 
+    number of schedules scored
+  '''
+  control = RunControl(time_budget, max_evaluations, parent=parent, lower_bound=lower_bound)
+  control.start()
+
+  rng = ran.Random(seed)
+  s = list(jobs)
+  if shuffle:
+    rng.shuffle(s)
+  cpus = list(cpus)
+  n = len(s)
+  num_tasks = len(cpus)
+  epoch = epoch or max(1, n + num_tasks)
+  max_evaluations = math.inf if max_evaluations is None else max_evaluations
+
+  schedule = ms.CheckpointedSchedule(pipeline, s, cpus)
+  make_span_s = schedule.makespan
+  control.record(make_span_s, [s, cpus])
+  can_swap = n > 1
+  can_change_cpus = num_tasks > 0 and pipeline.max_cpus > 1
+  if not can_swap and not can_change_cpus:
+    return control.best_makespan, control.best_params, 1
+
+  def propose():
+    '''
+    Picks a random move and scores it, returning the move and its makespan 
+    (infinite if the schedule is impossible). A move of CPUs comes with the 
+    schedule it was scored on, so accepting it doesn't simulate it again
+    '''
+    if can_change_cpus and (not can_swap or rng.random() < cpu_move_rate):
+      k = rng.randrange(num_tasks)
+      step = rng.randint(1, max(1, pipeline.max_cpus // 4))
+      c = cpus[k] + (step if rng.random() < 0.5 else -step)
+      c = min(max(c, 1), pipeline.max_cpus)
+      if c == cpus[k]:
+        c = cpus[k] - 1 if cpus[k] > 1 else cpus[k] + 1
+      cpus_prime = cpus.copy()
+      cpus_prime[k] = c
+      schedule_prime = ms.CheckpointedSchedule(pipeline, s, cpus_prime)
+      make_span = schedule_prime.makespan
+      move = (None, cpus_prime, schedule_prime)
+    else:
+      i, j = rng.sample(range(n), 2)
+      make_span = schedule.swap_makespan(i, j)
+      move = ((i, j), None, None)
+    return move, math.inf if make_span == -1 else make_span
+
+  #starting temperature at which half of the uphill moves around the 
+  #starting schedule would be accepted, from moves counted against the budget
+  warm_up = min(epoch, max_evaluations)
+  uphill = []
+  for _ in range(warm_up):
+    make_span_s_prime = propose()[1]
+    if make_span_s < make_span_s_prime < math.inf:
+      uphill.append(make_span_s_prime - make_span_s)
+  evaluations = warm_up
+  control.iteration(warm_up)
+  T = (sum(uphill) / len(uphill) if uphill else 1) / math.log(2)
+
+  while not control.should_stop():
+
+    uphill = 0
+    accepted = 0
+    moves = 0
+    while moves < epoch and evaluations < max_evaluations:
+      (swapped, cpus_prime, schedule_prime), make_span_s_prime = propose()
+      evaluations += 1
+      moves += 1
+
+      del_energy_state = make_span_s_prime - make_span_s
+      if del_energy_state > 0:
+        if del_energy_state == math.inf:
+          continue
+        uphill += 1
+        if rng.random() >= math.exp(-del_energy_state / T):
+          continue
+        accepted += 1
+
+      if swapped is not None:
+        s = swap(s, *swapped)
+        make_span_s = schedule.swap(*swapped)
+      else:
+        cpus = cpus_prime
+        schedule = schedule_prime
+        make_span_s = schedule.makespan
+      control.record(make_span_s, [s, cpus])
+
+    #aim to accept fewer uphill moves the further through the budget the run 
+    #is, heating up if too few were accepted and cooling down if too many were
+    control.iteration(moves)
+    target = 0.5 * 0.02 ** control.progress()
+    if uphill:
+      T = T * 0.9 if accepted / uphill > target else T / 0.9
+
+  return control.best_makespan, control.best_params, evaluations
+
+
+def cluster_annealing(jobs, nodes, tasks, time_budget=None, max_evaluations=10000, transfer_factor=0,
+                      cpu_move_rate=0.2, place_move_rate=0.4, epoch=None, seed=None, control=None):
+  '''
+  Simulated Annealing over the file order, the CPUs assigned to each task 
+  and the node each job runs on, for a cluster of nodes (see 
+  cluster.calc_cluster_makespan). Each move swaps two files, which take 
+  their nodes along, changes the CPUs of one task, or places jobs of a 
+  file elsewhere: either one of its jobs, or all of them on one node so 
+  the file doesn't have to move between steps. Jobs are only placed on 
+  nodes with enough memory for them. The temperature follows the same 
+  target share of accepted uphill moves as joint_annealing.
+
+  params:
+  jobs - an array of jobs whose order is being optimized
+  nodes - the machines of the cluster (list of Node)
+  transfer_factor - time units to move a file size of 1 unit from one 
+    node to another
+  place_move_rate - share of moves that place jobs on other nodes
+  control - budget and stall rule for the search (RunControl), checked 
+    after every epoch, and where every new best schedule is reported
+  (the rest as in joint_annealing)
+
+  returns - the lowest makespan found and the ordering of jobs, 
+    assignment of CPUs to tasks and placement of the tasks of each job 
+    that achieved it, as [ordering, cpus, placement]
+  '''
+  control = control if control is not None else RunControl()
+  control.start()
+  if time_budget is None:
+    time_budget = control.remaining_time()
+  if time_budget is None and max_evaluations is None:
+    raise Exception("Cluster annealing needs a time budget or a number of evaluations")
+
+  cluster = ClusterPipeline(jobs, tasks, nodes, transfer_factor)
+  if control.lower_bound is None:
+    control.lower_bound = cluster_lower_bound(cluster)
+  run = RunControl(time_budget, max_evaluations, parent=control, lower_bound=control.lower_bound)
+  run.start()
+
+  rng = ran.Random(seed)
+  s = list(jobs)
+  n = len(s)
+  num_tasks = len(tasks)
+  cpus = [min(max(task.cpus, 1), cluster.max_cpus) for task in tasks]
+  epoch = epoch or max(1, n + num_tasks)
+  max_evaluations = math.inf if max_evaluations is None else max_evaluations
+
+  #the nodes each task of a job of each size fits on, and the ones every 
+  #task of it fits on
+  fits = cluster.fits(sorted(set(s)))
+  where = {size: [[k for k in range(len(nodes)) if fits[m, i, k]] for i in range(num_tasks)]
+           for m, size in enumerate(sorted(set(s)))}
+  if any(not options for task_options in where.values() for options in task_options):
+    raise Exception("Trying to process inviable list of jobs")
+  local = {size: [k for k in range(len(nodes)) if fits[m, :, k].all()] for m, size in enumerate(sorted(set(s)))}
+
+  #start every job on the node with the most memory it fits on
+  place = [[max(options, key=lambda k: cluster.node_memory[k]) for options in where[size]] for size in s]
+  make_span_s = cluster.makespan(s, cpus, place)
+  if make_span_s == -1:
+    raise Exception("Trying to process inviable list of jobs")
+  run.record(make_span_s, [s, cpus, place])
+
+  can_swap = n > 1
+  can_change_cpus = num_tasks > 0 and cluster.max_cpus > 1
+  can_place = n > 0 and num_tasks > 0 and len(nodes) > 1
+  if not can_swap and not can_change_cpus and not can_place:
+    return run.best_makespan, run.best_params
+
+  def propose():
+    '''
+    Picks a random move and scores it, returning the ordering, CPUs and 
+    placement after the move and their makespan (infinite if the 
+    schedule is impossible)
+    '''
+    s_prime, cpus_prime, place_prime = s, cpus, place
+    kind = rng.random()
+    if can_place and (kind < place_move_rate or not (can_swap or can_change_cpus)):
+      j = rng.randrange(n)
+      place_prime = place.copy()
+      if rng.random() < 0.5 or not local[s[j]]:
+        i = rng.randrange(num_tasks)
+        place_prime[j] = place[j].copy()
+        place_prime[j][i] = rng.choice(where[s[j]][i])
+      else:
+        place_prime[j] = [rng.choice(local[s[j]])] * num_tasks
+    elif can_change_cpus and (not can_swap or kind < place_move_rate + cpu_move_rate):
+      k = rng.randrange(num_tasks)
+      step = rng.randint(1, max(1, cluster.max_cpus // 4))
+      c = min(max(cpus[k] + (step if rng.random() < 0.5 else -step), 1), cluster.max_cpus)
+      if c == cpus[k]:
+        c = cpus[k] - 1 if cpus[k] > 1 else cpus[k] + 1
+      cpus_prime = cpus.copy()
+      cpus_prime[k] = c
+    else:
+      i, j = rng.sample(range(n), 2)
+      s_prime, place_prime = swap(s, i, j), swap(place, i, j)
+    make_span = cluster.makespan(s_prime, cpus_prime, place_prime)
+    return (s_prime, cpus_prime, place_prime), math.inf if make_span == -1 else make_span
+
+  #starting temperature at which half of the uphill moves around the 
+  #starting schedule would be accepted, see _anneal_run
+  warm_up = min(epoch, max_evaluations)
+  uphill = []
+  for _ in range(warm_up):
+    make_span_s_prime = propose()[1]
+    if make_span_s < make_span_s_prime < math.inf:
+      uphill.append(make_span_s_prime - make_span_s)
+  evaluations = warm_up
+  run.iteration(warm_up)
+  T = (sum(uphill) / len(uphill) if uphill else 1) / math.log(2)
+
+  while not run.should_stop():
+
+    uphill = 0
+    accepted = 0
+    moves = 0
+    while moves < epoch and evaluations < max_evaluations:
+      move, make_span_s_prime = propose()
+      evaluations += 1
+      moves += 1
+
+      del_energy_state = make_span_s_prime - make_span_s
+      if del_energy_state > 0:
+        if del_energy_state == math.inf:
+          continue
+        uphill += 1
+        if rng.random() >= math.exp(-del_energy_state / T):
+          continue
+        accepted += 1
+
+      s, cpus, place = move
+      make_span_s = make_span_s_prime
+      run.record(make_span_s, [s, cpus, place])
+
+    run.iteration(moves)
+    target = 0.5 * 0.02 ** run.progress()
+    if uphill:
+      T = T * 0.9 if accepted / uphill > target else T / 0.9
+
+  return run.best_makespan, run.best_params
+
+
 if __name__ == "__main__":
 
   ### TESTING TESTING TESTING TESTING TESTING ###
@@ -136,6 +516,7 @@ if __name__ == "__main__":
   print(out2)
   print(ms.calc_makespan(jobs2, 64, 16, [task_a, task_b]))
   print(ms.calc_makespan(simulated_annealing(jobs2, 64, 16, [task_a, task_b]), 64, 16, [task_a, task_b]))
+  print(joint_annealing(jobs2, 64, 16, [task_a, task_b], time_budget=5, max_evaluations=None, restarts=4, workers=4))
 
   #create_plot(jobs2, 64, 16, [task_a, task_b])
 
@@ -1,4 +1,4 @@
-from itertools import permutations, product
+from itertools import product
 from math import inf
 import numpy as np
 from random import sample
@@ -6,7 +6,9 @@ import timeit
 from functools import partial
 from matplotlib import pyplot as plt
 
-from calc_makespan import calc_makespan, PipelineTask
+from calc_makespan import CompiledPipeline, PipelineTask
+from lower_bounds import pipeline_lower_bound
+from run_control import RunControl
 
 
 def main():
@@ -67,7 +69,7 @@ def main():
     plt.savefig("timing_brute_force.png")
 
 
-def brute_force_order(file_sizes, max_memory, max_cpus, tasks):
+def brute_force_order(file_sizes, max_memory, max_cpus, tasks, cache=None, control=None):
     """
     Try all possible input orders of the given file_sizes to determine optimal order. Return the optimal makespan and
     the parameters that achieved it.
@@ -76,22 +78,35 @@ def brute_force_order(file_sizes, max_memory, max_cpus, tasks):
     :param max_memory: the memory limits of the machine; int
     :param max_cpus: the number of cores in the machine; int
     :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
-    :return: the optimal makespan and the parameters used; (int, list of int)
+    :param cache: makespans of schedules already scored on this pipeline to reuse and add to, or None to simulate
+    every order; MakespanCache
+    :param control: budget to stop early by, checked after every order, and where the best order so far is
+    reported, or None to try every order; RunControl
+    :return: the optimal makespan and the parameters used, the best found if stopped early; (int, list of int)
     """
-    file_order_perms = list(set(permutations(file_sizes)))  # get all unique permutations of the input files
+    pipeline = cache if cache is not None else CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    control = control if control is not None else RunControl()
+    control.start()
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(cache.pipeline if cache is not None else pipeline)
     best_makespan = inf
     best_order = None
 
-    for file_order in file_order_perms:
-        makespan = calc_makespan(file_sizes=file_order, max_memory=max_memory, max_cpus=max_cpus, tasks=tasks)
+    for file_order in distinct_permutations(file_sizes):
+        makespan = pipeline.makespan(file_order)
         if makespan < best_makespan:
             best_makespan = makespan
             best_order = file_order
+            control.record(best_makespan, best_order)
+
+        control.iteration()
+        if control.should_stop():
+            break
 
     return best_makespan, best_order
 
 
-def brute_force_cpus(file_sizes, max_memory, max_cpus, tasks):
+def brute_force_cpus(file_sizes, max_memory, max_cpus, tasks, cache=None, control=None):
     """
     Try all possible task cpu assignments. Return the optimal makespan and the parameters that achieved it.
 
@@ -99,27 +114,37 @@ def brute_force_cpus(file_sizes, max_memory, max_cpus, tasks):
     :param max_memory: the memory limits of the machine; int
     :param max_cpus: the number of cores in the machine; int
     :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
-    :return: the optimal makespan and the parameters used; (int, tuple of int)
+    :param cache: makespans of schedules already scored on this pipeline to reuse and add to, or None to simulate
+    every assignment; MakespanCache
+    :param control: budget to stop early by, checked after every assignment, and where the best assignment so far is
+    reported, or None to try every assignment; RunControl
+    :return: the optimal makespan and the parameters used, the best found if stopped early; (int, tuple of int)
     """
 
     cpu_assns = product(*[range(1, max_cpus + 1) for task in tasks])  # each task can use between 1 and the max cpus
+    pipeline = cache if cache is not None else CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    control = control if control is not None else RunControl()
+    control.start()
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(cache.pipeline if cache is not None else pipeline, any_cpus=True)
     best_makespan = inf
     best_cpu_assn = None  # optimal assignment of cpus to tasks
 
     for cpu_assn in cpu_assns:
-        # Set each task's reserved cpus
-        for i, task in enumerate(tasks):
-            task.cpus = cpu_assn[i]
-
-        makespan = calc_makespan(file_sizes=file_sizes, max_memory=max_memory, max_cpus=max_cpus, tasks=tasks)
+        makespan = pipeline.makespan(file_sizes, cpu_assn)
         if makespan < best_makespan:
             best_makespan = makespan
             best_cpu_assn = cpu_assn
+            control.record(best_makespan, best_cpu_assn)
+
+        control.iteration()
+        if control.should_stop():
+            break
 
     return best_makespan, best_cpu_assn
 
 
-def brute_force(file_sizes, max_memory, max_cpus, tasks):
+def brute_force(file_sizes, max_memory, max_cpus, tasks, cache=None, control=None):
     """
     Try all possible input orders of the given file_sizes and all possible task cpu assignments.
     Return the optimal makespan and the parameters that achieved it.
@@ -128,11 +153,21 @@ def brute_force(file_sizes, max_memory, max_cpus, tasks):
     :param max_memory: the memory limits of the machine; int
     :param max_cpus: the number of cores in the machine; int
     :param tasks: a list of tasks to be completed for each file in the order listed; list of PipelineTask
-    :return: the optimal makespan and the parameters used; (int, tuple of tuples of ints)
+    :param cache: makespans of schedules already scored on this pipeline to reuse and add to, or None to simulate
+    every schedule; MakespanCache
+    :param control: budget to stop early by, checked after every schedule, and where the best schedule so far is
+    reported, or None to try every schedule; RunControl
+    :return: the optimal makespan and the parameters used, the best found if stopped early; (int, tuple of tuples
+    of ints)
     """
-    file_order_perms = list(set(permutations(file_sizes)))  # get all unique permutations of the input files
-    cpu_assns = product(*[range(1, max_cpus + 1) for task in tasks])  # each task can use between 1 and the max cpus
-    all_params = product(file_order_perms, cpu_assns)  # file_sizes! * max_cpus^num_tasks possible solutions
+    cpu_ranges = [range(1, max_cpus + 1) for task in tasks]  # each task can use between 1 and the max cpus
+    all_params = ((file_order, cpu_assn)  # up to file_sizes! * max_cpus^num_tasks possible solutions
+                  for file_order in distinct_permutations(file_sizes) for cpu_assn in product(*cpu_ranges))
+    pipeline = cache if cache is not None else CompiledPipeline(file_sizes, tasks, max_cpus, max_memory)
+    control = control if control is not None else RunControl()
+    control.start()
+    if control.lower_bound is None:
+        control.lower_bound = pipeline_lower_bound(cache.pipeline if cache is not None else pipeline, any_cpus=True)
 
     best_makespan = inf
     best_params = None
@@ -141,17 +176,48 @@ def brute_force(file_sizes, max_memory, max_cpus, tasks):
         file_order = params[0]
         cpu_assn = params[1]
 
-        # Set each task's reserved cpus
-        for i, task in enumerate(tasks):
-            task.cpus = cpu_assn[i]
-
-        makespan = calc_makespan(file_sizes=file_order, max_memory=max_memory, max_cpus=max_cpus, tasks=tasks)
+        makespan = pipeline.makespan(file_order, cpu_assn)
         if makespan < best_makespan:
             best_makespan = makespan
             best_params = params
+            control.record(best_makespan, best_params)
+
+        control.iteration()
+        if control.should_stop():
+            break
 
     return best_makespan, best_params
 
 
+def distinct_permutations(items):
+    """
+    Generate every distinct ordering of items in lexicographic order, one at a time. Orderings that only swap equal
+    items are generated once, so n items with repeats give n! / (k1! * k2! * ...) orderings, and only the current
+    ordering is kept in memory.
+
+    :param items: the items to order, e.g. file sizes; list of int
+    :return: each distinct ordering; generator of tuple
+    """
+    order = sorted(items)
+    n = len(order)
+
+    while True:
+        yield tuple(order)
+
+        # Find the last item smaller than the one after it, everything after it is in descending order
+        i = n - 2
+        while i >= 0 and order[i] >= order[i + 1]:
+            i -= 1
+        if i < 0:
+            return  # the items are in descending order, the last ordering
+
+        # Swap it with the last item larger than it, then put everything after it back in ascending order
+        j = n - 1
+        while order[j] <= order[i]:
+            j -= 1
+        order[i], order[j] = order[j], order[i]
+        order[i + 1:] = reversed(order[i + 1:])
+
+
 if __name__ == "__main__":
     main()